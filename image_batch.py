@@ -0,0 +1,237 @@
+"""Пакетная обработка изображений без графического интерфейса.
+
+Пример:
+    python image_batch.py "photos/*.jpg" -o out -p auto_contrast
+        -p color_balance:red_cyan=10 -p resize:width=800 --format png
+
+Операции (-p) применяются по порядку; параметры задаются как
+имя:ключ=значение,ключ=значение. Подряд идущие поточечные операции
+выполняются одним проходом (см. image_pipeline). Файлы обрабатываются
+параллельно в нескольких процессах.
+"""
+
+import argparse
+import ast
+import glob
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+import image_export
+import image_ops
+from image_pipeline import Pipeline
+
+
+def parse_operation(spec):
+    """Разбирает 'имя:ключ=значение,...' в (имя, параметры)"""
+    name, _, args = spec.partition(":")
+    if name not in image_ops.OPERATIONS:
+        raise argparse.ArgumentTypeError(f"неизвестная операция: {name}")
+
+    params = {}
+    for item in filter(None, args.split(",")):
+        key, _, value = item.partition("=")
+        try:
+            params[key.strip()] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            # Строковые значения можно писать без кавычек
+            params[key.strip()] = value.strip()
+    return name, params
+
+
+def collect_files(patterns):
+    """Раскрывает шаблоны путей (с поддержкой **) в отсортированный список"""
+    files = set()
+    for pattern in patterns:
+        matches = glob.glob(pattern, recursive=True)
+        files.update(path for path in matches if os.path.isfile(path))
+    return sorted(files)
+
+
+def common_root(files):
+    """Общая папка исходных файлов"""
+    folders = [os.path.dirname(os.path.abspath(path)) for path in files]
+    return os.path.commonpath(folders)
+
+
+def output_path(path, output_dir, image_format, root=None):
+    """Путь результата в output_dir с новым расширением.
+
+    Если задан root, структура папок исходного файла относительно root
+    повторяется в output_dir (файлы с одинаковыми именами из разных папок
+    не перезаписывают друг друга).
+    """
+    stem, extension = os.path.splitext(os.path.basename(path))
+    if image_format:
+        extension = "." + image_format.lower()
+    folder = output_dir
+    if root is not None:
+        relative = os.path.relpath(os.path.dirname(os.path.abspath(path)), root)
+        folder = os.path.normpath(os.path.join(output_dir, relative))
+    return os.path.join(folder, stem + extension)
+
+
+def process_file(path, target, chain, image_format, save_options, preset=None):
+    """Обрабатывает один файл в процессе пула.
+
+    Возвращает (путь, мегапиксели, секунды, текст ошибки или None).
+    """
+    start = time.perf_counter()
+    try:
+        with Image.open(path) as img:
+            img.load()
+            megapixels = img.width * img.height / 1e6
+            result = Pipeline(chain).run(img)
+            options = save_options
+            if preset:
+                # Метаданные переносятся из исходного файла по правилам профиля
+                options = image_export.export_options(
+                    preset,
+                    image_ops.image_format_for(target, image_format),
+                    img.info,
+                    **save_options,
+                )
+            image_ops.save_image(result, target, image_format, **options)
+    except Exception as e:
+        return path, 0.0, time.perf_counter() - start, str(e)
+    return path, megapixels, time.perf_counter() - start, None
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Пакетная обработка изображений без графического интерфейса"
+    )
+    parser.add_argument("inputs", nargs="+", help="файлы или шаблоны (*.jpg, **/*.png)")
+    parser.add_argument("-o", "--output", required=True, help="папка для результатов")
+    parser.add_argument(
+        "-p",
+        "--op",
+        dest="chain",
+        action="append",
+        type=parse_operation,
+        default=[],
+        help="операция имя[:ключ=значение,...]; можно указать несколько раз",
+    )
+    parser.add_argument(
+        "-f", "--format", help="формат результата (png, jpg, webp, ico...)"
+    )
+    parser.add_argument("-q", "--quality", type=int, help="качество JPEG/WebP")
+    parser.add_argument(
+        "--preset",
+        choices=list(image_export.PRESETS),
+        help="профиль экспорта для png, jpg, webp, avif (см. image_export)",
+    )
+    parser.add_argument(
+        "--ico-sizes",
+        default="16,32,48,256",
+        help="размеры иконок через запятую (для формата ico)",
+    )
+    parser.add_argument(
+        "-j", "--workers", type=int, default=os.cpu_count(), help="число процессов"
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="показать доступные операции и выйти"
+    )
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    if argv is None:
+        argv = sys.argv[1:]
+    if "--list" in argv:
+        for name, operation in image_ops.OPERATIONS.items():
+            print(f"{name:18} {operation.__doc__.splitlines()[0]}")
+        return 0
+
+    args = parser.parse_args(argv)
+    files = collect_files(args.inputs)
+    if not files:
+        print("Нет файлов для обработки", file=sys.stderr)
+        return 1
+
+    os.makedirs(args.output, exist_ok=True)
+    save_options = {}
+    if args.quality is not None:
+        save_options["quality"] = args.quality
+    image_format = args.format.upper() if args.format else None
+    if image_format == "ICO":
+        save_options["sizes"] = [int(size) for size in args.ico_sizes.split(",")]
+
+    root = common_root(files)
+    jobs = []
+    sources = {}
+    for path in files:
+        target = output_path(path, args.output, image_format, root)
+        if os.path.abspath(target) == os.path.abspath(path):
+            print(f"Пропуск {path}: результат перезаписал бы исходный файл")
+            continue
+        key = os.path.normcase(os.path.abspath(target))
+        if key in sources:
+            # Параллельные задачи с одним результатом затерли бы друг друга
+            print(
+                f"Файлы {sources[key]} и {path} записываются в один {target}; "
+                "разнесите их по разным папкам",
+                file=sys.stderr,
+            )
+            return 1
+        sources[key] = path
+        jobs.append((path, target))
+    if not jobs:
+        return 1
+    if args.preset:
+        # Профиль задает параметры не всех форматов: проверяем до запуска пула
+        formats = {
+            image_ops.image_format_for(target, image_format) for _, target in jobs
+        }
+        unsupported = sorted(formats - set(image_export.available_formats()))
+        if unsupported:
+            print(
+                f"Профиль {args.preset} не поддерживает формат "
+                f"{', '.join(unsupported)}; доступны: "
+                f"{', '.join(image_export.available_formats())}",
+                file=sys.stderr,
+            )
+            return 1
+    for folder in {os.path.dirname(target) for _, target in jobs}:
+        os.makedirs(folder, exist_ok=True)
+
+    start = time.perf_counter()
+    total_megapixels = 0.0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [
+            executor.submit(
+                process_file,
+                path,
+                target,
+                args.chain,
+                image_format,
+                save_options,
+                args.preset,
+            )
+            for path, target in jobs
+        ]
+        for done, future in enumerate(as_completed(futures), 1):
+            path, megapixels, seconds, error = future.result()
+            if error:
+                failed += 1
+                print(f"[{done}/{len(jobs)}] Ошибка {path}: {error}", file=sys.stderr)
+            else:
+                total_megapixels += megapixels
+                print(f"[{done}/{len(jobs)}] {path} ({seconds:.2f} с)")
+
+    elapsed = time.perf_counter() - start
+    processed = len(jobs) - failed
+    print(
+        f"Готово: {processed} файлов, ошибок: {failed}, время {elapsed:.2f} с, "
+        f"{processed / elapsed:.1f} файлов/с, {total_megapixels / elapsed:.1f} Мп/с"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,82 @@
+"""Кэш декодированных изображений в памяти с ограничением по объему"""
+
+import os
+import threading
+from collections import OrderedDict
+
+
+def file_key(path):
+    """Ключ файла: путь, время изменения и размер.
+
+    Перезаписанный файл получает новый ключ, поэтому устаревшая запись
+    кэша не будет найдена.
+    """
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+class MemoryCache:
+    """LRU-кэш с ограничением по суммарному объему значений.
+
+    sizeof(value) возвращает объем значения в байтах. При превышении бюджета
+    вытесняются записи, к которым дольше всего не обращались.
+    """
+
+    def __init__(self, memory_budget, sizeof):
+        self.memory_budget = memory_budget
+        self.sizeof = sizeof
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Возвращает значение (и отмечает его как недавно использованное)"""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        """Добавляет значение; слишком большие для бюджета не сохраняются"""
+        size = self.sizeof(value)
+        with self.lock:
+            self.discard_locked(key)
+            if size > self.memory_budget:
+                return False
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            self.evict(self.memory_budget)
+            return True
+
+    def discard(self, key):
+        with self.lock:
+            self.discard_locked(key)
+
+    def discard_locked(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+
+    def set_budget(self, memory_budget):
+        """Меняет бюджет памяти, вытесняя лишние записи"""
+        with self.lock:
+            self.memory_budget = memory_budget
+            self.evict(memory_budget)
+
+    def evict(self, memory_budget):
+        while self.total_bytes > memory_budget and self.entries:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+
+    def clear(self):
+        with self.lock:
+            self.evict(0)
@@ -0,0 +1,144 @@
+"""Преобразования между QImage, NumPy и PIL без лишних копий.
+
+Каждое преобразование стоит не больше одной копии пикселей: там, где формат
+памяти совпадает, возвращается представление (view) чужого буфера.
+"""
+
+import numpy as np
+from PyQt6 import sip
+from PyQt6.QtGui import QImage, QPixmap
+from PIL import Image
+
+
+# Режимы PIL, память которых совпадает с форматом QImage
+MODE_FORMATS = {
+    "L": QImage.Format.Format_Grayscale8,
+    "RGB": QImage.Format.Format_RGB888,
+    "RGBA": QImage.Format.Format_RGBA8888,
+}
+
+# Число байт на пиксель для форматов, которые можно представить массивом
+FORMAT_CHANNELS = {
+    QImage.Format.Format_Grayscale8: 1,
+    QImage.Format.Format_RGB888: 3,
+    QImage.Format.Format_RGBA8888: 4,
+    QImage.Format.Format_RGBA8888_Premultiplied: 4,
+    QImage.Format.Format_RGBX8888: 4,
+    QImage.Format.Format_ARGB32: 4,
+    QImage.Format.Format_ARGB32_Premultiplied: 4,
+    QImage.Format.Format_RGB32: 4,
+}
+
+
+def qimage_to_array(qimg, writable=False):
+    """Возвращает NumPy-представление памяти QImage.
+
+    Данные не копируются, поэтому QImage должен жить дольше полученного
+    массива. При writable=True изменения массива сразу видны в QImage.
+    Для Grayscale8 массив двумерный, для остальных форматов - (h, w, c).
+    Форматы ARGB32/RGB32 хранятся как BGRA (порядок байт little-endian).
+    """
+    channels = FORMAT_CHANNELS.get(qimg.format())
+    if channels is None:
+        raise ValueError(f"Неподдерживаемый формат QImage: {qimg.format()}")
+
+    width, height = qimg.width(), qimg.height()
+    bytes_per_line = qimg.bytesPerLine()
+
+    ptr = qimg.bits() if writable else qimg.constBits()
+    ptr.setsize(qimg.sizeInBytes())
+    buffer = np.frombuffer(ptr, dtype=np.uint8).reshape(height, bytes_per_line)
+
+    # Отбрасываем выравнивание строк, не копируя данные
+    pixels = buffer[:, : width * channels]
+    if channels == 1:
+        return pixels
+    return pixels.reshape(height, width, channels)
+
+
+def array_to_qimage(pixels, image_format):
+    """Создает QImage поверх памяти массива (без копирования).
+
+    Строки массива могут идти с шагом (например, срез с выравниванием),
+    но пиксели внутри строки должны лежать подряд. Массив должен жить дольше
+    QImage; для независимой копии используйте QPixmap.fromImage
+    или QImage.copy.
+    """
+    height, width = pixels.shape[:2]
+    channels = pixels.shape[2] if pixels.ndim == 3 else 1
+    if pixels.strides[1:] != ((channels, 1) if pixels.ndim == 3 else (1,)):
+        pixels = np.ascontiguousarray(pixels)
+
+    address = sip.voidptr(pixels.ctypes.data)
+    qimg = QImage(address, width, height, pixels.strides[0], image_format)
+    # Держим ссылку на массив, пока жив QImage
+    qimg.array = pixels
+    return qimg
+
+
+def array_to_pixmap(pixels):
+    """Конвертирует массив L (h, w), RGB или RGBA (h, w, c) в QPixmap"""
+    channels = pixels.shape[2] if pixels.ndim == 3 else 1
+    image_format = {1: "L", 3: "RGB", 4: "RGBA"}[channels]
+    return QPixmap.fromImage(array_to_qimage(pixels, MODE_FORMATS[image_format]))
+
+
+def pil_to_qimage(img):
+    """Возвращает QImage с пикселями PIL-изображения.
+
+    Режимы L, RGB и RGBA копируются один раз (в массив NumPy, поверх которого
+    создается QImage), остальные сначала приводятся к RGB или RGBA.
+    """
+    if img.mode not in MODE_FORMATS:
+        img = img.convert("RGBA" if "A" in img.getbands() else "RGB")
+    return array_to_qimage(np.asarray(img), MODE_FORMATS[img.mode])
+
+
+def pil_to_pixmap(img):
+    """Конвертирует PIL-изображение в QPixmap"""
+    return QPixmap.fromImage(pil_to_qimage(img))
+
+
+def qimage_to_pil(qimg):
+    """Возвращает PIL-изображение с пикселями QImage.
+
+    Изображения с альфа-каналом и Grayscale8 разделяют память с QImage
+    (RGBA, L; другие форматы с альфой сначала приводятся к RGBA8888 -
+    одна копия). Непрозрачные RGB32, RGBX8888 и RGB888 распаковываются
+    в RGB одной копией прямо из буфера QImage.
+    """
+    # Непрозрачные форматы -> режим распаковки PIL (RGB32 хранится как BGRX)
+    opaque_modes = {
+        QImage.Format.Format_RGB32: "BGRX",
+        QImage.Format.Format_RGBX8888: "RGBX",
+        QImage.Format.Format_RGB888: "RGB",
+    }
+    if qimg.format() == QImage.Format.Format_Grayscale8:
+        mode = raw_mode = "L"
+    elif qimg.hasAlphaChannel():
+        if qimg.format() != QImage.Format.Format_RGBA8888:
+            qimg = qimg.convertToFormat(QImage.Format.Format_RGBA8888)
+        mode = raw_mode = "RGBA"
+    else:
+        if qimg.format() not in opaque_modes:
+            qimg = qimg.convertToFormat(QImage.Format.Format_RGB32)
+        mode, raw_mode = "RGB", opaque_modes[qimg.format()]
+
+    ptr = qimg.constBits()
+    ptr.setsize(qimg.sizeInBytes())
+    buffer = np.frombuffer(ptr, dtype=np.uint8)
+
+    size = (qimg.width(), qimg.height())
+    if mode == "RGB":
+        # Распаковка в RGB - единственная копия пикселей
+        return Image.frombytes(
+            mode, size, buffer, "raw", raw_mode, qimg.bytesPerLine(), 1
+        )
+
+    img = Image.frombuffer(
+        mode, size, buffer, "raw", raw_mode, qimg.bytesPerLine(), 1
+    )
+
+    # Держим ссылку на QImage, пока жив PIL-образ, разделяющий его память
+    img.qimage = qimg
+    return img
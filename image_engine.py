@@ -0,0 +1,474 @@
+"""Вычислительные ядра обработки изображений (NumPy/OpenCV, без Qt)"""
+
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import cv2
+
+
+# Кэш сеток cv2.remap для эффектов смещения:
+# (эффект, размер, положение, параметры) -> (map_x, map_y)
+remap_cache = OrderedDict()
+REMAP_CACHE_BYTES = 256 * 1024 * 1024
+# Кэшем пользуются рабочие потоки JobQueue из разных полос
+remap_cache_lock = threading.Lock()
+
+# Наибольшее число значений в стопке окон отпечатков (см. dab_alpha)
+DAB_BATCH = 1 << 22
+# Площадь окна, начиная с которой отпечатки выгоднее считать по одному
+DAB_LOOP_AREA = 48 * 48
+
+
+def color_mask(pixels, color, tolerance=0):
+    """Возвращает маску пикселей, близких к color.
+
+    Сравниваются первые len(color) каналов: пиксель попадает в маску, если
+    каждый канал отличается от color не больше чем на tolerance.
+    """
+    mask = np.ones(pixels.shape[:2], dtype=bool)
+    for channel, key in enumerate(color):
+        # |c - key| <= tolerance  <=>  key - tolerance <= c <= key + tolerance;
+        # сравниваем прямо в uint8 без промежуточных int16-массивов
+        values = pixels[:, :, channel]
+        low = int(key) - tolerance
+        high = int(key) + tolerance
+        if low > 0:
+            mask &= values >= low
+        if high < 255:
+            mask &= values <= high
+    return mask
+
+
+def background_mask(rgba, color=(255, 255, 255), tolerance=15, edge_connected=False):
+    """Возвращает булеву маску пикселей фона.
+
+    Пиксель считается фоном, если каждый его канал RGB отличается от color
+    меньше чем на tolerance. В режиме edge_connected остаются только области
+    фона, связанные с краями изображения (как заливка от границ).
+    """
+    mask = color_mask(rgba, color, tolerance - 1)
+
+    if edge_connected and mask.any():
+        count, labels = cv2.connectedComponents(mask.view(np.uint8), connectivity=4)
+        border_labels = np.concatenate(
+            (labels[0], labels[-1], labels[:, 0], labels[:, -1])
+        )
+        # Таблица "метка -> касается края"; метка 0 - это не фон
+        keep = np.zeros(count, dtype=bool)
+        keep[border_labels] = True
+        keep[0] = False
+        mask = keep[labels]
+
+    return mask
+
+
+def remove_background(
+    rgba, color=(255, 255, 255), tolerance=15, feather=0, edge_connected=False
+):
+    """Делает фон прозрачным и возвращает новый RGBA-массив.
+
+    feather - радиус растушевки края маски в пикселях (0 - жесткий край).
+    """
+    mask = background_mask(rgba, color, tolerance, edge_connected)
+    result = rgba.copy()
+
+    if feather > 0:
+        # Мягкая маска: размываем бинарную маску и гасим альфу пропорционально
+        soft = cv2.GaussianBlur(mask.astype(np.float32), (0, 0), sigmaX=feather)
+        np.maximum(soft, mask, out=soft)
+        alpha = result[:, :, 3].astype(np.float32) * (1.0 - soft)
+        result[:, :, 3] = np.clip(alpha + 0.5, 0, 255).astype(np.uint8)
+
+    # Пиксели фона заменяем на прозрачный цвет фона. Запись идет через
+    # представление uint32 (один пиксель RGBA - одно слово), что на порядок
+    # быстрее булевой индексации по трем каналам
+    transparent = np.array((*color, 0), dtype=np.uint8).view(np.uint32)[0]
+    pixels = result.view(np.uint32).reshape(mask.shape)
+    np.copyto(pixels, transparent, where=mask)
+    return result
+
+
+def shadow_layer(rgba, opacity=0.5):
+    """Возвращает черный RGBA-слой тени по альфа-каналу изображения"""
+    shadow = np.zeros_like(rgba)
+    shadow[:, :, 3] = (rgba[:, :, 3] * opacity).astype(np.uint8)
+    return shadow
+
+
+def flood_fill_mask(rgba, seed, tolerance=0, connectivity=4, region_mask=None):
+    """Возвращает маску области заливки от точки seed = (x, y).
+
+    Сначала векторно отбираются пиксели, близкие к цвету затравки (RGBA, с
+    допуском tolerance), затем cv2.floodFill выделяет связную компоненту,
+    содержащую seed. region_mask ограничивает заливку (например, выделением).
+    """
+    x, y = seed
+    similar = color_mask(rgba, rgba[y, x], tolerance)
+    if region_mask is not None:
+        similar &= region_mask
+
+    # Заливаем бинарную картинку "похож/не похож": поиск связной области идет
+    # в C++ по строкам, без Python-цикла по пикселям
+    seed_mask = np.zeros((similar.shape[0] + 2, similar.shape[1] + 2), np.uint8)
+    flags = connectivity | cv2.FLOODFILL_MASK_ONLY | (1 << 8)
+    cv2.floodFill(
+        similar.view(np.uint8), seed_mask, (int(x), int(y)), 1, 0, 0, flags
+    )
+    return seed_mask[1:-1, 1:-1].view(bool)
+
+
+def fill_mask(rgba, mask, color):
+    """Закрашивает пиксели по маске цветом RGBA на месте"""
+    value = np.array(color, dtype=np.uint8).view(np.uint32)[0]
+    pixels = rgba.view(np.uint32).reshape(mask.shape)
+    np.copyto(pixels, value, where=mask)
+
+
+def dab_alpha(height, width, centers, radius, hardness=0.5, batch=DAB_BATCH):
+    """Общая непрозрачность мягких отпечатков кисти в области (h, w).
+
+    centers - центры отпечатков (N, 2) в координатах области. Край отпечатка
+    плавно спадает от hardness * radius до radius. Отпечатки складываются
+    как при последовательном наложении: 1 - П(1 - a_i), поэтому порядок
+    отпечатков не важен и их можно считать одной порцией.
+
+    Окна отпечатков считаются стопкой (N, s, s) одним выражением порциями
+    не больше batch значений. Окна крупной кисти считаются по одному:
+    там работа над окном важнее накладных расходов цикла.
+    """
+    keep = np.ones((height, width), np.float32)
+    centers = np.asarray(centers, dtype=np.float64).reshape(-1, 2)
+    reach = int(np.ceil(radius)) + 1
+    falloff = max(radius * (1 - hardness), 1e-3)
+    window = np.arange(-reach, reach)
+
+    if window.size**2 > DAB_LOOP_AREA:
+        for x, y in centers:
+            left, top = max(int(x) - reach, 0), max(int(y) - reach, 0)
+            right, bottom = min(int(x) + reach, width), min(int(y) + reach, height)
+            if left >= right or top >= bottom:
+                continue
+            ys, xs = np.ogrid[top:bottom, left:right]
+            distance = np.sqrt((xs + 0.5 - x) ** 2 + (ys + 0.5 - y) ** 2)
+            alpha = np.clip((radius - distance) / falloff, 0, 1, dtype=np.float32)
+            keep[top:bottom, left:right] *= 1 - alpha
+        return 1 - keep
+
+    count = max(1, batch // window.size**2)
+    flat = keep.reshape(-1)
+
+    for start in range(0, len(centers), count):
+        x, y = centers[start : start + count].T
+        # Строки и столбцы окон (N, s) вокруг целой части центров
+        cols = x.astype(np.int64)[:, None] + window
+        rows = y.astype(np.int64)[:, None] + window
+        # Расстояние от центра пикселя до центра отпечатка
+        distance = np.sqrt(
+            ((rows + 0.5 - y[:, None]) ** 2)[:, :, None]
+            + ((cols + 0.5 - x[:, None]) ** 2)[:, None, :]
+        )
+        alpha = np.clip((radius - distance) / falloff, 0, 1, dtype=np.float32)
+
+        inside = ((rows >= 0) & (rows < height))[:, :, None] & (
+            (cols >= 0) & (cols < width)
+        )[:, None, :]
+        index = rows[:, :, None] * width + cols[:, None, :]
+        # Окна перекрываются: множители одного пикселя накапливаются по очереди
+        np.multiply.at(flat, index[inside], 1 - alpha[inside])
+    return 1 - keep
+
+
+def blend(target, source, alpha):
+    """Смешивает source с target на месте с непрозрачностью alpha (h, w)"""
+    weight = alpha[..., None] if target.ndim == 3 else alpha
+    mixed = target + (source.astype(np.float32) - target) * weight
+    np.copyto(target, np.rint(mixed), casting="unsafe")
+
+
+def channel_histograms(pixels):
+    """Гистограммы цветовых каналов: массив (каналы, 256).
+
+    Для полутонового изображения - один канал, альфа-канал не учитывается.
+    """
+    if pixels.ndim == 2:
+        pixels = pixels[:, :, np.newaxis]
+    channels = min(pixels.shape[2], 3)
+    source = np.ascontiguousarray(pixels)
+    return np.stack(
+        [
+            cv2.calcHist([source], [channel], None, [256], [0, 256]).ravel()
+            for channel in range(channels)
+        ]
+    ).astype(np.float64)
+
+
+def remap_histograms(histograms, lut):
+    """Пересчитывает гистограммы каналов после применения таблицы lut"""
+    lut = np.broadcast_to(lut, histograms.shape)
+    return np.stack(
+        [
+            np.bincount(table, weights=histogram, minlength=256)
+            for table, histogram in zip(lut, histograms)
+        ]
+    )
+
+
+def apply_lut(pixels, lut):
+    """Применяет таблицы к цветовым каналам, возвращает новый массив.
+
+    lut - (1, 256) для всех каналов или (каналы, 256) для каждого своя;
+    альфа-канал не меняется.
+    """
+    lut = np.asarray(lut, dtype=np.uint8)
+    if pixels.ndim == 2:
+        return cv2.LUT(pixels, lut[0])
+
+    channels = pixels.shape[2]
+    tables = np.empty((channels, 256), dtype=np.uint8)
+    tables[:] = np.arange(256, dtype=np.uint8)
+    color = min(channels, 3)
+    tables[:color] = np.broadcast_to(lut, (color, 256))
+    # cv2.LUT с многоканальной таблицей: форма (1, 256, каналы)
+    return cv2.LUT(
+        np.ascontiguousarray(pixels), np.ascontiguousarray(tables.T[np.newaxis])
+    )
+
+
+def autocontrast_lut(histograms, cutoff=0):
+    """Таблицы автоконтраста по каналам (как ImageOps.autocontrast).
+
+    cutoff - процент самых темных и самых светлых пикселей, которые
+    не учитываются при поиске диапазона.
+    """
+    levels = np.arange(256, dtype=np.float64)
+    tables = []
+    for histogram in histograms:
+        total = histogram.sum()
+        cut = int(total * cutoff // 100) if cutoff else 0
+        # Первый и последний уровни, остающиеся после отсечения cut пикселей
+        low = np.flatnonzero(np.cumsum(histogram) > cut)
+        high = np.flatnonzero(np.cumsum(histogram[::-1]) > cut)
+        if not len(low) or not len(high) or 255 - high[0] <= low[0]:
+            tables.append(levels.astype(np.uint8))
+            continue
+        lo, hi = low[0], 255 - high[0]
+        scale = 255.0 / (hi - lo)
+        table = np.clip(np.floor(levels * scale - lo * scale), 0, 255)
+        tables.append(table.astype(np.uint8))
+    return np.stack(tables)
+
+
+def color_balance_lut(histograms, red_cyan=0, green_magenta=0, blue_yellow=0):
+    """Таблицы цветового баланса: сдвиг каналов R, G, B в процентах.
+
+    Полутоновое изображение не меняется.
+    """
+    levels = np.arange(256, dtype=np.float32)
+    if len(histograms) == 1:
+        return levels.astype(np.uint8)[np.newaxis]
+    shifts = (red_cyan, green_magenta, blue_yellow)[: len(histograms)]
+    return np.stack(
+        [np.clip(levels + shift * 2.55, 0, 255).astype(np.uint8) for shift in shifts]
+    )
+
+
+# Веса каналов при переходе RGB -> L (ITU-R 601, как в PIL и OpenCV)
+GRAY_WEIGHTS = (0.299, 0.587, 0.114)
+
+
+def enhance_lut(histograms, brightness=1.0, contrast=1.0, weights=None):
+    """Общая таблица (1, 256) для яркости и контрастности.
+
+    Повторяет семантику ImageEnhance: контраст тянет значения от средней
+    яркости изображения, уже измененного яркостью. Средняя яркость
+    считается по гистограммам: по одной полутоновой или по гистограммам
+    R, G, B с весами weights.
+    """
+    levels = np.arange(256, dtype=np.float32)
+    bright = np.clip(levels * brightness + 0.5, 0, 255).astype(np.uint8)
+
+    if weights is None:
+        weights = GRAY_WEIGHTS if len(histograms) == 3 else (1.0,)
+    mean = sum(
+        weight * (histogram * bright).sum() / max(1.0, histogram.sum())
+        for weight, histogram in zip(weights, histograms)
+    )
+    mean = int(mean + 0.5)
+
+    lut = (bright.astype(np.float32) - mean) * contrast + mean
+    return np.clip(lut + 0.5, 0, 255).astype(np.uint8)[np.newaxis]
+
+
+def saturate(pixels, saturation=1.0):
+    """Насыщенность: смешивание цвета с его оттенком серого.
+
+    Работает с RGB и RGBA (альфа-канал не меняется), возвращает новый массив.
+    """
+    result = pixels.copy()
+    if pixels.ndim == 2 or saturation == 1.0:
+        return result
+
+    rgb = np.ascontiguousarray(pixels[:, :, :3])
+    gray = cv2.cvtColor(cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY), cv2.COLOR_GRAY2RGB)
+    result[:, :, :3] = cv2.addWeighted(rgb, saturation, gray, 1.0 - saturation, 0)
+    return result
+
+
+def enhance(pixels, brightness=1.0, contrast=1.0, saturation=1.0):
+    """Яркость, контрастность и насыщенность за один проход по LUT.
+
+    Работает с RGB и RGBA (альфа-канал не меняется), возвращает новый массив.
+    """
+    result = pixels
+    if brightness != 1.0 or contrast != 1.0:
+        # Средняя яркость - по гистограммам каналов, как и в цепочках
+        # image_pipeline: редактор и пакетная обработка дают одни пиксели
+        histograms = channel_histograms(pixels)
+        result = apply_lut(pixels, enhance_lut(histograms, brightness, contrast))
+    return saturate(result, saturation)
+
+
+def add_noise(pixels, sigma=25, seed=None, origin=(0, 0)):
+    """Добавляет гауссов шум к цветовым каналам (альфа-канал не меняется).
+
+    origin - положение фрагмента в кадре: при обработке по тайлам каждый тайл
+    получает свой поток случайных чисел, производный от seed.
+    """
+    rng = np.random.default_rng(None if seed is None else (seed, *origin))
+    channels = min(pixels.shape[2], 3) if pixels.ndim == 3 else None
+    color = pixels if channels is None else pixels[:, :, :channels]
+
+    noise = rng.standard_normal(color.shape, dtype=np.float32)
+    noise *= sigma
+    noise += color
+    np.clip(noise, 0, 255, out=noise)
+
+    result = pixels.copy()
+    if channels is None:
+        result[...] = noise
+    else:
+        result[:, :, :channels] = noise
+    return result
+
+
+def sketch(gray, blur_radius=21):
+    """Эффект карандашного рисунка для полутонового изображения.
+
+    Основа осветляется размытым негативом (color dodge):
+    result = gray * 255 / (255 - blur).
+    """
+    blur = cv2.GaussianBlur(cv2.bitwise_not(gray), (0, 0), blur_radius)
+    # Избегаем деления на ноль, как и прежде: 255 -> 254
+    denominator = cv2.bitwise_not(np.minimum(blur, 254))
+    return cv2.divide(gray, denominator, scale=255)
+
+
+def cached_maps(key, build):
+    """Возвращает сетки cv2.remap из кэша, строя их при промахе.
+
+    Кэш общий для всех эффектов смещения и ограничен REMAP_CACHE_BYTES:
+    при переполнении удаляются давно не использованные сетки. Сетки
+    строятся вне блокировки, поэтому потоки не ждут друг друга на build.
+    """
+    with remap_cache_lock:
+        maps = remap_cache.get(key)
+        if maps is not None:
+            remap_cache.move_to_end(key)
+            return maps
+
+    maps = build()
+    with remap_cache_lock:
+        remap_cache[key] = maps
+        total = sum(
+            map_x.nbytes + map_y.nbytes for map_x, map_y in remap_cache.values()
+        )
+        while len(remap_cache) > 1 and total > REMAP_CACHE_BYTES:
+            _, (map_x, map_y) = remap_cache.popitem(last=False)
+            total -= map_x.nbytes + map_y.nbytes
+    return maps
+
+
+def displace(pixels, maps, interpolation=cv2.INTER_LINEAR):
+    """Переносит пиксели по сеткам смещения (map_x, map_y).
+
+    Точки за краем берутся с края - так же, как при обрезке координат.
+    """
+    map_x, map_y = maps
+    return cv2.remap(
+        pixels, map_x, map_y, interpolation, borderMode=cv2.BORDER_REPLICATE
+    )
+
+
+def glass_maps(height, width, radius, seed, origin):
+    """Сетки эффекта стекла: случайные целые смещения в пределах radius"""
+    rng = np.random.default_rng(None if seed is None else (seed, *origin))
+    map_x = np.arange(width, dtype=np.float32)[np.newaxis, :] + rng.integers(
+        -radius, radius + 1, (height, width)
+    ).astype(np.float32)
+    map_y = np.arange(height, dtype=np.float32)[:, np.newaxis] + rng.integers(
+        -radius, radius + 1, (height, width)
+    ).astype(np.float32)
+    return map_x, map_y
+
+
+def glass(pixels, radius=5, seed=None, origin=(0, 0)):
+    """Эффект стекла: каждый пиксель берется из случайной соседней точки.
+
+    Сетки кэшируются только при заданном seed (при seed=None узор
+    каждый раз новый).
+    """
+    height, width = pixels.shape[:2]
+
+    def build():
+        return glass_maps(height, width, radius, seed, origin)
+
+    if seed is None:
+        maps = build()
+    else:
+        maps = cached_maps(("glass", height, width, *origin, radius, seed), build)
+    return displace(pixels, maps, cv2.INTER_NEAREST)
+
+
+def wave_maps(height, width, amplitude, frequency, origin):
+    """Сетки эффекта волн в координатах фрагмента, начинающегося в origin"""
+    top, left = origin
+    y = np.arange(top, top + height, dtype=np.float32)
+    x = np.arange(left, left + width, dtype=np.float32)
+
+    # x' = x + A * sin(f * y), y' = y + A * sin(f * x): каждая сетка - сумма
+    # строки и столбца, синус считается один раз на строку или столбец
+    shift_x = amplitude * np.sin(frequency * y)
+    shift_y = amplitude * np.sin(frequency * x)
+    # Сетки считаются в координатах кадра и только потом сдвигаются в
+    # координаты фрагмента: вычитание целого сдвига точно, поэтому тайлы
+    # получают те же значения, что и обработка целого кадра
+    map_x = x[np.newaxis, :] + shift_x[:, np.newaxis] - np.float32(left)
+    map_y = y[:, np.newaxis] + shift_y[np.newaxis, :] - np.float32(top)
+    return map_x, map_y
+
+
+def wave(pixels, amplitude=20, frequency=0.05, origin=(0, 0)):
+    """Эффект волн: синусоидальное смещение по обеим осям.
+
+    origin - положение фрагмента в кадре (при обработке по тайлам волна
+    считается в координатах кадра).
+    """
+    height, width = pixels.shape[:2]
+    maps = cached_maps(
+        ("wave", height, width, *origin, amplitude, frequency),
+        lambda: wave_maps(height, width, amplitude, frequency, origin),
+    )
+    return displace(pixels, maps)
+
+
+# Ядра, которые можно выполнять по тайлам: функция -> радиус перекрытия
+# тайлов в пикселях в зависимости от параметров ядра. С таким перекрытием
+# результат тайла совпадает с обработкой целого кадра
+TILE_HALO = {
+    add_noise: lambda sigma=25, seed=None: 0,
+    sketch: lambda blur_radius=21: math.ceil(3 * blur_radius) + 1,
+    glass: lambda radius=5, seed=None: radius,
+    wave: lambda amplitude=20, frequency=0.05: math.ceil(abs(amplitude)) + 2,
+}
@@ -0,0 +1,150 @@
+"""Профили экспорта: параметры кодировщиков PNG, JPEG, WebP и AVIF.
+
+Профиль задает для каждого формата параметры PIL.Image.save (уровень
+и стратегию zlib, optimize, прогрессивный JPEG, прореживание цветности,
+качество и скорость WebP/AVIF) и политику метаданных. compare_presets
+кодирует текущее изображение всеми профилями в памяти и сообщает время
+кодирования и размер результата.
+"""
+
+import io
+import time
+import zlib
+
+from PIL import Image, features
+
+import image_ops
+
+
+# Форматы экспорта: имя PIL -> расширение файла
+FORMATS = {"PNG": ".png", "JPEG": ".jpg", "WEBP": ".webp", "AVIF": ".avif"}
+
+# Профили: параметры save по форматам; metadata - сохранять EXIF и ICC
+PRESETS = {
+    "fast": {
+        "metadata": True,
+        "PNG": {"compress_level": 1},
+        "JPEG": {"quality": 85, "subsampling": "4:2:0"},
+        "WEBP": {"quality": 80, "method": 0},
+        "AVIF": {"quality": 70, "speed": 10},
+    },
+    "balanced": {
+        "metadata": True,
+        "PNG": {"compress_level": 6},
+        "JPEG": {"quality": 85, "optimize": True, "subsampling": "4:2:0"},
+        "WEBP": {"quality": 80, "method": 4},
+        "AVIF": {"quality": 70, "speed": 6},
+    },
+    "quality": {
+        "metadata": True,
+        "PNG": {"compress_level": 6},
+        "JPEG": {"quality": 95, "optimize": True, "subsampling": "4:4:4"},
+        "WEBP": {"quality": 95, "method": 4, "exact": True},
+        "AVIF": {"quality": 90, "speed": 6, "subsampling": "4:4:4"},
+    },
+    "web": {
+        "metadata": False,
+        # Фильтрованная стратегия zlib лучше подходит для фотографий
+        "PNG": {"compress_level": 9, "compress_type": zlib.Z_FILTERED},
+        "JPEG": {
+            "quality": 82,
+            "optimize": True,
+            "progressive": True,
+            "subsampling": "4:2:0",
+        },
+        "WEBP": {"quality": 78, "method": 5},
+        "AVIF": {"quality": 60, "speed": 6},
+    },
+    "smallest": {
+        "metadata": False,
+        "PNG": {"optimize": True},
+        "JPEG": {
+            "quality": 75,
+            "optimize": True,
+            "progressive": True,
+            "subsampling": "4:2:0",
+        },
+        "WEBP": {"quality": 70, "method": 6},
+        "AVIF": {"quality": 50, "speed": 2},
+    },
+}
+
+
+def available_formats():
+    """Форматы экспорта, поддерживаемые установленной сборкой Pillow"""
+    return [
+        image_format
+        for image_format in FORMATS
+        if image_format in ("PNG", "JPEG") or features.check(image_format.lower())
+    ]
+
+
+def read_metadata(path):
+    """EXIF и профиль ICC файла (пустой словарь, если файл не читается)"""
+    try:
+        with Image.open(path) as img:
+            return {
+                key: img.info[key]
+                for key in ("exif", "icc_profile")
+                if img.info.get(key)
+            }
+    except (OSError, ValueError):
+        return {}
+
+
+def export_options(preset, image_format, info=None, **overrides):
+    """Параметры save для формата по профилю preset.
+
+    info - словарь метаданных исходного файла (Image.info); EXIF и профиль
+    ICC из него переносятся, если профиль сохраняет метаданные. overrides
+    заменяют значения профиля.
+    """
+    if preset not in PRESETS:
+        raise ValueError(f"Неизвестный профиль экспорта: {preset}")
+    if image_format not in available_formats():
+        raise ValueError(f"Формат {image_format} недоступен для экспорта")
+
+    profile = PRESETS[preset]
+    options = dict(profile[image_format])
+    if profile["metadata"]:
+        for key in ("exif", "icc_profile"):
+            if info and info.get(key):
+                options[key] = info[key]
+    else:
+        # PIL по умолчанию переносит профиль ICC открытого изображения
+        options["icc_profile"] = None
+    options.update(overrides)
+    return options
+
+
+def compare_presets(image, image_format, info=None, presets=None, progress=None):
+    """Кодирует изображение всеми профилями в память.
+
+    Возвращает список (профиль, размер в байтах, секунды кодирования).
+    progress(i, total) вызывается после каждого профиля; исключение из
+    него прерывает сравнение.
+    """
+    presets = list(presets or PRESETS)
+    img = image_ops.flatten_for_format(image, image_format)
+    results = []
+    for index, preset in enumerate(presets):
+        options = export_options(preset, image_format, info)
+        buffer = io.BytesIO()
+        start = time.perf_counter()
+        img.save(buffer, image_format, **options)
+        results.append((preset, buffer.tell(), time.perf_counter() - start))
+        if progress is not None:
+            progress(index + 1, len(presets))
+    return results
+
+
+def format_report(results):
+    """Текстовый отчет сравнения профилей: размер, время и доля от наибольшего"""
+    largest = max(size for _, size, _ in results)
+    lines = []
+    for preset, size, seconds in results:
+        lines.append(
+            f"{preset:10} {size / 1024:10.1f} КБ {seconds:8.3f} с "
+            f"{size / largest:7.0%}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,254 @@
+"""История изменений на основе тайлов: хранятся только измененные участки.
+
+Кроме изображения холста история ведет его слои: пиксели каждого слоя
+хранятся так же, разницей тайлов, а состав и свойства слоев - как
+непрозрачное для истории состояние (state), которое сохраняется в шаге
+целиком.
+"""
+
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class HistoryStep:
+    """Один шаг истории: тайлы до и после операции в сжатом виде.
+
+    Форма None означает, что поверхности (слоя) до или после шага нет.
+    """
+
+    def __init__(self, shape_before, shape_after):
+        self.shape_before = shape_before
+        self.shape_after = shape_after
+        # Списки (y, x, высота, ширина, future со сжатыми байтами)
+        self.before = []
+        self.after = []
+        # Ключ слоя -> HistoryStep его пикселей; состав и свойства слоев
+        self.layers = {}
+        self.state_before = None
+        self.state_after = None
+
+    @property
+    def nbytes(self):
+        """Объем памяти шага (несжатые тайлы считаются по полному размеру)"""
+        total = sum(step.nbytes for step in self.layers.values())
+        for tiles, shape in (
+            (self.before, self.shape_before),
+            (self.after, self.shape_after),
+        ):
+            for _, _, height, width, future in tiles:
+                if future.done():
+                    total += len(future.result())
+                else:
+                    total += height * width * shape[2]
+        return total
+
+    @staticmethod
+    def apply_tiles(pixels, tiles, shape):
+        """Записывает тайлы в массив, создавая новый при смене размера"""
+        if shape is None:
+            return None
+        if pixels is None or pixels.shape != shape:
+            pixels = np.empty(shape, dtype=np.uint8)
+        for y, x, height, width, future in tiles:
+            tile = np.frombuffer(zlib.decompress(future.result()), dtype=np.uint8)
+            tile = tile.reshape(height, width, shape[2])
+            pixels[y : y + height, x : x + width] = tile
+        return pixels
+
+
+class TileHistory:
+    """История изменений с ограничением по памяти, а не по числу шагов.
+
+    Хранит одну эталонную копию текущего состояния и для каждого шага -
+    только тайлы, которые изменились. Тайлы сжимаются в фоновом потоке.
+    Эталоны слоев лежат в layers (ключ слоя -> массив), их состав и
+    свойства - в state; после undo и redo оттуда восстанавливаются слои.
+    """
+
+    def __init__(self, tile_size=256, memory_budget=512 * 1024 * 1024):
+        self.tile_size = tile_size
+        self.memory_budget = memory_budget
+        self.steps = []
+        self.index = 0
+        self.reference = None
+        self.layers = {}
+        self.state = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def __len__(self):
+        """Количество состояний в истории (включая исходное)"""
+        return len(self.steps) + 1
+
+    def reset(self, pixels):
+        """Начинает историю заново с указанного состояния (без слоев)"""
+        self.steps = []
+        self.index = 0
+        self.reference = np.array(pixels, dtype=np.uint8, copy=True)
+        self.layers = {}
+        self.state = None
+
+    def can_undo(self):
+        return self.index > 0
+
+    def can_redo(self):
+        return self.index < len(self.steps)
+
+    def discard_redo(self):
+        """Удаляет отмененные шаги (после нового действия их не повторить)"""
+        del self.steps[self.index :]
+
+    def memory_usage(self):
+        """Объем памяти, занятой шагами истории, в байтах"""
+        return sum(step.nbytes for step in self.steps)
+
+    def changed_tiles(self, reference, pixels):
+        """Возвращает координаты тайлов pixels, отличающихся от эталона"""
+        height, width = pixels.shape[:2]
+        size = self.tile_size
+
+        # Сравниваем пиксели целиком как 32-битные слова (или по байтам)
+        if pixels.shape[2] == 4:
+            diff = reference.view(np.uint32) != pixels.view(np.uint32)
+            diff = diff.reshape(height, width)
+        else:
+            diff = (reference != pixels).any(axis=2)
+
+        rows = np.arange(0, height, size)
+        cols = np.arange(0, width, size)
+        changed = np.logical_or.reduceat(diff, rows, axis=0)
+        changed = np.logical_or.reduceat(changed, cols, axis=1)
+
+        return [(int(rows[i]), int(cols[j])) for i, j in zip(*np.nonzero(changed))]
+
+    def compress(self, tile):
+        """Ставит тайл в очередь на сжатие и возвращает future.
+
+        Байты тайла копируются сразу, поэтому исходный массив можно менять.
+        """
+        return self.executor.submit(zlib.compress, tile.tobytes(), 1)
+
+    def delta(self, reference, pixels):
+        """Шаг с разницей pixels и эталона reference (любой может быть None).
+
+        Возвращает (шаг или None без изменений, новый эталон); эталон того
+        же размера обновляется на месте.
+        """
+        step = HistoryStep(
+            None if reference is None else reference.shape,
+            None if pixels is None else pixels.shape,
+        )
+        size = self.tile_size
+
+        if reference is None or pixels is None or pixels.shape != reference.shape:
+            # Размер изменился (обрезка, поворот) или слой добавлен либо
+            # удален - сохраняем кадры целиком
+            if reference is not None:
+                height, width = reference.shape[:2]
+                step.before.append((0, 0, height, width, self.compress(reference)))
+            if pixels is not None:
+                height, width = pixels.shape[:2]
+                step.after.append((0, 0, height, width, self.compress(pixels)))
+                pixels = pixels.copy()
+            return step, pixels
+
+        tiles = self.changed_tiles(reference, pixels)
+        if not tiles:
+            return None, reference
+        for y, x in tiles:
+            before = reference[y : y + size, x : x + size]
+            after = pixels[y : y + size, x : x + size]
+            height, width = before.shape[:2]
+            step.before.append((y, x, height, width, self.compress(before)))
+            step.after.append((y, x, height, width, self.compress(after)))
+            # Обновляем эталон только в измененных тайлах
+            before[...] = after
+        return step, reference
+
+    def commit(self, pixels, layers=None, state=None):
+        """Записывает изменения относительно эталона как новый шаг.
+
+        layers - слои после действия: ключ -> массив пикселей или None,
+        если слой не менялся с прошлой фиксации; слои, которых нет в
+        словаре, считаются удаленными. state - состав и свойства слоев.
+        Возвращает True, если изменения были.
+        """
+        pixels = np.ascontiguousarray(pixels)
+        step, self.reference = self.delta(self.reference, pixels)
+        if step is None:
+            step = HistoryStep(pixels.shape, pixels.shape)
+        changed = bool(step.after)
+
+        layers = layers or {}
+        keys = list(self.layers) + [key for key in layers if key not in self.layers]
+        for key in keys:
+            if key in layers and layers[key] is None:
+                continue
+            current = layers.get(key)
+            if current is not None:
+                current = np.ascontiguousarray(current)
+            layer_step, reference = self.delta(self.layers.get(key), current)
+            if layer_step is None:
+                continue
+            step.layers[key] = layer_step
+            if reference is None:
+                del self.layers[key]
+            else:
+                self.layers[key] = reference
+
+        step.state_before, step.state_after = self.state, state
+        if not changed and not step.layers and state == self.state:
+            return False
+        self.state = state
+
+        self.discard_redo()
+        self.steps.append(step)
+        self.index += 1
+        self.enforce_budget()
+        return True
+
+    def enforce_budget(self):
+        """Удаляет самые старые шаги, пока история не уложится в бюджет"""
+        while len(self.steps) > 1 and self.memory_usage() > self.memory_budget:
+            self.steps.pop(0)
+            self.index -= 1
+
+    def undo(self):
+        """Отменяет шаг и возвращает восстановленное состояние"""
+        if not self.can_undo():
+            return None
+        self.index -= 1
+        step = self.steps[self.index]
+        self.reference = step.apply_tiles(
+            self.reference, step.before, step.shape_before
+        )
+        self.apply_layers(step, "before")
+        return self.reference
+
+    def redo(self):
+        """Повторяет шаг и возвращает восстановленное состояние"""
+        if not self.can_redo():
+            return None
+        step = self.steps[self.index]
+        self.index += 1
+        self.reference = step.apply_tiles(
+            self.reference, step.after, step.shape_after
+        )
+        self.apply_layers(step, "after")
+        return self.reference
+
+    def apply_layers(self, step, side):
+        """Восстанавливает эталоны и состояние слоев до (side="before")
+        или после ("after") шага"""
+        for key, layer_step in step.layers.items():
+            pixels = layer_step.apply_tiles(
+                self.layers.get(key),
+                getattr(layer_step, side),
+                getattr(layer_step, "shape_" + side),
+            )
+            if pixels is None:
+                self.layers.pop(key, None)
+            else:
+                self.layers[key] = pixels
+        self.state = getattr(step, "state_" + side)
@@ -0,0 +1,109 @@
+"""Очередь фоновых задач обработки на постоянном пуле потоков"""
+
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+
+class JobCancelled(Exception):
+    """Задача отменена во время выполнения"""
+
+
+class JobQueue(QObject):
+    """Очередь задач с постоянными рабочими потоками.
+
+    Задачи распределяются по полосам (lane): внутри полосы они выполняются
+    строго по очереди, разные полосы работают параллельно. Результат задачи
+    выдается в главном потоке до запуска следующей задачи той же полосы,
+    поэтому она видит уже примененный результат предыдущей.
+
+    Задача - объект с методами prepare() (главный поток, перед запуском),
+    run() (рабочий поток), deliver() (главный поток, выдача результата)
+    и cancel(). Исключение из prepare() или deliver() не останавливает
+    полосу: о нем сообщает сигнал failed(полоса, текст ошибки).
+    """
+
+    job_done = pyqtSignal(str, object)
+    changed = pyqtSignal(int)
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, max_workers=None, parent=None):
+        super().__init__(parent)
+        if max_workers is None:
+            max_workers = min(4, os.cpu_count() or 1)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.waiting = {}
+        self.running = {}
+        self.job_done.connect(self.on_job_done)
+
+    def pending_count(self):
+        """Количество ожидающих и выполняемых задач"""
+        return sum(len(jobs) for jobs in self.waiting.values()) + len(self.running)
+
+    def is_busy(self, lane):
+        """Есть ли в полосе ожидающие или выполняемые задачи"""
+        return lane in self.running or bool(self.waiting.get(lane))
+
+    def submit(self, job, lane="default", supersede=False):
+        """Ставит задачу в очередь полосы.
+
+        При supersede=True все прежние задачи полосы (включая выполняемую)
+        отменяются: их результаты уже не нужны.
+        """
+        if supersede:
+            self.cancel(lane)
+        self.waiting.setdefault(lane, deque()).append(job)
+        self.dispatch(lane)
+        self.changed.emit(self.pending_count())
+        return job
+
+    def cancel(self, lane=None):
+        """Отменяет задачи полосы (или всех полос при lane=None)"""
+        lanes = list(self.waiting) if lane is None else [lane]
+        for name in lanes:
+            for job in self.waiting.pop(name, ()):
+                job.cancel()
+            if name in self.running:
+                # Выполняемая задача остановится на ближайшей проверке
+                self.running[name].cancel()
+        self.changed.emit(self.pending_count())
+
+    def dispatch(self, lane):
+        """Запускает следующую задачу полосы, если полоса свободна"""
+        while lane not in self.running and self.waiting.get(lane):
+            job = self.waiting[lane].popleft()
+            self.running[lane] = job
+            try:
+                job.prepare()
+            except Exception as e:
+                # Задача не запущена: полоса освобождается для следующей
+                del self.running[lane]
+                self.failed.emit(lane, str(e))
+                continue
+            self.executor.submit(self.execute, lane, job)
+
+    def execute(self, lane, job):
+        """Выполняет задачу в рабочем потоке"""
+        try:
+            job.run()
+        finally:
+            # Сигнал доставляется в главный поток через очередь событий
+            self.job_done.emit(lane, job)
+
+    def on_job_done(self, lane, job):
+        """Выдает результат задачи и запускает следующую в полосе"""
+        del self.running[lane]
+        try:
+            job.deliver()
+        except Exception as e:
+            self.failed.emit(lane, str(e))
+        finally:
+            self.dispatch(lane)
+            self.changed.emit(self.pending_count())
+
+    def shutdown(self):
+        """Отменяет все задачи и освобождает рабочие потоки"""
+        self.cancel()
+        self.executor.shutdown(wait=False, cancel_futures=True)
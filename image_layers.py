@@ -0,0 +1,169 @@
+"""Стек слоев холста с кэшированной композицией.
+
+Над фоном (изображением холста) лежат слои с собственной непрозрачностью
+и режимом наложения: вставленные фрагменты, текст, штрихи. Композиция
+хранится в кэше и при изменении слоя или фона пересобирается только
+в затронутых тайлах.
+"""
+
+from PyQt6.QtCore import QPoint, QRect
+from PyQt6.QtGui import QImage, QPainter, QPixmap
+
+
+Mode = QPainter.CompositionMode
+
+# Режимы наложения: имя -> (подпись, режим композиции QPainter)
+BLEND_MODES = {
+    "normal": ("Обычный", Mode.CompositionMode_SourceOver),
+    "multiply": ("Умножение", Mode.CompositionMode_Multiply),
+    "screen": ("Экран", Mode.CompositionMode_Screen),
+    "overlay": ("Перекрытие", Mode.CompositionMode_Overlay),
+    "darken": ("Замена темным", Mode.CompositionMode_Darken),
+    "lighten": ("Замена светлым", Mode.CompositionMode_Lighten),
+    "color_dodge": ("Осветление основы", Mode.CompositionMode_ColorDodge),
+    "color_burn": ("Затемнение основы", Mode.CompositionMode_ColorBurn),
+    "hard_light": ("Жесткий свет", Mode.CompositionMode_HardLight),
+    "soft_light": ("Мягкий свет", Mode.CompositionMode_SoftLight),
+    "difference": ("Разница", Mode.CompositionMode_Difference),
+    "exclusion": ("Исключение", Mode.CompositionMode_Exclusion),
+    "plus": ("Сложение", Mode.CompositionMode_Plus),
+}
+
+
+class Layer:
+    """Слой: изображение с позицией на холсте, непрозрачностью и режимом"""
+
+    def __init__(
+        self, image, position=None, name="Слой", opacity=1.0, blend_mode="normal"
+    ):
+        if isinstance(image, QPixmap):
+            image = image.toImage()
+        self.image = image.convertToFormat(QImage.Format.Format_ARGB32_Premultiplied)
+        self.position = QPoint(position) if position is not None else QPoint(0, 0)
+        self.name = name
+        self.opacity = opacity
+        self.blend_mode = blend_mode
+        self.visible = True
+
+    def rect(self):
+        """Область слоя в координатах холста"""
+        return QRect(self.position, self.image.size())
+
+
+class LayerStack:
+    """Слои над фоном и кэш их композиции, разбитый на тайлы.
+
+    Изменения помечают тайлы как устаревшие (invalidate); refresh
+    пересобирает только их. Пока слоев нет, кэш не хранится.
+    """
+
+    def __init__(self, tile_size=256):
+        self.tile_size = tile_size
+        self.layers = []  # снизу вверх
+        self.background = None
+        self.background_key = None
+        self.composite = None
+        self.dirty_tiles = set()
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def bounds(self):
+        return self.background.rect() if self.background is not None else QRect()
+
+    def invalidate(self, rect=None):
+        """Помечает устаревшими тайлы, пересекающие rect (None - все)"""
+        if self.background is None:
+            return
+        bounds = self.bounds()
+        rect = bounds if rect is None else rect.intersected(bounds)
+        if rect.isEmpty():
+            return
+        size = self.tile_size
+        for row in range(rect.top() // size, rect.bottom() // size + 1):
+            for col in range(rect.left() // size, rect.right() // size + 1):
+                self.dirty_tiles.add((row, col))
+
+    def set_background(self, pixmap, rect=None):
+        """Задает фон; если он изменился, устаревает rect (None - весь кадр)"""
+        if pixmap is self.background and pixmap.cacheKey() == self.background_key:
+            return
+        resized = self.background is None or pixmap.size() != self.background.size()
+        self.background = pixmap
+        self.background_key = pixmap.cacheKey()
+        self.invalidate(None if resized else rect)
+
+    def add(self, layer, index=None):
+        """Добавляет слой (по умолчанию - наверх) и возвращает его"""
+        self.layers.insert(len(self.layers) if index is None else index, layer)
+        self.invalidate(layer.rect())
+        return layer
+
+    def remove(self, layer):
+        self.layers.remove(layer)
+        self.invalidate(layer.rect())
+
+    def move(self, layer, position):
+        """Переносит слой; устаревают старая и новая области"""
+        self.invalidate(layer.rect())
+        layer.position = QPoint(position)
+        self.invalidate(layer.rect())
+
+    def reorder(self, layer, step):
+        """Сдвигает слой на step позиций вверх (отрицательный - вниз)"""
+        index = self.layers.index(layer)
+        target = max(0, min(len(self.layers) - 1, index + step))
+        if target != index:
+            self.layers.insert(target, self.layers.pop(index))
+            self.invalidate(layer.rect())
+
+    def replace(self, layers):
+        """Заменяет состав слоев (восстановление из истории); устаревает весь
+        кадр"""
+        self.layers = list(layers)
+        self.invalidate()
+
+    def clear(self):
+        self.layers = []
+        self.composite = None
+        self.dirty_tiles = set()
+
+    def refresh(self):
+        """Пересобирает устаревшие тайлы и возвращает кэш композиции.
+
+        Без слоев возвращается сам фон.
+        """
+        if not self.layers:
+            self.composite = None
+            self.dirty_tiles = set()
+            return self.background
+        if self.composite is None or self.composite.size() != self.background.size():
+            self.composite = QPixmap(self.background.size())
+            self.dirty_tiles = set()
+            self.invalidate()
+        if not self.dirty_tiles:
+            return self.composite
+
+        size = self.tile_size
+        bounds = self.bounds()
+        painter = QPainter(self.composite)
+        for row, col in sorted(self.dirty_tiles):
+            tile = QRect(col * size, row * size, size, size).intersected(bounds)
+            painter.setCompositionMode(Mode.CompositionMode_Source)
+            painter.setOpacity(1.0)
+            painter.drawPixmap(tile, self.background, tile)
+            for layer in self.layers:
+                area = tile.intersected(layer.rect())
+                if not layer.visible or area.isEmpty():
+                    continue
+                painter.setCompositionMode(BLEND_MODES[layer.blend_mode][1])
+                painter.setOpacity(layer.opacity)
+                painter.drawImage(
+                    area, layer.image, area.translated(-layer.position)
+                )
+        painter.end()
+        self.dirty_tiles = set()
+        return self.composite
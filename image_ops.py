@@ -0,0 +1,419 @@
+"""Операции над изображениями без Qt: общие для редактора и пакетной обработки.
+
+Операция принимает PIL-изображение или массив NumPy (L, RGB, RGBA) и
+возвращает одно из них; преобразование выполняется только там, где
+следующему шагу действительно нужен другой вид данных.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+import image_engine
+import image_parallel
+
+
+# Режим PIL по числу каналов массива
+CHANNEL_MODES = {1: "L", 3: "RGB", 4: "RGBA"}
+
+
+def as_array(image):
+    """Возвращает изображение как массив L (h, w), RGB или RGBA (h, w, c)"""
+    if isinstance(image, np.ndarray):
+        return image
+    if image.mode not in ("L", "RGB", "RGBA"):
+        image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+    return np.asarray(image)
+
+
+def as_pil(image):
+    """Возвращает изображение как PIL.Image"""
+    if isinstance(image, Image.Image):
+        return image
+    channels = image.shape[2] if image.ndim == 3 else 1
+    return Image.fromarray(image, CHANNEL_MODES[channels])
+
+
+def filters(image, brightness=1.0, contrast=1.0, saturation=1.0):
+    """Яркость, контрастность и насыщенность"""
+    pixels = as_array(image)
+    if pixels.ndim == 2:
+        pixels = np.asarray(as_pil(pixels).convert("RGB"))
+    return image_engine.enhance(pixels, brightness, contrast, saturation)
+
+
+def brightness_contrast(image, brightness=1.0, contrast=1.0):
+    """Яркость и контрастность (одна таблица на все каналы)"""
+    pixels = as_array(image)
+    histograms = image_engine.channel_histograms(pixels)
+    return image_engine.apply_lut(
+        pixels, image_engine.enhance_lut(histograms, brightness, contrast)
+    )
+
+
+def saturation(image, saturation=1.0):
+    """Насыщенность"""
+    return image_engine.saturate(as_array(image), saturation)
+
+
+def remove_background(image, tolerance=15, feather=0, edge_connected=False):
+    """Делает белый фон прозрачным"""
+    rgba = np.asarray(as_pil(image).convert("RGBA"))
+    return image_engine.remove_background(
+        rgba, tolerance=tolerance, feather=feather, edge_connected=edge_connected
+    )
+
+
+def blur(image, radius=2):
+    """Размытие по Гауссу"""
+    return as_pil(image).filter(ImageFilter.GaussianBlur(radius=radius))
+
+
+def sharpen(image):
+    """Резкость"""
+    return as_pil(image).filter(ImageFilter.SHARPEN)
+
+
+def unsharp_mask(image, radius=2, percent=150, threshold=3):
+    """Увеличение резкости с помощью маски нерезкости"""
+    return as_pil(image).filter(
+        ImageFilter.UnsharpMask(radius=radius, percent=percent, threshold=threshold)
+    )
+
+
+def noise_reduction(image, size=3):
+    """Шумоподавление медианным фильтром"""
+    return as_pil(image).filter(ImageFilter.MedianFilter(size=size))
+
+
+def grayscale(image):
+    """Преобразование в черно-белое"""
+    return as_pil(image).convert("L").convert("RGB")
+
+
+def noise(image, sigma=25, seed=None, use_processes=False):
+    """Добавление шума"""
+    return image_parallel.run_kernel(
+        image_engine.add_noise,
+        as_array(image),
+        use_processes=use_processes,
+        sigma=sigma,
+        seed=seed,
+    )
+
+
+def sketch(image, blur_radius=21, use_processes=False):
+    """Эффект рисунка"""
+    gray = np.asarray(as_pil(image).convert("L"))
+    result = image_parallel.run_kernel(
+        image_engine.sketch, gray, use_processes=use_processes, blur_radius=blur_radius
+    )
+    return Image.fromarray(result, "L").convert("RGB")
+
+
+def glass(image, radius=5, seed=None, use_processes=False):
+    """Эффект стекла"""
+    return image_parallel.run_kernel(
+        image_engine.glass,
+        as_array(image),
+        use_processes=use_processes,
+        radius=radius,
+        seed=seed,
+    )
+
+
+def wave(image, amplitude=20, frequency=0.05, use_processes=False):
+    """Эффект волн"""
+    return image_parallel.run_kernel(
+        image_engine.wave,
+        as_array(image),
+        use_processes=use_processes,
+        amplitude=amplitude,
+        frequency=frequency,
+    )
+
+
+def glow(image, radius=15, brightness=1.5, strength=0.3):
+    """Эффект свечения: смешивание с размытой осветленной копией"""
+    img = as_pil(image)
+    halo = img.filter(ImageFilter.GaussianBlur(radius=radius))
+    halo = ImageEnhance.Brightness(halo).enhance(brightness)
+    return Image.blend(img, halo, strength)
+
+
+def shadow(image, offset=5, radius=5, opacity=0.5):
+    """Эффект тени: размытая черная копия по альфа-каналу под изображением"""
+    img = as_pil(image)
+    rgba = np.asarray(img.convert("RGBA"))
+    layer = Image.fromarray(image_engine.shadow_layer(rgba, opacity=opacity), "RGBA")
+    layer = layer.filter(ImageFilter.GaussianBlur(radius=radius))
+
+    result = Image.new(
+        "RGBA", (img.width + 2 * offset, img.height + 2 * offset), (255, 255, 255, 0)
+    )
+    result.paste(layer, (offset, offset))
+    result.paste(img, (0, 0))
+    return result
+
+
+def auto_levels(image):
+    """Автоматическая коррекция уровней"""
+    return auto_contrast(image, cutoff=0)
+
+
+def auto_contrast(image, cutoff=1):
+    """Автоматическая коррекция контраста (альфа-канал не меняется)"""
+    pixels = as_array(image)
+    histograms = image_engine.channel_histograms(pixels)
+    return image_engine.apply_lut(
+        pixels, image_engine.autocontrast_lut(histograms, cutoff)
+    )
+
+
+def color_balance(image, red_cyan=0, green_magenta=0, blue_yellow=0):
+    """Коррекция цветового баланса: сдвиг каналов R, G, B в процентах"""
+    pixels = as_array(image)
+    histograms = image_engine.channel_histograms(pixels)
+    return image_engine.apply_lut(
+        pixels,
+        image_engine.color_balance_lut(
+            histograms, red_cyan, green_magenta, blue_yellow
+        ),
+    )
+
+
+def resize(image, width=None, height=None, scale=None):
+    """Изменение размера; при одной заданной стороне пропорции сохраняются"""
+    img = as_pil(image)
+    if scale is not None:
+        width, height = round(img.width * scale), round(img.height * scale)
+    elif width is None and height is None:
+        return img
+    elif width is None:
+        width = round(img.width * height / img.height)
+    elif height is None:
+        height = round(img.height * width / img.width)
+    return img.resize((max(1, width), max(1, height)), Image.Resampling.LANCZOS)
+
+
+# Операции по именам (совпадают с ImageProcessor.operation)
+OPERATIONS = {
+    "filters": filters,
+    "brightness_contrast": brightness_contrast,
+    "saturation": saturation,
+    "remove_background": remove_background,
+    "blur": blur,
+    "sharpen": sharpen,
+    "unsharp_mask": unsharp_mask,
+    "noise_reduction": noise_reduction,
+    "grayscale": grayscale,
+    "noise": noise,
+    "sketch_effect": sketch,
+    "glass_effect": glass,
+    "wave_effect": wave,
+    "glow_effect": glow,
+    "shadow_effect": shadow,
+    "auto_levels": auto_levels,
+    "auto_contrast": auto_contrast,
+    "color_balance": color_balance,
+    "resize": resize,
+}
+
+
+def icon_master(image):
+    """Квадратная RGBA-основа для иконок: неквадратное изображение
+    вписывается по центру прозрачного квадрата"""
+    img = as_pil(image)
+    if img.mode != "RGBA":
+        img = img.convert("RGBA")
+    if img.width == img.height:
+        return img
+
+    max_side = max(img.width, img.height)
+    square = Image.new("RGBA", (max_side, max_side), (0, 0, 0, 0))
+    position = ((max_side - img.width) // 2, (max_side - img.height) // 2)
+    square.paste(img, position, img)
+    return square
+
+
+def icon_pyramid(master, min_size):
+    """Уровни последовательного уменьшения вдвое, от master до min_size"""
+    levels = [master]
+    while levels[-1].width // 2 >= min_size:
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def icon_image(pyramid, size):
+    """Возвращает RGBA-иконку size x size из ближайшего большего уровня"""
+    source = pyramid[0]
+    for level in pyramid:
+        if level.width < size:
+            break
+        source = level
+
+    # Для маленьких иконок - более четкие алгоритмы масштабирования
+    if size <= 16:
+        resample = Image.Resampling.NEAREST
+    elif size <= 48:
+        resample = Image.Resampling.BOX
+    else:
+        resample = Image.Resampling.LANCZOS
+    icon = source.resize((size, size), resample)
+
+    if size <= 48:
+        # Маленькие иконки квантуем до 255 цветов, сохраняя альфа-канал
+        try:
+            alpha = icon.getchannel("A")
+            quantized = icon.convert("RGB").quantize(
+                colors=255, method=Image.Quantize.MEDIANCUT
+            )
+            icon = quantized.convert("RGBA")
+            icon.putalpha(alpha)
+        except Exception:
+            # Если квантизация не удалась, оставляем как есть
+            pass
+
+    return icon
+
+
+def build_icons(image, sizes, progress=None):
+    """Готовит иконки всех размеров: {размер: RGBA-изображение}.
+
+    Квадратная основа и пирамида уменьшений строятся один раз, размеры
+    обрабатываются параллельно в пуле потоков (PIL отпускает GIL при
+    масштабировании). progress(i, total) вызывается по готовности иконок.
+    """
+    sizes = sorted(set(sizes))
+    pyramid = icon_pyramid(icon_master(image), sizes[0])
+
+    icons = {}
+    workers = min(len(sizes), os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(icon_image, pyramid, size): size for size in sizes}
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                icons[futures[future]] = future.result()
+                if progress is not None:
+                    progress(done, len(sizes))
+        except BaseException:
+            # Отмена: не запущенные размеры уже не нужны
+            for future in futures:
+                future.cancel()
+            raise
+    return icons
+
+
+def save_ico(image, path, sizes, progress=None):
+    """Сохраняет изображение как ICO с иконками указанных размеров.
+
+    progress(i, total) вызывается после подготовки каждой иконки.
+    """
+    icons = build_icons(image, sizes, progress)
+    # PIL берет из основного изображения только размеры не больше его
+    # самого, поэтому основным идет самое большое
+    ordered = [icons[size] for size in sorted(icons, reverse=True)]
+    ordered[0].save(
+        path,
+        format="ICO",
+        sizes=[icon.size for icon in ordered],
+        append_images=ordered[1:],
+    )
+
+
+@contextmanager
+def atomic_write(path):
+    """Дает путь временного файла рядом с path и после успешной записи
+    переименовывает его в path.
+
+    При ошибке или отмене временный файл удаляется, а прежний файл остается
+    нетронутым.
+    """
+    temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield temp_path
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
+
+# Снятие предела PIL на число пикселей: число активных блоков и прежний предел
+pixel_limit_lock = threading.Lock()
+pixel_limit_users = 0
+saved_pixel_limit = None
+
+
+@contextmanager
+def unlimited_pixels():
+    """Снимает защиту PIL от "бомб распаковки" на время блока.
+
+    Нужна путям, которые сами ограничивают расход памяти: чтению заголовка
+    и переносу огромных файлов в хранилище вне памяти. Предел общий для
+    процесса, поэтому параллельные блоки считаются: он восстанавливается,
+    когда завершается последний из них.
+    """
+    global pixel_limit_users, saved_pixel_limit
+    with pixel_limit_lock:
+        if not pixel_limit_users:
+            saved_pixel_limit = Image.MAX_IMAGE_PIXELS
+            Image.MAX_IMAGE_PIXELS = None
+        pixel_limit_users += 1
+    try:
+        yield
+    finally:
+        with pixel_limit_lock:
+            pixel_limit_users -= 1
+            if not pixel_limit_users:
+                Image.MAX_IMAGE_PIXELS = saved_pixel_limit
+
+
+def image_format_for(path, image_format=None):
+    """Имя формата PIL: заданное или по расширению файла"""
+    if image_format is None:
+        image_format = os.path.splitext(path)[1].lstrip(".")
+    image_format = image_format.upper()
+    return {"JPG": "JPEG", "TIF": "TIFF"}.get(image_format, image_format)
+
+
+def flatten_for_format(image, image_format):
+    """Форматы без прозрачности (JPEG, BMP) получают белый фон вместо
+    альфа-канала"""
+    img = as_pil(image)
+    if image_format in ("JPEG", "BMP") and img.mode not in ("RGB", "L"):
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        rgba = img.convert("RGBA")
+        background.paste(rgba, mask=rgba.getchannel("A"))
+        img = background
+    return img
+
+
+def save_image(image, path, image_format=None, progress=None, **options):
+    """Сохраняет результат в файл; формат определяется по расширению.
+
+    Для ICO в options передается sizes. Форматы без прозрачности (JPEG, BMP)
+    получают белый фон вместо альфа-канала. Файл записывается атомарно
+    (см. atomic_write). progress(i, total) вызывается по ходу записи;
+    исключение из него отменяет запись.
+    """
+    image_format = image_format_for(path, image_format)
+
+    with atomic_write(path) as temp_path:
+        if image_format == "ICO":
+            sizes = options.pop("sizes", (16, 32, 48, 256))
+            save_ico(image, temp_path, sizes, progress)
+            return
+
+        img = flatten_for_format(image, image_format)
+        if progress is not None:
+            progress(0, 1)
+        img.save(temp_path, image_format, **options)
+        if progress is not None:
+            progress(1, 1)
@@ -0,0 +1,211 @@
+"""Выполнение тяжелых ядер обработки в пуле процессов.
+
+Ядра NumPy/OpenCV из image_engine запускаются в отдельных процессах, чтобы
+не делить GIL с интерфейсом. Пиксели передаются через
+multiprocessing.shared_memory, а не сериализуются через pickle. Ядра из
+image_engine.TILE_HALO обрабатываются по тайлам с перекрытием: тайлы
+распределяются по всем ядрам процессора, а временные массивы ядра
+ограничены размером тайла.
+"""
+
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from image_engine import TILE_HALO
+
+
+# Изображения меньше этого размера быстрее обработать в текущем процессе
+PROCESS_MIN_PIXELS = 4_000_000
+
+# Сторона тайла (без перекрытия) при обработке по тайлам
+TILE_SIZE = 1024
+
+executor = None
+
+
+def get_executor():
+    """Возвращает пул процессов, создавая его при первом обращении"""
+    global executor
+    if executor is None:
+        # spawn: дочерние процессы не наследуют потоки и состояние Qt
+        executor = ProcessPoolExecutor(
+            max_workers=os.cpu_count() or 1,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+    return executor
+
+
+def shutdown():
+    """Останавливает пул процессов"""
+    global executor
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
+        executor = None
+
+
+def create_shared(shape, dtype):
+    """Создает блок общей памяти и массив поверх него"""
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def shared_call(func, name, shape, dtype, kwargs):
+    """Выполняет ядро в процессе пула.
+
+    Исходные пиксели читаются из общей памяти name, результат записывается
+    в новый блок общей памяти; возвращается его имя, форма и тип.
+    """
+    source = shared_memory.SharedMemory(name=name)
+    try:
+        pixels = np.ndarray(shape, dtype=dtype, buffer=source.buf)
+        result = func(pixels, **kwargs)
+        del pixels
+    finally:
+        source.close()
+
+    output, array = create_shared(result.shape, result.dtype)
+    array[...] = result
+    del array
+    output.close()
+    return output.name, result.shape, result.dtype.str
+
+
+def run_in_process(func, pixels, **kwargs):
+    """Выполняет func(pixels, **kwargs) в пуле процессов.
+
+    func должна быть функцией уровня модуля (ее передают по имени).
+    Блокирует вызывающий поток до готовности результата.
+    """
+    source, array = create_shared(pixels.shape, pixels.dtype)
+    try:
+        array[...] = pixels
+        del array
+        future = get_executor().submit(
+            shared_call, func, source.name, pixels.shape, pixels.dtype.str, kwargs
+        )
+        name, shape, dtype = future.result()
+    finally:
+        source.close()
+        source.unlink()
+
+    output = shared_memory.SharedMemory(name=name)
+    try:
+        return np.ndarray(shape, dtype=dtype, buffer=output.buf).copy()
+    finally:
+        output.close()
+        output.unlink()
+
+
+def tile_bounds(height, width, halo, tile_size=TILE_SIZE):
+    """Перебирает тайлы кадра.
+
+    Для каждого тайла возвращает область результата и область исходных
+    пикселей с перекрытием halo: (y0, y1, x0, x1) для каждой.
+    """
+    for y in range(0, height, tile_size):
+        for x in range(0, width, tile_size):
+            inner = (y, min(y + tile_size, height), x, min(x + tile_size, width))
+            outer = (
+                max(y - halo, 0),
+                min(inner[1] + halo, height),
+                max(x - halo, 0),
+                min(inner[3] + halo, width),
+            )
+            yield inner, outer
+
+
+def process_tile(func, pixels, output, inner, outer, kwargs):
+    """Обрабатывает тайл с перекрытием и записывает в output его середину"""
+    y0, y1, x0, x1 = inner
+    top, bottom, left, right = outer
+    # Ядрам, зависящим от положения в кадре (волна, случайные смещения),
+    # передаем координаты тайла
+    if "origin" in inspect.signature(func).parameters:
+        kwargs = dict(kwargs, origin=(top, left))
+
+    result = func(pixels[top:bottom, left:right], **kwargs)
+    output[y0:y1, x0:x1] = result[y0 - top : y1 - top, x0 - left : x1 - left]
+
+
+def shared_tile_call(func, source_name, output_name, shape, dtype, tile, kwargs):
+    """Обрабатывает один тайл в процессе пула прямо в общей памяти"""
+    source = shared_memory.SharedMemory(name=source_name)
+    output = shared_memory.SharedMemory(name=output_name)
+    try:
+        pixels = np.ndarray(shape, dtype=dtype, buffer=source.buf)
+        result = np.ndarray(shape, dtype=dtype, buffer=output.buf)
+        process_tile(func, pixels, result, *tile, kwargs)
+        del pixels, result
+    finally:
+        source.close()
+        output.close()
+
+
+def run_tiled(func, pixels, use_processes=True, tile_size=TILE_SIZE, **kwargs):
+    """Выполняет ядро из TILE_HALO по тайлам с перекрытием.
+
+    В режиме use_processes тайлы обрабатываются параллельно в пуле
+    процессов: исходный кадр и результат лежат в общей памяти, и каждый
+    процесс пишет свой тайл на место. Иначе тайлы обрабатываются по очереди
+    в текущем потоке - так ограничивается пиковый объем памяти.
+    """
+    halo = TILE_HALO[func](**kwargs)
+    height, width = pixels.shape[:2]
+    tiles = list(tile_bounds(height, width, halo, tile_size))
+
+    if not use_processes:
+        output = np.empty_like(pixels)
+        for tile in tiles:
+            process_tile(func, pixels, output, *tile, kwargs)
+        return output
+
+    source, array = create_shared(pixels.shape, pixels.dtype)
+    output, result = create_shared(pixels.shape, pixels.dtype)
+    try:
+        array[...] = pixels
+        del array
+        futures = [
+            get_executor().submit(
+                shared_tile_call,
+                func,
+                source.name,
+                output.name,
+                pixels.shape,
+                pixels.dtype.str,
+                tile,
+                kwargs,
+            )
+            for tile in tiles
+        ]
+        wait(futures)
+        for future in futures:
+            # Пробрасываем ошибку тайла, если она была
+            future.result()
+        return result.copy()
+    finally:
+        del result
+        for shm in (source, output):
+            shm.close()
+            shm.unlink()
+
+
+def run_kernel(func, pixels, use_processes=True, **kwargs):
+    """Выполняет ядро, выбирая способ по размеру изображения.
+
+    Большие изображения обрабатываются по тайлам (если ядро это допускает)
+    или целиком в пуле процессов, малые - в текущем потоке.
+    """
+    if pixels.shape[0] * pixels.shape[1] < PROCESS_MIN_PIXELS:
+        return func(pixels, **kwargs)
+    if func in TILE_HALO:
+        return run_tiled(func, pixels, use_processes=use_processes, **kwargs)
+    if use_processes:
+        return run_in_process(func, pixels, **kwargs)
+    return func(pixels, **kwargs)
@@ -0,0 +1,196 @@
+"""Миниатюры для списка файлов с кэшем на диске.
+
+Миниатюра строится с уменьшенным декодированием: для JPEG - масштабированием
+DCT (Image.draft), для остальных форматов - через Image.reduce. Форматы,
+которые draft не уменьшает (PNG, TIFF), декодируются целиком, поэтому для
+слишком больших файлов миниатюра не строится. Готовые миниатюры
+сохраняются на диск под ключом из пути, времени изменения и размера файла:
+измененный файл получает новый ключ, а устаревшие записи вытесняются.
+Объем кэша ограничен, первыми удаляются записи, к которым дольше всего
+не обращались (LRU).
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, PngImagePlugin
+
+import image_ops
+
+
+# Сторона миниатюры в кэше (с запасом для экранов с высокой плотностью)
+THUMBNAIL_SIZE = 128
+
+# Предельный объем кэша на диске
+CACHE_BYTES = 256 * 1024 * 1024
+
+# Наибольшее число пикселей, декодируемых ради миниатюры (около 256 МБ RGBA)
+MAX_DECODE_PIXELS = 64_000_000
+
+
+def cache_directory():
+    """Папка кэша миниатюр пользователя"""
+    base = os.environ.get("LOCALAPPDATA") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(base, "img_edit", "thumbnails")
+
+
+def read_size(path):
+    """Размер изображения (ширина, высота) по заголовку файла без декодирования.
+
+    Кадр не декодируется, поэтому предел PIL на число пикселей не нужен:
+    размер любого файла можно узнать и выбрать способ загрузки.
+    """
+    with image_ops.unlimited_pixels(), Image.open(path) as img:
+        return img.size
+
+
+def decode_reduced(path, size):
+    """Быстро декодирует изображение в уменьшенном масштабе (не меньше size).
+
+    Возвращает (изображение, (ширина, высота) исходного) или None,
+    если декодер не умеет уменьшать при чтении - тогда уменьшенная копия
+    обошлась бы не дешевле полной.
+    """
+    with Image.open(path) as img:
+        original_size = img.size
+        img.draft("RGB", size)
+        if img.size == original_size:
+            return None
+        img.load()
+    return img, original_size
+
+
+def make_thumbnail(path, size=THUMBNAIL_SIZE, max_pixels=MAX_DECODE_PIXELS):
+    """Строит миниатюру файла.
+
+    Возвращает (миниатюра RGB/RGBA, (ширина, высота) исходного изображения).
+    Если даже уменьшенное декодирование дает больше max_pixels пикселей,
+    вызывает ValueError: полный кадр огромного скана не читается ради
+    миниатюры.
+    """
+    with Image.open(path) as img:
+        original_size = img.size
+        # JPEG декодируется сразу в уменьшенном масштабе (1/2 ... 1/8)
+        img.draft("RGB", (size, size))
+        if img.width * img.height > max_pixels:
+            raise ValueError(
+                "Изображение {}x{} слишком велико для миниатюры".format(
+                    *original_size
+                )
+            )
+        # reducing_gap: грубое уменьшение через reduce, затем точное
+        img.thumbnail((size, size), Image.Resampling.BICUBIC, reducing_gap=2.0)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGBA" if img.has_transparency_data else "RGB")
+        else:
+            img.load()
+    return img, original_size
+
+
+class ThumbnailCache:
+    """Дисковый кэш миниатюр с вытеснением давно не использованных записей.
+
+    Методы потокобезопасны: миниатюры строятся в нескольких рабочих потоках.
+    """
+
+    def __init__(self, directory=None, max_bytes=CACHE_BYTES, size=THUMBNAIL_SIZE):
+        self.directory = directory or cache_directory()
+        self.max_bytes = max_bytes
+        self.size = size
+        self.lock = threading.Lock()
+        # Ключ -> объем файла записи, от давно использованных к недавним.
+        # Заполняется при первом обращении к кэшу.
+        self.entries = None
+        self.total_bytes = 0
+
+    def key(self, path):
+        """Ключ записи: путь, время изменения и размер файла"""
+        stat = os.stat(path)
+        source = f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}"
+        source += f"|{self.size}"
+        return hashlib.sha1(source.encode("utf-8")).hexdigest()
+
+    def entry_path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".png")
+
+    def scan(self):
+        """Читает содержимое кэша с диска (вызывается под блокировкой)"""
+        found = []
+        if os.path.isdir(self.directory):
+            for folder in os.scandir(self.directory):
+                if not folder.is_dir():
+                    continue
+                for entry in os.scandir(folder.path):
+                    if entry.name.endswith(".png"):
+                        stat = entry.stat()
+                        found.append((stat.st_mtime, entry.name[:-4], stat.st_size))
+        found.sort()
+        self.entries = OrderedDict((key, size) for _, key, size in found)
+        self.total_bytes = sum(self.entries.values())
+
+    def get(self, path):
+        """Возвращает (миниатюра, размер исходного изображения).
+
+        При промахе миниатюра строится и сохраняется в кэш.
+        """
+        key = self.key(path)
+        entry_path = self.entry_path(key)
+        with self.lock:
+            if self.entries is None:
+                self.scan()
+            hit = key in self.entries
+            if hit:
+                self.entries.move_to_end(key)
+
+        if hit:
+            try:
+                with Image.open(entry_path) as cached:
+                    cached.load()
+                    width, height = cached.text["original_size"].split("x")
+                # Время изменения записи - время последнего обращения
+                os.utime(entry_path)
+                return cached, (int(width), int(height))
+            except (OSError, KeyError, ValueError):
+                # Запись повреждена или удалена - строим заново
+                pass
+
+        thumbnail, original_size = make_thumbnail(path, self.size)
+        self.store(key, thumbnail, original_size)
+        return thumbnail, original_size
+
+    def store(self, key, thumbnail, original_size):
+        """Записывает миниатюру в кэш и вытесняет старые записи"""
+        entry_path = self.entry_path(key)
+        info = PngImagePlugin.PngInfo()
+        info.add_text("original_size", "{}x{}".format(*original_size))
+        try:
+            os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+            # Запись через временный файл: параллельный читатель не увидит
+            # недописанную миниатюру
+            temp_path = f"{entry_path}.{threading.get_ident()}.tmp"
+            thumbnail.save(temp_path, "PNG", pnginfo=info)
+            os.replace(temp_path, entry_path)
+            size = os.path.getsize(entry_path)
+        except OSError:
+            # Кэш недоступен для записи - миниатюра просто не сохраняется
+            return
+
+        with self.lock:
+            self.total_bytes += size - self.entries.pop(key, 0)
+            self.entries[key] = size
+            self.evict()
+
+    def evict(self):
+        """Удаляет давно не использованные записи сверх лимита"""
+        while self.total_bytes > self.max_bytes and len(self.entries) > 1:
+            key, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(self.entry_path(key))
+            except OSError:
+                pass
+
@@ -0,0 +1,388 @@
+"""Изображения вне оперативной памяти: хранилище на диске, отображенное в память.
+
+Очень большие изображения (сканы в десятки тысяч пикселей по стороне)
+хранятся во временном файле, отображенном в память (mmap): в
+оперативной памяти находятся только страницы, к которым идет обращение.
+Операции выполняются по тайлам с перекрытием и пишут результат в новое
+хранилище, поэтому пиковый объем памяти ограничен размером тайла, а не
+изображения. Для показа на холсте строится уменьшенная копия.
+"""
+
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import image_engine
+import image_ops
+from image_parallel import TILE_SIZE, tile_bounds
+from image_pipeline import Pipeline
+
+
+# Наибольшая сторона уменьшенной копии для показа
+OVERVIEW_SIZE = 4096
+
+
+def blur_halo(radius=2, **params):
+    """Перекрытие тайлов для размытия по Гауссу радиуса radius"""
+    return math.ceil(3 * radius) + 1
+
+
+# Операции image_ops, выполнимые по тайлам: имя -> перекрытие тайлов
+TILE_OPERATIONS = {
+    "saturation": lambda saturation=1.0: 0,
+    "grayscale": lambda: 0,
+    "blur": blur_halo,
+    "sharpen": lambda: 2,
+    "unsharp_mask": blur_halo,
+    "noise_reduction": lambda size=3: size // 2,
+    "sketch_effect": image_engine.TILE_HALO[image_engine.sketch],
+}
+
+# Ядра, зависящие от положения в кадре: им передаются координаты тайла
+TILE_KERNELS = {
+    "noise": image_engine.add_noise,
+    "glass_effect": image_engine.glass,
+    "wave_effect": image_engine.wave,
+}
+
+
+class TiledImage:
+    """Изображение L, RGB или RGBA во временном файле, отображенном в память"""
+
+    def __init__(self, shape, directory=None):
+        handle, self.path = tempfile.mkstemp(
+            prefix="img_edit_", suffix=".raw", dir=directory
+        )
+        size = int(np.prod(shape))
+        with os.fdopen(handle, "r+b") as f:
+            f.truncate(size)
+            self.mapping = mmap.mmap(f.fileno(), size)
+        self.pixels = np.ndarray(shape, dtype=np.uint8, buffer=self.mapping)
+
+    @property
+    def width(self):
+        return self.pixels.shape[1]
+
+    @property
+    def height(self):
+        return self.pixels.shape[0]
+
+    @property
+    def channels(self):
+        return self.pixels.shape[2] if self.pixels.ndim == 3 else 1
+
+    @classmethod
+    def from_file(cls, path, progress=None, directory=None):
+        """Переносит изображение из файла в хранилище полосами строк.
+
+        Несжатые кадры (TIFF без сжатия, BMP, PPM) читаются из файла
+        полосами, и весь кадр в памяти не собирается. Сжатые форматы PIL
+        по частям не декодирует: такой файл один раз декодируется целиком
+        и сразу выгружается на диск. Файлы, которые сюда попадают, открыты
+        пользователем, поэтому предел PIL на число пикселей снят.
+        """
+        with image_ops.unlimited_pixels(), Image.open(path) as img:
+            mode = img.mode
+            if mode not in ("L", "RGB", "RGBA"):
+                mode = "RGBA" if "A" in img.getbands() else "RGB"
+            channels = {"L": (), "RGB": (3,), "RGBA": (4,)}[mode]
+
+            store = cls((img.height, img.width) + channels, directory)
+            try:
+                for y, strip in read_strips(img, path):
+                    if strip.mode != mode:
+                        strip = strip.convert(mode)
+                    bottom = y + strip.height
+                    store.pixels[y:bottom] = np.asarray(strip)
+                    if progress is not None:
+                        progress(bottom, img.height)
+            except BaseException:
+                store.close()
+                raise
+        store.mapping.flush()
+        return store
+
+    def close(self):
+        """Освобождает отображение и удаляет файл хранилища"""
+        if self.pixels is None:
+            return
+        self.pixels = None
+        try:
+            self.mapping.close()
+        except BufferError:
+            # Где-то еще живет срез хранилища: отображение закроется вместе с ним
+            pass
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def replace(self, other):
+        """Забирает содержимое другого хранилища, освобождая свое"""
+        self.close()
+        self.pixels, self.mapping = other.pixels, other.mapping
+        self.path = other.path
+        other.pixels = None
+
+    def histograms(self):
+        """Гистограммы каналов всего изображения, накопленные по полосам"""
+        total = None
+        for y in range(0, self.height, TILE_SIZE):
+            strip = self.pixels[y : y + TILE_SIZE]
+            histograms = image_engine.channel_histograms(strip)
+            total = histograms if total is None else total + histograms
+        return total
+
+    def overview(self, max_side=OVERVIEW_SIZE):
+        """Уменьшенная копия (массив NumPy) для показа на холсте"""
+        scale = min(1.0, max_side / max(self.width, self.height))
+        width = max(1, round(self.width * scale))
+        height = max(1, round(self.height * scale))
+        result = np.empty((height, width) + self.pixels.shape[2:], dtype=np.uint8)
+
+        for (y0, y1, x0, x1), _ in tile_bounds(self.height, self.width, 0):
+            top, bottom = round(y0 * scale), round(y1 * scale)
+            left, right = round(x0 * scale), round(x1 * scale)
+            if bottom > top and right > left:
+                result[top:bottom, left:right] = cv2.resize(
+                    np.ascontiguousarray(self.pixels[y0:y1, x0:x1]),
+                    (right - left, bottom - top),
+                    interpolation=cv2.INTER_AREA,
+                ).reshape((bottom - top, right - left) + self.pixels.shape[2:])
+        return result
+
+    def map_tiles(self, func, halo=0, progress=None):
+        """Применяет func(тайл, origin) к тайлам с перекрытием halo.
+
+        Возвращает новое хранилище; число каналов результата определяется
+        по первому тайлу.
+        """
+        tiles = list(tile_bounds(self.height, self.width, halo))
+        output = None
+        try:
+            for index, ((y0, y1, x0, x1), outer) in enumerate(tiles):
+                top, bottom, left, right = outer
+                result = func(self.pixels[top:bottom, left:right], (top, left))
+                if output is None:
+                    shape = (self.height, self.width) + result.shape[2:]
+                    output = TiledImage(shape, os.path.dirname(self.path))
+                output.pixels[y0:y1, x0:x1] = result[
+                    y0 - top : y1 - top, x0 - left : x1 - left
+                ]
+                if progress is not None:
+                    progress(index + 1, len(tiles))
+        except BaseException:
+            if output is not None:
+                output.close()
+            raise
+        output.mapping.flush()
+        return output
+
+    def apply(self, name, progress=None, **params):
+        """Выполняет операцию image_ops по тайлам и возвращает новое хранилище.
+
+        Подряд идущие поточечные шаги (см. image_pipeline) выполняются одним
+        проходом по таблице, построенной по гистограммам всего изображения.
+        """
+        stages = Pipeline().add(name, **params).stages()
+        for point, steps in stages:
+            step = steps[0][0]
+            if not (point or step in TILE_OPERATIONS or step in TILE_KERNELS):
+                raise ValueError(
+                    f"Операция {name} недоступна для изображений вне памяти"
+                )
+
+        current = self
+        try:
+            for index, (point, steps) in enumerate(stages):
+
+                def stage_progress(done, total, index=index):
+                    if progress is not None:
+                        progress(index * total + done, len(stages) * total)
+
+                result = current.apply_stage(point, steps, stage_progress)
+                if current is not self:
+                    current.close()
+                current = result
+        except BaseException:
+            if current is not self:
+                current.close()
+            raise
+        return current
+
+    def apply_stage(self, point, steps, progress):
+        """Выполняет один этап цепочки операций по тайлам"""
+        if point:
+            lut = Pipeline.compose_luts(self.histograms(), steps)
+            return self.map_tiles(
+                lambda tile, origin: image_engine.apply_lut(tile, lut),
+                progress=progress,
+            )
+
+        name, params = steps[0]
+        if name in TILE_KERNELS:
+            kernel = TILE_KERNELS[name]
+            return self.map_tiles(
+                lambda tile, origin: kernel(tile, origin=origin, **params),
+                image_engine.TILE_HALO[kernel](**params),
+                progress,
+            )
+
+        operation = image_ops.OPERATIONS[name]
+        return self.map_tiles(
+            lambda tile, origin: image_ops.as_array(operation(tile, **params)),
+            TILE_OPERATIONS[name](**params),
+            progress,
+        )
+
+    def save(self, path, image_format=None, progress=None, **options):
+        """Сохраняет изображение; TIFF записывается полосами без сборки кадра.
+
+        Остальные форматы кодируются PIL, которому нужен весь кадр в памяти;
+        options передаются кодировщику.
+        """
+        if image_ops.image_format_for(path, image_format) == "TIFF":
+            with image_ops.atomic_write(path) as temp_path:
+                write_tiff(self.pixels, temp_path, progress)
+            return
+        image_ops.save_image(
+            np.asarray(self.pixels), path, image_format, progress, **options
+        )
+
+
+def raw_layout(img):
+    """Расположение несжатого кадра в файле или None.
+
+    Возвращает список (верх, низ, смещение, rawmode, шаг строки, порядок
+    строк) для полос кадра во всю ширину, строки которых лежат в файле
+    без сжатия и читаются по частям. Для сжатых форматов (PNG, JPEG, TIFF
+    со сжатием) и режимов с палитрой или не по 8 бит на канал - None.
+    """
+    if img.mode not in ("L", "LA", "RGB", "RGBA", "CMYK") or not img.tile:
+        return None
+    layout = []
+    for name, (left, top, right, bottom), offset, args in img.tile:
+        if name != "raw" or left != 0 or right != img.width:
+            return None
+        if isinstance(args, str):
+            args = (args,)
+        rawmode, stride, orientation = (tuple(args) + (0, 1))[:3]
+        if not stride:
+            # Упакованные строки: по байту на каждую букву rawmode (RGB, BGRX)
+            if not rawmode.isalpha():
+                return None
+            stride = len(rawmode) * img.width
+        layout.append((top, bottom, offset, rawmode, stride, orientation))
+    return layout
+
+
+def read_strips(img, path, rows=TILE_SIZE):
+    """Выдает (y, полоса PIL) кадра по rows строк.
+
+    Несжатые кадры читаются из файла полосами (см. raw_layout), остальные
+    декодируются целиком и нарезаются.
+    """
+    layout = raw_layout(img)
+    if layout is None:
+        img.load()
+        for y in range(0, img.height, rows):
+            yield y, img.crop((0, y, img.width, min(y + rows, img.height)))
+        return
+
+    with open(path, "rb") as f:
+        for top, bottom, offset, rawmode, stride, orientation in layout:
+            height = bottom - top
+            for y in range(top, bottom, rows):
+                count = min(rows, bottom - y)
+                # Строки снизу вверх (BMP) лежат в файле в обратном порядке
+                row = y - top if orientation > 0 else height - (y - top) - count
+                f.seek(offset + row * stride)
+                data = f.read(count * stride)
+                yield y, Image.frombytes(
+                    img.mode,
+                    (img.width, count),
+                    data,
+                    "raw",
+                    rawmode,
+                    stride,
+                    orientation,
+                )
+
+
+def write_tiff(pixels, path, progress=None, rows_per_strip=64):
+    """Записывает массив L, RGB или RGBA как несжатый TIFF полосами строк.
+
+    Файлы больше 4 ГБ записываются в формате BigTIFF.
+    """
+    height, width = pixels.shape[:2]
+    channels = pixels.shape[2] if pixels.ndim == 3 else 1
+    strip_count = math.ceil(height / rows_per_strip)
+    row_bytes = width * channels
+    big = height * row_bytes + 4096 + 16 * strip_count > 2**32
+
+    # Смещения: в классическом TIFF - 32 бита (LONG), в BigTIFF - 64 (LONG8)
+    offset, offset_type = ("Q", 16) if big else ("I", 4)
+    offset_size = struct.calcsize(offset)
+    header_size = 16 if big else 8
+
+    with open(path, "wb") as f:
+        f.write(b"\0" * header_size)
+        strip_offsets = []
+        for index in range(strip_count):
+            strip_offsets.append(f.tell())
+            y = index * rows_per_strip
+            f.write(np.ascontiguousarray(pixels[y : y + rows_per_strip]).tobytes())
+            if progress is not None:
+                progress(index + 1, strip_count)
+        strip_counts = [
+            (min(rows_per_strip, height - index * rows_per_strip)) * row_bytes
+            for index in range(strip_count)
+        ]
+
+        short, long = 3, 4
+        entries = [
+            (256, long, [width]),
+            (257, long, [height]),
+            (258, short, [8] * channels),
+            (259, short, [1]),
+            (262, short, [1 if channels == 1 else 2]),
+            (273, offset_type, strip_offsets),
+            (277, short, [channels]),
+            (278, long, [rows_per_strip]),
+            (279, offset_type, strip_counts),
+            (284, short, [1]),
+        ]
+        if channels == 4:
+            # Альфа-канал без предварительного умножения
+            entries.append((338, short, [2]))
+
+        # Значения, не помещающиеся в запись каталога, пишутся перед ним
+        formats = {short: "H", long: "I", 16: "Q"}
+        fields = []
+        for tag, kind, values in entries:
+            data = struct.pack(f"<{len(values)}{formats[kind]}", *values)
+            if len(data) > offset_size:
+                position = f.tell()
+                f.write(data + b"\0" * (len(data) % 2))
+                data = struct.pack(f"<{offset}", position)
+            fields.append(
+                struct.pack(f"<HH{offset}", tag, kind, len(values))
+                + data.ljust(offset_size, b"\0")
+            )
+
+        ifd_offset = f.tell()
+        f.write(struct.pack("<Q" if big else "<H", len(fields)))
+        f.write(b"".join(fields))
+        f.write(struct.pack(f"<{offset}", 0))
+
+        f.seek(0)
+        if big:
+            f.write(b"II+\0" + struct.pack("<HHQ", 8, 0, ifd_offset))
+        else:
+            f.write(b"II*\0" + struct.pack("<I", ifd_offset))
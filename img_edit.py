@@ -2,6 +2,9 @@
 
 import sys
 import os
+import math
+import inspect
+import threading
 from PyQt6.QtWidgets import (
     QApplication,
     QMainWindow,
@@ -38,8 +41,20 @@ from PyQt6.QtWidgets import (
     QDialogButtonBox,
     QSlider,
     QSpinBox,
+    QDoubleSpinBox,
+)
+from PyQt6.QtCore import (
+    Qt,
+    QPoint,
+    QPointF,
+    QRect,
+    QRectF,
+    QSize,
+    QObject,
+    QEventLoop,
+    pyqtSignal,
+    QTimer,
 )
-from PyQt6.QtCore import Qt, QPoint, QRect, QSize, QThread, pyqtSignal, QTimer
 from PyQt6.QtGui import (
     QPainter,
     QPen,
@@ -48,6 +63,7 @@ from PyQt6.QtGui import (
     QPixmap,
     QImage,
     QFont,
+    QFontMetrics,
     QIcon,
     QPalette,
     QAction,
@@ -59,456 +75,367 @@ from PyQt6.QtGui import (
     QPaintEvent,
     QClipboard,
     QLinearGradient,
+    QRadialGradient,
 )
-from PIL import Image, ImageEnhance, ImageFilter, ImageDraw, ImageFont, ImageOps
+from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 import cv2
 
-
-class ImageProcessor(QThread):
-    """Поток для обработки изображений"""
+from image_convert import (
+    array_to_pixmap,
+    array_to_qimage,
+    pil_to_pixmap,
+    pil_to_qimage,
+    qimage_to_array,
+    qimage_to_pil,
+)
+from image_cache import MemoryCache, file_key
+from image_history import TileHistory
+from image_jobs import JobCancelled, JobQueue
+from image_layers import BLEND_MODES, Layer, LayerStack
+from image_strokes import DabSpacer, dab_bounds
+from image_thumbnails import ThumbnailCache, decode_reduced, read_size
+from image_tiles import TiledImage
+import image_engine
+import image_export
+import image_ops
+import image_parallel
+
+
+class ImageProcessor(QObject):
+    """Задача обработки изображения для очереди JobQueue.
+
+    Вычисления идут в рабочем потоке пула, а сигналы finished и error
+    испускаются в главном потоке и только для неотмененных задач.
+    Загрузка с параметром preview_size=(ширина, высота) сначала испускает
+    preview с быстро декодированной уменьшенной копией (если формат это
+    позволяет), а затем finished с полным изображением.
+
+    Загрузка с out_of_core=True и операции над TiledImage работают с
+    изображением вне памяти: finished получает уменьшенную копию, а само
+    хранилище - в tiled_result.
+    """
 
     finished = pyqtSignal(QPixmap)
+    preview = pyqtSignal(QPixmap)
     progress = pyqtSignal(int)
     error = pyqtSignal(str)
 
-    def __init__(self, image_path=None, image_data=None, operation="load", **kwargs):
+    def __init__(
+        self,
+        image_path=None,
+        image_data=None,
+        operation="load",
+        image_source=None,
+        use_processes=False,
+        **kwargs,
+    ):
         super().__init__()
         self.image_path = image_path
         self.image_data = image_data
+        self.image_source = image_source
+        self.use_processes = use_processes
         self.operation = operation
         self.kwargs = kwargs
+        self.cancel_event = threading.Event()
+        self.result = None
+        self.tiled_result = None
+        self.error_message = None
 
-    def run(self):
-        try:
-            if self.operation == "load":
-                self.load_image()
-            elif self.operation == "filters":
-                self.apply_filters()
-            elif self.operation == "remove_background":
-                self.remove_background()
-            elif self.operation == "blur":
-                self.apply_blur()
-            elif self.operation == "sharpen":
-                self.apply_sharpen()
-            elif self.operation == "unsharp_mask":
-                self.apply_unsharp_mask()
-            elif self.operation == "noise_reduction":
-                self.apply_noise_reduction()
-            elif self.operation == "grayscale":
-                self.apply_grayscale()
-            elif self.operation == "noise":
-                self.apply_noise()
-            elif self.operation == "sketch_effect":
-                self.apply_sketch_effect()
-            elif self.operation == "glass_effect":
-                self.apply_glass_effect()
-            elif self.operation == "wave_effect":
-                self.apply_wave_effect()
-            elif self.operation == "glow_effect":
-                self.apply_glow_effect()
-            elif self.operation == "shadow_effect":
-                self.apply_shadow_effect()
-            elif self.operation == "auto_levels":
-                self.apply_auto_levels()
-            elif self.operation == "auto_contrast":
-                self.apply_auto_contrast()
-            elif self.operation == "color_balance":
-                self.apply_color_balance()
-
-        except Exception as e:
-            self.error.emit(str(e))
-
-    def load_image(self):
-        img = Image.open(self.image_path)
-        self.progress.emit(50)
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_filters(self):
-        brightness = self.kwargs.get("brightness", 1.0)
-        contrast = self.kwargs.get("contrast", 1.0)
-        saturation = self.kwargs.get("saturation", 1.0)
-
-        img = Image.open(self.image_path)
-        self.progress.emit(25)
+    def cancel(self):
+        """Отменяет задачу (выполняемая остановится на ближайшем шаге)"""
+        self.cancel_event.set()
 
-        if brightness != 1.0:
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(brightness)
-        self.progress.emit(50)
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
 
-        if contrast != 1.0:
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(contrast)
-        self.progress.emit(75)
+    def prepare(self):
+        """Снимает исходное изображение перед запуском (главный поток).
 
-        if saturation != 1.0:
-            enhancer = ImageEnhance.Color(img)
-            img = enhancer.enhance(saturation)
-        self.progress.emit(90)
-
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def remove_background(self):
-        img = Image.open(self.image_path)
-        self.progress.emit(30)
-
-        #*  Конвертируем в RGBA
-        img = img.convert("RGBA")
-        data = img.getdata()
-
-        self.progress.emit(60)
-
-        new_data = []
-        threshold = self.kwargs.get("threshold", 240)
+        image_source вызывается в момент запуска, а не постановки в очередь,
+        поэтому задача видит результат предыдущих задач своей полосы.
+        """
+        if self.image_source is not None:
+            self.image_data = self.image_source()
+
+    def report_progress(self, value):
+        """Сообщает прогресс и прерывает отмененную задачу"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.progress.emit(value)
+
+    def set_result(self, pixmap):
+        self.result = pixmap
+
+    def deliver(self):
+        """Выдает результат в главном потоке"""
+        if self.is_cancelled():
+            if self.tiled_result is not None:
+                self.tiled_result.close()
+            return
+        if isinstance(self.image_data, TiledImage) and self.tiled_result is not None:
+            # Результат операции по тайлам заменяет содержимое хранилища
+            # до запуска следующей задачи полосы
+            self.image_data.replace(self.tiled_result)
+        if self.error_message is not None:
+            self.error.emit(self.error_message)
+        elif self.result is not None:
+            self.finished.emit(self.result)
 
-        for item in data:
-            # Делаем белые пиксели прозрачными
-            if item[0] > threshold and item[1] > threshold and item[2] > threshold:
-                new_data.append((255, 255, 255, 0))
+    def run(self):
+        if self.is_cancelled():
+            return
+        try:
+            if self.operation == "load":
+                self.load_image()
             else:
-                new_data.append(item)
-
-        img.putdata(new_data)
-        self.progress.emit(90)
-
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_blur(self):
-        img = Image.open(self.image_path)
-        radius = self.kwargs.get("radius", 2)
-
-        self.progress.emit(50)
-        img = img.filter(ImageFilter.GaussianBlur(radius=radius))
-        self.progress.emit(90)
-
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_sharpen(self):
-        img = Image.open(self.image_path)
-        self.progress.emit(50)
-
-        img = img.filter(ImageFilter.SHARPEN)
-        self.progress.emit(90)
-
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_unsharp_mask(self):
-        """Увеличение резкости с помощью маски нерезкости"""
-        img = Image.open(self.image_path)
-        self.progress.emit(30)
-
-        img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=150, threshold=3))
-        self.progress.emit(90)
-
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_noise_reduction(self):
-        """Шумоподавление"""
-        img = Image.open(self.image_path)
-        self.progress.emit(30)
-
-        # Применяем медианный фильтр для уменьшения шума
-        img = img.filter(ImageFilter.MedianFilter(size=3))
-        self.progress.emit(90)
-
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_grayscale(self):
-        """Преобразование в черно-белое"""
-        img = Image.open(self.image_path)
-        self.progress.emit(50)
-
-        img = img.convert("L").convert("RGB")
-        self.progress.emit(90)
-
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_noise(self):
-        """Добавление шума"""
-        img = Image.open(self.image_path)
-        img_array = np.array(img)
-        self.progress.emit(30)
-
-        # Добавляем случайный шум
-        noise = np.random.normal(0, 25, img_array.shape).astype(np.uint8)
-        noisy_img = np.clip(img_array.astype(np.int16) + noise, 0, 255).astype(np.uint8)
-
-        self.progress.emit(70)
-
-        img = Image.fromarray(noisy_img)
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_sketch_effect(self):
-        """Эффект рисунка"""
-        img = Image.open(self.image_path)
-        self.progress.emit(30)
-
-        # Преобразуем в оттенки серого
-        img_gray = img.convert("L")
-
-        # Инвертируем изображение
-        img_inverted = ImageOps.invert(img_gray)
+                self.apply_operation()
+        except JobCancelled:
+            pass
+        except Exception as e:
+            self.error_message = str(e)
 
-        # Применяем размытие
-        img_blur = img_inverted.filter(ImageFilter.GaussianBlur(radius=21))
+    def open_source(self):
+        """Возвращает исходное изображение для обработки.
 
-        # Создаем эффект карандашного рисунка
-        def dodge(front, back):
-            # Избегаем деления на ноль
-            back_safe = np.where(back == 255, 254, back)
-            result = front * 255.0 / (255 - back_safe)
-            result = np.clip(result, 0, 255)
-            return result.astype(np.uint8)
+        Если передан буфер холста (QImage), работаем с ним напрямую и не
+        обращаемся к диску - так эффекты применяются поверх уже сделанных правок.
+        """
+        if self.image_data is not None:
+            return qimage_to_pil(self.image_data)
+        return Image.open(self.image_path)
 
-        front = np.array(img_gray)
-        back = np.array(img_blur)
+    def load_image(self):
+        if self.kwargs.get("out_of_core"):
+            self.load_tiled()
+            return
 
-        try:
-            sketch = dodge(front, back)
-            # Убеждаемся, что результат корректный
-            if sketch.min() < 0 or sketch.max() > 255:
-                # Если что-то пошло не так, применяем простой эффект
-                sketch = np.clip(front + (255 - back) // 2, 0, 255).astype(np.uint8)
-        except:
-            # Резервный вариант - простое инвертирование
-            sketch = 255 - np.array(img_gray)
-
-        self.progress.emit(90)
-
-        img = Image.fromarray(sketch, mode="L").convert("RGB")
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
+        preview_size = self.kwargs.get("preview_size")
+        if preview_size is not None:
+            reduced = decode_reduced(self.image_path, preview_size)
+            if reduced is not None:
+                self.report_progress(20)
+                self.preview.emit(pil_to_pixmap(reduced[0]))
 
-    def apply_glass_effect(self):
-        """Эффект стекла"""
         img = Image.open(self.image_path)
-        img_array = np.array(img)
-        self.progress.emit(30)
-
-        # Создаем искажение для эффекта стекла
-        height, width = img_array.shape[:2]
-
-        # Генерируем случайные смещения
-        displacement_x = np.random.randint(-5, 6, (height, width))
-        displacement_y = np.random.randint(-5, 6, (height, width))
-
-        # Применяем искажение
-        y_indices, x_indices = np.meshgrid(
-            np.arange(height), np.arange(width), indexing="ij"
+        self.report_progress(50)
+        pixmap = pil_to_pixmap(img)
+        self.report_progress(100)
+        self.set_result(pixmap)
+
+    def load_tiled(self):
+        """Переносит изображение в хранилище на диске"""
+        self.tiled_result = TiledImage.from_file(
+            self.image_path,
+            progress=lambda done, total: self.report_progress(80 * done // total),
         )
-        new_x = np.clip(x_indices + displacement_x, 0, width - 1)
-        new_y = np.clip(y_indices + displacement_y, 0, height - 1)
-
-        if len(img_array.shape) == 3:
-            glass_img = img_array[new_y, new_x]
-        else:
-            glass_img = img_array[new_y, new_x]
-
-        self.progress.emit(90)
-
-        img = Image.fromarray(glass_img)
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def apply_wave_effect(self):
-        """Эффект волн"""
-        img = Image.open(self.image_path)
-        img_array = np.array(img)
-        self.progress.emit(30)
-
-        height, width = img_array.shape[:2]
-
-        # Создаем волновые искажения
-        y_indices, x_indices = np.meshgrid(
-            np.arange(height), np.arange(width), indexing="ij"
+        self.set_result(array_to_pixmap(self.tiled_result.overview()))
+        self.report_progress(100)
+
+    def apply_tiled(self):
+        """Выполняет операцию над изображением вне памяти по тайлам"""
+        self.tiled_result = self.image_data.apply(
+            self.operation,
+            progress=lambda done, total: self.report_progress(90 * done // total),
+            **self.kwargs,
         )
+        self.set_result(array_to_pixmap(self.tiled_result.overview()))
+        self.report_progress(100)
 
-        # Параметры волн
-        amplitude = 20
-        frequency = 0.05
+    def apply_operation(self):
+        """Выполняет операцию image_ops над исходным изображением"""
+        if isinstance(self.image_data, TiledImage):
+            self.apply_tiled()
+            return
 
-        # Применяем синусоидальные искажения
-        new_x = x_indices + amplitude * np.sin(frequency * y_indices)
-        new_y = y_indices + amplitude * np.sin(frequency * x_indices)
+        img = self.open_source()
+        self.report_progress(30)
 
-        # Обрезаем значения по границам
-        new_x = np.clip(new_x, 0, width - 1).astype(int)
-        new_y = np.clip(new_y, 0, height - 1).astype(int)
+        operation = image_ops.OPERATIONS[self.operation]
+        kwargs = dict(self.kwargs)
+        if "use_processes" in inspect.signature(operation).parameters:
+            kwargs["use_processes"] = self.use_processes
+        result = operation(img, **kwargs)
+        self.report_progress(90)
 
-        if len(img_array.shape) == 3:
-            wave_img = img_array[new_y, new_x]
+        if isinstance(result, np.ndarray):
+            pixmap = array_to_pixmap(result)
         else:
-            wave_img = img_array[new_y, new_x]
+            pixmap = pil_to_pixmap(result)
+        self.report_progress(100)
+        self.set_result(pixmap)
 
-        self.progress.emit(90)
 
-        img = Image.fromarray(wave_img)
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
+class ExportJob(QObject):
+    """Задача очереди JobQueue: запись изображения в файл.
 
-    def apply_glow_effect(self):
-        """Эффект свечения"""
-        img = Image.open(self.image_path)
-        self.progress.emit(30)
+    Изображение (снимок холста QImage или TiledImage) кодируется в рабочем
+    потоке; файл записывается атомарно, поэтому отмена или ошибка не портят
+    прежний файл.
+    """
 
-        # Создаем копию для свечения
-        glow = img.filter(ImageFilter.GaussianBlur(radius=15))
+    finished = pyqtSignal(str)
+    progress = pyqtSignal(int)
+    error = pyqtSignal(str)
 
-        # Усиливаем яркость для свечения
-        enhancer = ImageEnhance.Brightness(glow)
-        glow = enhancer.enhance(1.5)
+    def __init__(self, image, path, image_format=None, **options):
+        super().__init__()
+        self.image = image
+        self.path = path
+        self.image_format = image_format
+        self.options = options
+        self.cancel_event = threading.Event()
+        self.saved = False
+        self.error_message = None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def prepare(self):
+        pass
+
+    def report_progress(self, done, total):
+        """Сообщает прогресс и прерывает отмененную запись"""
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.progress.emit(100 * done // total)
 
-        # Смешиваем оригинал со свечением
-        result = Image.blend(img, glow, 0.3)
+    def run(self):
+        if self.cancel_event.is_set():
+            return
+        try:
+            if isinstance(self.image, TiledImage):
+                self.image.save(
+                    self.path,
+                    self.image_format,
+                    progress=self.report_progress,
+                    **self.options,
+                )
+            else:
+                image_ops.save_image(
+                    qimage_to_pil(self.image),
+                    self.path,
+                    self.image_format,
+                    progress=self.report_progress,
+                    **self.options,
+                )
+            self.saved = True
+        except JobCancelled:
+            pass
+        except Exception as e:
+            self.error_message = str(e)
 
-        self.progress.emit(90)
+    def deliver(self):
+        if self.cancel_event.is_set():
+            return
+        if self.error_message is not None:
+            self.error.emit(self.error_message)
+        elif self.saved:
+            self.finished.emit(self.path)
 
-        pixmap = self.pil_to_pixmap(result)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
 
-    def apply_auto_levels(self):
-        """Автоматическая коррекция уровней"""
-        img = Image.open(self.image_path)
-        self.progress.emit(50)
+class PresetComparisonJob(QObject):
+    """Задача очереди JobQueue: сравнение профилей экспорта.
 
-        img = ImageOps.autocontrast(img)
-        self.progress.emit(90)
+    Снимок холста кодируется всеми профилями в память; результат - список
+    (профиль, размер в байтах, секунды) из image_export.compare_presets.
+    """
 
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
+    finished = pyqtSignal(list)
+    progress = pyqtSignal(int)
+    error = pyqtSignal(str)
 
-    def apply_auto_contrast(self):
-        """Автоматическая коррекция контраста"""
-        img = Image.open(self.image_path)
-        self.progress.emit(50)
+    def __init__(self, image, image_format, info=None):
+        super().__init__()
+        self.image = image
+        self.image_format = image_format
+        self.info = info
+        self.cancel_event = threading.Event()
+        self.results = None
+        self.error_message = None
 
-        img = ImageOps.autocontrast(img, cutoff=1)
-        self.progress.emit(90)
+    def cancel(self):
+        self.cancel_event.set()
 
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
+    def prepare(self):
+        pass
 
-    def apply_color_balance(self):
-        """Коррекция цветового баланса"""
-        img = Image.open(self.image_path)
-        img_array = np.array(img)
-        self.progress.emit(30)
-
-        # Получаем значения коррекции
-        red_cyan = self.kwargs.get("red_cyan", 0)
-        green_magenta = self.kwargs.get("green_magenta", 0)
-        blue_yellow = self.kwargs.get("blue_yellow", 0)
-
-        # Применяем коррекцию к каждому каналу
-        if len(img_array.shape) == 3:
-            # Красный-Голубой
-            img_array[:, :, 0] = np.clip(img_array[:, :, 0] + red_cyan * 2.55, 0, 255)
-            # Зеленый-Пурпурный
-            img_array[:, :, 1] = np.clip(
-                img_array[:, :, 1] + green_magenta * 2.55, 0, 255
-            )
-            # Синий-Желтый
-            img_array[:, :, 2] = np.clip(
-                img_array[:, :, 2] + blue_yellow * 2.55, 0, 255
+    def report_progress(self, done, total):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.progress.emit(100 * done // total)
+
+    def run(self):
+        if self.cancel_event.is_set():
+            return
+        try:
+            self.results = image_export.compare_presets(
+                qimage_to_pil(self.image),
+                self.image_format,
+                self.info,
+                progress=self.report_progress,
             )
+        except JobCancelled:
+            pass
+        except Exception as e:
+            self.error_message = str(e)
 
-        self.progress.emit(90)
+    def deliver(self):
+        if self.cancel_event.is_set():
+            return
+        if self.error_message is not None:
+            self.error.emit(self.error_message)
+        elif self.results is not None:
+            self.finished.emit(self.results)
 
-        img = Image.fromarray(img_array.astype(np.uint8))
-        pixmap = self.pil_to_pixmap(img)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
 
-    def apply_shadow_effect(self):
-        """Эффект теней"""
-        img = Image.open(self.image_path)
-        self.progress.emit(30)
+class ThumbnailJob:
+    """Задача очереди JobQueue: миниатюры для группы файлов списка.
 
-        # Создаем тень
-        shadow = img.convert("RGBA")
+    Миниатюры читаются из кэша или строятся в рабочем потоке; callback
+    вызывается в главном потоке для каждой готовой миниатюры.
+    """
 
-        # Создаем черную тень
-        shadow_data = []
-        for pixel in shadow.getdata():
-            # Делаем пиксель темнее для тени
-            shadow_data.append(
-                (0, 0, 0, int(pixel[3] * 0.5) if len(pixel) == 4 else 128)
-            )
+    def __init__(self, cache, paths, callback):
+        self.cache = cache
+        self.paths = paths
+        self.callback = callback
+        self.cancel_event = threading.Event()
+        self.results = []
 
-        shadow.putdata(shadow_data)
+    def cancel(self):
+        self.cancel_event.set()
 
-        # Размываем тень
-        shadow = shadow.filter(ImageFilter.GaussianBlur(radius=5))
+    def prepare(self):
+        pass
 
-        # Создаем новое изображение с тенью
-        result = Image.new(
-            "RGBA", (img.width + 10, img.height + 10), (255, 255, 255, 0)
-        )
-        result.paste(shadow, (5, 5))  # Смещение тени
-        result.paste(img, (0, 0))  # Оригинальное изображение сверху
-
-        self.progress.emit(90)
-
-        pixmap = self.pil_to_pixmap(result)
-        self.progress.emit(100)
-        self.finished.emit(pixmap)
-
-    def pil_to_pixmap(self, img):
-        """Конвертирует PIL изображение в QPixmap"""
-        if img.mode == "RGBA":
-            img_rgb = img
-            h, w, ch = np.array(img_rgb).shape
-            bytes_per_line = ch * w
-            qt_image = QImage(
-                np.array(img_rgb).data,
-                w,
-                h,
-                bytes_per_line,
-                QImage.Format.Format_RGBA8888,
-            )
-        else:
-            img_rgb = img.convert("RGB")
-            h, w, ch = np.array(img_rgb).shape
-            bytes_per_line = ch * w
-            qt_image = QImage(
-                np.array(img_rgb).data,
-                w,
-                h,
-                bytes_per_line,
-                QImage.Format.Format_RGB888,
-            )
+    def run(self):
+        for path in self.paths:
+            if self.cancel_event.is_set():
+                return
+            try:
+                thumbnail, original_size = self.cache.get(path)
+            except Exception:
+                # Файл не читается как изображение - остается без миниатюры
+                continue
+            self.results.append((path, pil_to_qimage(thumbnail), original_size))
 
-        return QPixmap.fromImage(qt_image)
+    def deliver(self):
+        if self.cancel_event.is_set():
+            return
+        for path, thumbnail, original_size in self.results:
+            self.callback(path, thumbnail, original_size)
 
 
 class DrawingCanvas(QLabel):
     """Холст для рисования и редактирования изображений"""
 
+    # Состав или порядок слоев изменился
+    layers_changed = pyqtSignal()
+
+    # Сторона тайла, которыми кадр дорисовывается в режиме реального размера
+    display_tile_size = 512
+
     def __init__(self):
         super().__init__()
         self.setMinimumSize(600, 450)
@@ -526,24 +453,75 @@ class DrawingCanvas(QLabel):
 
         # Дополнительные инструменты
         self.fill_color = QColor(Qt.GlobalColor.white)
+        self.fill_tolerance = 0
+        self.fill_connectivity = 4
+        self.fill_selection_only = False
         self.gradient_start_color = QColor(Qt.GlobalColor.black)
         self.gradient_end_color = QColor(Qt.GlobalColor.white)
+        self.gradient_type = "linear"
+        # Конечная точка градиента во время перетаскивания (предпросмотр)
+        self.gradient_preview_end = None
         self.clone_source_point = None
         self.clone_offset = QPoint(0, 0)
+        self.clone_hardness = 0.5
+        # Штрих клонирования: снимок источника и изменяемая копия холста
+        self.clone_snapshot = None
+        self.clone_canvas = None
+        self.clone_pixels = None
         self.stamp_pattern = None
 
-        # История изменений
-        self.history = []
-        self.history_index = -1
-        self.max_history_size = 20
+        # Штрихи кисти, карандаша и ластика: точки ввода копятся и
+        # отрисовываются отпечатками раз в кадр в отдельный слой штриха
+        self.brush_spacing = 0.15  # шаг отпечатков в долях диаметра кисти
+        self.stroke_points = []
+        self.stroke_spacer = None
+        self.stroke_layer = None
+        self.stroke_base = None
+        self.stroke_target = None
+        self.stroke_rect = QRect()
+        self.stroke_timer = QTimer(self)
+        self.stroke_timer.setInterval(16)
+        self.stroke_timer.timeout.connect(self.flush_stroke)
+
+        # История изменений: хранит только измененные тайлы в пределах бюджета памяти
+        self.history = TileHistory(tile_size=256, memory_budget=512 * 1024 * 1024)
+        self.history_pending = False
+        # Метка незавершенного действия (см. add_to_history)
+        self.history_action = None
+        # Слой -> cacheKey его изображения при последней фиксации истории:
+        # пиксели неизмененных слоев не сравниваются с эталоном
+        self.history_keys = {}
 
         # Изображение
         self.image = QPixmap(600, 450)
         self.image.fill(Qt.GlobalColor.white)
+        self.history.reset(self.image_pixels())
         self.original_image = None
         self.backup_image = None
         self.actual_size_mode = False
 
+        # Уменьшенная копия загружаемого изображения: пока она показана,
+        # холст не принимает правок
+        self.loading_pixmap = None
+        # Холст показывает уменьшенную копию изображения вне памяти
+        self.read_only = False
+
+        # Слои над изображением холста; штрихи идут в активный слой
+        # (None - в само изображение)
+        self.layers = LayerStack()
+        self.active_layer = None
+        # Слой, поднятый инструментом перемещения: (слой, место в стеке)
+        self.floating_layer = None
+
+        # Кэш отображения: пирамида уменьшенных копий и готовый кадр
+        self.pyramid = []
+        self.pyramid_dirty_rect = QRect()
+        self.display_pixmap = None
+        self.display_image_key = None
+        self.display_image_size = QSize()
+        # Уже отрисованные тайлы кадра в режиме реального размера
+        self.display_tiles = set()
+
         # Текст
         self.text_font = QFont("Arial", 20)
         self.text_position = QPoint(50, 50)
@@ -569,18 +547,27 @@ class DrawingCanvas(QLabel):
         self.pasted_fragment = None
         self.fragment_position = QPoint(50, 50)
         self.dragging_fragment = False
+        # Смещение курсора от угла фрагмента при перетаскивании
+        self.fragment_grab_offset = QPoint()
+        # Фрагмент в масштабе отображения и ключ (фрагмент, размер) кэша
+        self.fragment_display = None
+        self.fragment_display_key = None
 
         self.setPixmap(self.image)
 
     def set_image(self, pixmap):
         """Устанавливает изображение на холст"""
+        self.loading_pixmap = None
         self.original_image = pixmap.copy()
         self.image = pixmap.copy()
         self.backup_image = pixmap.copy()
+        self.clear_layers()
 
         # Сбрасываем историю
-        self.history = [pixmap.copy()]
-        self.history_index = 0
+        self.history.reset(self.image_pixels())
+        self.history_pending = False
+        self.history_action = None
+        self.history_keys = {}
 
         # Обновляем отображение
         self.update_display()
@@ -624,22 +611,95 @@ class DrawingCanvas(QLabel):
         """Создает резервную копию текущего состояния"""
         self.backup_image = self.image.copy()
 
-    def add_to_history(self):
-        """Добавляет текущее состояние в историю"""
-        if not self.image:
-            return
+    def image_pixels(self):
+        """Возвращает пиксели холста как массив RGBA (альфа предумножена)"""
+        qimg = self.image.toImage().convertToFormat(
+            QImage.Format.Format_RGBA8888_Premultiplied
+        )
+        return qimage_to_array(qimg).copy()
 
-        # Удаляем все записи после текущего индекса (если мы отменили некоторые действия)
-        self.history = self.history[: self.history_index + 1]
+    def set_image_pixels(self, pixels):
+        """Устанавливает изображение холста из массива пикселей"""
+        # Непрозрачное изображение не должно получить альфа-канал после отмены
+        if (pixels[:, :, 3] == 255).all():
+            image_format = QImage.Format.Format_RGBX8888
+        else:
+            image_format = QImage.Format.Format_RGBA8888_Premultiplied
+        self.image = QPixmap.fromImage(array_to_qimage(pixels, image_format))
+
+    def layer_pixels(self):
+        """Пиксели слоев для истории: None у слоев, изображение которых не
+        менялось с прошлой фиксации"""
+        pixels, keys = {}, {}
+        for layer in self.layers:
+            keys[layer] = layer.image.cacheKey()
+            if self.history_keys.get(layer) == keys[layer]:
+                pixels[layer] = None
+            else:
+                pixels[layer] = qimage_to_array(layer.image).copy()
+        self.history_keys = keys
+        return pixels
+
+    def layer_state(self):
+        """Состав слоев снизу вверх и их свойства для истории"""
+        return tuple(
+            (
+                layer,
+                layer.position.x(),
+                layer.position.y(),
+                layer.opacity,
+                layer.blend_mode,
+                layer.visible,
+            )
+            for layer in self.layers
+        )
+
+    def restore_layers(self):
+        """Восстанавливает слои из истории после отмены или повтора"""
+        layers = []
+        for layer, x, y, opacity, blend_mode, visible in self.history.state or ():
+            # Эталон истории меняется на месте: слою нужна своя копия
+            layer.image = array_to_qimage(
+                self.history.layers[layer],
+                QImage.Format.Format_ARGB32_Premultiplied,
+            ).copy()
+            layer.position = QPoint(x, y)
+            layer.opacity = opacity
+            layer.blend_mode = blend_mode
+            layer.visible = visible
+            layers.append(layer)
+        self.layers.replace(layers)
+        self.history_keys = {layer: layer.image.cacheKey() for layer in layers}
+        if self.active_layer not in layers:
+            self.active_layer = None
+        self.layers_changed.emit()
+
+    def commit_history(self):
+        """Фиксирует изменения незавершенного действия как шаг истории"""
+        if self.history_pending:
+            self.history_pending = False
+            self.history.commit(
+                self.image_pixels(), self.layer_pixels(), self.layer_state()
+            )
 
-        # Добавляем новое состояние
-        self.history.append(self.image.copy())
-        self.history_index += 1
+    def add_to_history(self, action=None):
+        """Отмечает начало нового действия в истории.
 
-        # Ограничиваем размер истории
-        if len(self.history) > self.max_history_size:
-            self.history.pop(0)
-            self.history_index -= 1
+        Изменения предыдущего действия (изображения и слоев) сохраняются
+        как разница тайлов с эталоном, а отмененные шаги отбрасываются.
+        Подряд идущие действия с одной меткой action (например, движение
+        ползунка непрозрачности слоя) образуют один шаг.
+        """
+        if not self.image:
+            return
+        if self.history_pending and action is not None:
+            if action == self.history_action:
+                return
+
+        self.commit_history()
+        self.history.discard_redo()
+        self.history_pending = True
+        self.history_action = action
 
         # Обновляем интерфейс истории
         if hasattr(self.parent(), "update_history_ui"):
@@ -647,17 +707,26 @@ class DrawingCanvas(QLabel):
 
     def can_undo(self):
         """Проверяет, можно ли отменить действие"""
-        return self.history_index > 0
+        return self.history_pending or self.history.can_undo()
 
     def can_redo(self):
         """Проверяет, можно ли повторить действие"""
-        return self.history_index < len(self.history) - 1
+        return not self.history_pending and self.history.can_redo()
 
     def undo_action(self):
         """Отменяет последнее действие"""
+        if self.floating_layer is not None:
+            # Поднятый слой не теряется, а возвращается на прежнее место
+            # до фиксации истории
+            layer, index = self.floating_layer
+            self.floating_layer = None
+            self.layers.add(layer, index)
+            self.pasted_fragment = None
+            self.dragging_fragment = False
+        self.commit_history()
         if self.can_undo():
-            self.history_index -= 1
-            self.image = self.history[self.history_index].copy()
+            self.set_image_pixels(self.history.undo())
+            self.restore_layers()
             self.update_display()
 
             # Очищаем состояние вставленного фрагмента при отмене
@@ -675,8 +744,8 @@ class DrawingCanvas(QLabel):
     def redo_action(self):
         """Повторяет отмененное действие"""
         if self.can_redo():
-            self.history_index += 1
-            self.image = self.history[self.history_index].copy()
+            self.set_image_pixels(self.history.redo())
+            self.restore_layers()
             self.update_display()
 
             # Обновляем интерфейс истории
@@ -691,57 +760,526 @@ class DrawingCanvas(QLabel):
             self.image = self.backup_image.copy()
             self.update_display()
 
-    def update_display(self):
-        """Обновляет отображение изображения"""
-        if not self.image:
-            return
-
+    def display_size(self):
+        """Вычисляет размер отображаемого изображения"""
         if self.actual_size_mode:
             # Показываем в реальном размере с учетом масштаба
-            new_width = int(self.image.width() * self.zoom_factor)
-            new_height = int(self.image.height() * self.zoom_factor)
-            display_pixmap = self.image.scaled(
-                QSize(new_width, new_height),
-                Qt.AspectRatioMode.IgnoreAspectRatio,
-                Qt.TransformationMode.SmoothTransformation,
-            )
+            size = self.image.size()
         else:
-            # Обычный режим - масштабируем под размер виджета с учетом zoom_factor
+            # Подгоняем под размер виджета (с отступами), сохраняя пропорции
             widget_size = self.size()
-            # Оставляем небольшие отступы
             target_size = QSize(widget_size.width() - 20, widget_size.height() - 20)
+            size = self.image.size().scaled(
+                target_size, Qt.AspectRatioMode.KeepAspectRatio
+            )
+
+        return QSize(
+            max(1, int(size.width() * self.zoom_factor)),
+            max(1, int(size.height() * self.zoom_factor)),
+        )
+
+    def rebuild_pyramid(self, source):
+        """Строит пирамиду уменьшенных копий изображения (каждая вдвое меньше)"""
+        self.pyramid = []
+        level = source
+        while level.width() > 256 and level.height() > 256:
+            level = level.scaled(
+                level.width() // 2,
+                level.height() // 2,
+                Qt.AspectRatioMode.IgnoreAspectRatio,
+                Qt.TransformationMode.SmoothTransformation,
+            )
+            self.pyramid.append(level)
+        self.pyramid_dirty_rect = QRect()
+
+    def refresh_pyramid(self, source, rect):
+        """Пересчитывает уровни пирамиды только в измененной области"""
+        for level in self.pyramid:
+            scale_x = level.width() / source.width()
+            scale_y = level.height() / source.height()
+            target_rect = self.map_rect(rect, scale_x, scale_y, level.rect())
+
+            painter = QPainter(level)
+            painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+            painter.drawPixmap(
+                QRectF(target_rect),
+                source,
+                self.unmap_rect(target_rect, scale_x, scale_y),
+            )
+            painter.end()
+
+            source = level
+            rect = target_rect
+        self.pyramid_dirty_rect = QRect()
+
+    @staticmethod
+    def map_rect(rect, scale_x, scale_y, bounds):
+        """Масштабирует прямоугольник с округлением наружу и обрезкой"""
+        left = math.floor(rect.left() * scale_x) - 1
+        top = math.floor(rect.top() * scale_y) - 1
+        right = math.ceil((rect.right() + 1) * scale_x) + 1
+        bottom = math.ceil((rect.bottom() + 1) * scale_y) + 1
+        return QRect(left, top, right - left, bottom - top).intersected(bounds)
+
+    @staticmethod
+    def unmap_rect(rect, scale_x, scale_y):
+        """Возвращает исходную область для масштабированного прямоугольника"""
+        return QRectF(
+            rect.left() / scale_x,
+            rect.top() / scale_y,
+            rect.width() / scale_x,
+            rect.height() / scale_y,
+        )
+
+    def update_display(self, dirty_rect=None):
+        """Обновляет отображение изображения.
+
+        Если передан dirty_rect (в координатах изображения) и кэш отображения
+        актуален, перерисовывается только эта область с быстрым
+        масштабированием. Полная перерисовка берет ближайший подходящий
+        уровень пирамиды и сглаживает результат.
+        """
+        if not self.image:
+            return
+        if self.loading_pixmap is not None:
+            self.show_loading_preview(self.loading_pixmap)
+            return
+
+        image = self.composed_image(dirty_rect)
+        target_size = self.display_size()
+        cache_valid = (
+            self.display_pixmap is not None
+            and self.display_pixmap.size() == target_size
+            and self.display_image_size == image.size()
+        )
 
-            # Сначала подгоняем под размер виджета, сохраняя пропорции
-            fitted_pixmap = self.image.scaled(
+        if dirty_rect is not None and cache_valid:
+            # Быстрый путь: дорисовываем в кэш только измененную область
+            scale_x = target_size.width() / image.width()
+            scale_y = target_size.height() / image.height()
+            target_rect = self.map_rect(
+                dirty_rect, scale_x, scale_y, self.display_pixmap.rect()
+            )
+
+            painter = QPainter(self.display_pixmap)
+            painter.drawPixmap(
+                QRectF(target_rect),
+                image,
+                self.unmap_rect(target_rect, scale_x, scale_y),
+            )
+            painter.end()
+
+            self.pyramid_dirty_rect = self.pyramid_dirty_rect.united(dirty_rect)
+            self.display_image_key = image.cacheKey()
+            self.setPixmap(self.display_pixmap)
+            self.update()
+            return
+
+        source = self.display_source(image, target_size)
+        self.display_image_key = image.cacheKey()
+        self.display_image_size = image.size()
+
+        if self.actual_size_mode:
+            # Кадр в реальном размере бывает огромным: масштабируется только
+            # видимая часть, остальное дорисовывается при прокрутке
+            self.clear()
+            if self.display_pixmap is None or self.display_pixmap.size() != target_size:
+                self.display_pixmap = QPixmap(target_size)
+            self.display_pixmap.fill(Qt.GlobalColor.white)
+            self.display_tiles = set()
+            self.render_visible()
+        else:
+            self.display_pixmap = source.scaled(
                 target_size,
-                Qt.AspectRatioMode.KeepAspectRatio,
+                Qt.AspectRatioMode.IgnoreAspectRatio,
                 Qt.TransformationMode.SmoothTransformation,
             )
+            self.setPixmap(self.display_pixmap)
+        self.update()  # Принудительно обновляем виджет для перерисовки наложений
+
+    def display_source(self, image, target_size):
+        """Самый маленький уровень пирамиды, не меньший target_size.
+
+        Пирамида перед этим обновляется, если изображение заменено целиком
+        или изменено частично.
+        """
+        if image.cacheKey() != self.display_image_key:
+            self.rebuild_pyramid(image)
+        elif not self.pyramid_dirty_rect.isEmpty():
+            self.refresh_pyramid(image, self.pyramid_dirty_rect)
+
+        source = image
+        for level in self.pyramid:
+            if (
+                level.width() < target_size.width()
+                or level.height() < target_size.height()
+            ):
+                break
+            source = level
+        return source
+
+    def visible_display_rect(self):
+        """Видимая в области прокрутки часть кадра (в координатах кадра)"""
+        visible = self.rect()
+        viewport = self.parentWidget()
+        if viewport is not None:
+            visible = visible.intersected(
+                QRect(-self.x(), -self.y(), viewport.width(), viewport.height())
+            )
+        # Кадр выводится по центру виджета
+        offset = QPoint(
+            (self.width() - self.display_pixmap.width()) // 2,
+            (self.height() - self.display_pixmap.height()) // 2,
+        )
+        return visible.translated(-offset).intersected(self.display_pixmap.rect())
 
-            # Затем применяем zoom_factor
-            zoomed_width = int(fitted_pixmap.width() * self.zoom_factor)
-            zoomed_height = int(fitted_pixmap.height() * self.zoom_factor)
+    def render_visible(self):
+        """Дорисовывает видимые тайлы кадра в режиме реального размера"""
+        if (
+            not self.actual_size_mode
+            or self.display_pixmap is None
+            or self.loading_pixmap is not None
+        ):
+            return
+        visible = self.visible_display_rect()
+        if visible.isEmpty():
+            return
 
-            display_pixmap = fitted_pixmap.scaled(
-                QSize(zoomed_width, zoomed_height),
+        size = self.display_tile_size
+        tiles = [
+            (x, y)
+            for y in range(visible.top() // size, visible.bottom() // size + 1)
+            for x in range(visible.left() // size, visible.right() // size + 1)
+            if (x, y) not in self.display_tiles
+        ]
+        if not tiles:
+            return
+
+        image = self.composed_image()
+        source = self.display_source(image, self.display_pixmap.size())
+        scale_x = self.display_pixmap.width() / source.width()
+        scale_y = self.display_pixmap.height() / source.height()
+
+        # Надпись отдает свою копию кадра, чтобы рисование не копировало его
+        self.clear()
+        painter = QPainter(self.display_pixmap)
+        painter.setRenderHint(QPainter.RenderHint.SmoothPixmapTransform)
+        for x, y in tiles:
+            rect = QRect(x * size, y * size, size, size).intersected(
+                self.display_pixmap.rect()
+            )
+            painter.drawPixmap(
+                QRectF(rect), source, self.unmap_rect(rect, scale_x, scale_y)
+            )
+        painter.end()
+
+        self.display_tiles.update(tiles)
+        self.setPixmap(self.display_pixmap)
+
+    def show_loading_preview(self, pixmap):
+        """Показывает уменьшенную копию изображения, пока грузится полное"""
+        self.loading_pixmap = pixmap
+        target_size = pixmap.size().scaled(
+            QSize(self.width() - 20, self.height() - 20),
+            Qt.AspectRatioMode.KeepAspectRatio,
+        )
+        self.setPixmap(
+            pixmap.scaled(
+                target_size,
                 Qt.AspectRatioMode.IgnoreAspectRatio,
                 Qt.TransformationMode.SmoothTransformation,
             )
+        )
+        self.update()
 
-        self.setPixmap(display_pixmap)
-        self.update()  # Принудительно обновляем виджет для перерисовки наложений
+    def hide_loading_preview(self):
+        """Возвращает текущее изображение, если загрузка не состоялась"""
+        if self.loading_pixmap is None:
+            return
+        self.loading_pixmap = None
+        self.display_pixmap = None
+        self.update_display()
 
-    def add_text(self, text, position=None):
-        """Добавляет текст на изображение"""
-        if not text:
+    def show_preview(self, pixmap):
+        """Показывает предпросмотр вместо кэша отображения (None - убрать)"""
+        if self.display_pixmap is None:
             return
+        self.setPixmap(pixmap if pixmap is not None else self.display_pixmap)
+        self.update()
 
-        self.add_to_history()
+    def begin_stroke(self, point):
+        """Начинает штрих текущего инструмента (кисть, карандаш, ластик,
+        клонирование)"""
+        if self.current_tool == "clone":
+            self.begin_clone(point)
+            return
+        # Штрих рисуется в активный слой или в само изображение
+        self.stroke_target = self.active_layer
+        target = self.stroke_device()
+        size = target.size()
+        if self.stroke_layer is None or self.stroke_layer.size() != size:
+            # Слой живет между штрихами: очищается только область штриха
+            self.stroke_layer = QImage(
+                size, QImage.Format.Format_ARGB32_Premultiplied
+            )
+            self.stroke_layer.fill(Qt.GlobalColor.transparent)
+        # Изображение до штриха: слой каждый кадр накладывается на него заново,
+        # поэтому перекрытия отпечатков не накапливают прозрачность
+        if self.stroke_target is None:
+            self.stroke_base = self.image.toImage()
+        else:
+            self.stroke_base = target.copy()
+
+        width = 1 if self.current_tool == "pencil" else self.brush_size
+        self.stroke_spacer = DabSpacer(max(1.0, width * self.brush_spacing))
+        self.stroke_points = [(point.x(), point.y())]
+        self.stroke_rect = QRect()
+        self.stroke_timer.start()
+
+    def begin_clone(self, point):
+        """Начинает штрих клонирования.
+
+        Источник снимается в массив один раз за штрих: отпечатки берут
+        пиксели из снимка, а не из уже измененного холста, поэтому штрих
+        не размазывает сам себя.
+        """
+        self.stroke_target = None
+        self.clone_offset = self.clone_source_point - point
+        self.clone_canvas = self.image.toImage().convertToFormat(
+            QImage.Format.Format_RGBA8888_Premultiplied
+        )
+        self.clone_pixels = qimage_to_array(self.clone_canvas, writable=True)
+        self.clone_snapshot = self.clone_pixels.copy()
+
+        self.stroke_spacer = DabSpacer(max(1.0, self.brush_size * self.brush_spacing))
+        self.stroke_points = [(point.x(), point.y())]
+        self.stroke_rect = QRect()
+        self.stroke_timer.start()
+
+    def stamp_clone(self, dabs):
+        """Накладывает порцию мягких отпечатков клонирования одним проходом"""
+        radius = self.brush_size / 2
+        height, width = self.clone_snapshot.shape[:2]
+        dx, dy = self.clone_offset.x(), self.clone_offset.y()
+
+        # Область цели, для которой источник тоже лежит внутри изображения
+        left, top, right, bottom = dab_bounds(dabs, radius)
+        left, top = max(left, 0, -dx), max(top, 0, -dy)
+        right = min(right, width, width - dx)
+        bottom = min(bottom, height, height - dy)
+        if left >= right or top >= bottom:
+            return
+
+        alpha = image_engine.dab_alpha(
+            bottom - top, right - left, dabs - (left, top), radius, self.clone_hardness
+        )
+        image_engine.blend(
+            self.clone_pixels[top:bottom, left:right],
+            self.clone_snapshot[top + dy : bottom + dy, left + dx : right + dx],
+            alpha,
+        )
 
+        rect = QRect(left, top, right - left, bottom - top)
         painter = QPainter(self.image)
-        painter.setPen(QPen(self.brush_color, 2))
-        painter.setFont(self.text_font)
-        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.drawImage(rect, self.clone_canvas, rect)
+        painter.end()
+
+        self.stroke_rect = self.stroke_rect.united(rect)
+        self.update_display(rect)
+
+    def flush_stroke(self):
+        """Отрисовывает накопленные точки штриха и обновляет только
+        затронутую ими область"""
+        if self.stroke_spacer is None or not self.stroke_points:
+            return
+        dabs = self.stroke_spacer.add(self.stroke_points)
+        self.stroke_points = []
+        if not len(dabs):
+            return
+        if self.clone_snapshot is not None:
+            self.stamp_clone(dabs)
+            return
+        target = self.stroke_device()
+        offset = QPoint(0, 0)
+        if self.stroke_target is not None:
+            # Координаты отпечатков - в системе слоя
+            offset = self.stroke_target.position
+            dabs = dabs - (offset.x(), offset.y())
+
+        pencil = self.current_tool == "pencil"
+        erase = self.current_tool == "eraser"
+        if erase:
+            color = QColor(Qt.GlobalColor.white)
+        else:
+            color = QColor(self.brush_color)
+        # Отпечатки в слое непрозрачны, прозрачность цвета применяется
+        # к слою целиком
+        opacity = color.alphaF()
+        color.setAlpha(255)
+
+        painter = QPainter(self.stroke_layer)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(color)
+        if pencil:
+            radius = 0.5
+            for x, y in dabs:
+                painter.drawRect(QRectF(math.floor(x), math.floor(y), 1, 1))
+        else:
+            radius = self.brush_size / 2
+            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+            for x, y in dabs:
+                painter.drawEllipse(QPointF(x, y), radius, radius)
+        painter.end()
+
+        left, top, right, bottom = dab_bounds(dabs, radius)
+        rect = QRect(QPoint(left, top), QPoint(right, bottom)).intersected(
+            target.rect()
+        )
+        if rect.isEmpty():
+            return
+
+        painter = QPainter(target)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.drawImage(rect, self.stroke_base, rect)
+        if erase and target.hasAlphaChannel():
+            painter.setCompositionMode(
+                QPainter.CompositionMode.CompositionMode_DestinationOut
+            )
+        else:
+            painter.setCompositionMode(
+                QPainter.CompositionMode.CompositionMode_SourceOver
+            )
+        painter.setOpacity(opacity)
+        painter.drawImage(rect, self.stroke_layer, rect)
+        painter.end()
+
+        self.stroke_rect = self.stroke_rect.united(rect)
+        rect.translate(offset)
+        if self.stroke_target is not None:
+            self.layers.invalidate(rect)
+        self.update_display(rect)
+
+    def stroke_device(self):
+        """Изображение, в которое рисуется текущий штрих"""
+        if self.stroke_target is not None:
+            return self.stroke_target.image
+        return self.image
+
+    def end_stroke(self):
+        """Дорисовывает остаток штриха и очищает слой штриха"""
+        if self.stroke_spacer is None:
+            return
+        self.flush_stroke()
+        self.stroke_timer.stop()
+
+        if self.clone_snapshot is not None:
+            self.clone_snapshot = self.clone_canvas = self.clone_pixels = None
+        else:
+            painter = QPainter(self.stroke_layer)
+            painter.setCompositionMode(
+                QPainter.CompositionMode.CompositionMode_Clear
+            )
+            painter.fillRect(self.stroke_rect, Qt.GlobalColor.transparent)
+            painter.end()
+
+        self.stroke_spacer = None
+        self.stroke_base = None
+        self.stroke_target = None
+        self.stroke_rect = QRect()
+
+    def composed_image(self, dirty_rect=None):
+        """Изображение холста вместе со слоями (для показа и записи).
+
+        dirty_rect - измененная область изображения холста: кэш композиции
+        пересобирается только в ее тайлах.
+        """
+        if not len(self.layers):
+            return self.image
+        self.layers.set_background(self.image, dirty_rect)
+        return self.layers.refresh()
+
+    def add_layer(self, layer, index=None, activate=False):
+        """Добавляет слой; activate=True делает его активным.
+
+        Текст и вставки слоями по своему размеру активными не становятся:
+        иначе штрихи за их пределами обрезались бы границами слоя.
+        """
+        self.add_to_history()
+        self.layers.add(layer, index)
+        if activate:
+            self.active_layer = layer
+        self.update_display(layer.rect())
+        self.layers_changed.emit()
+        return layer
+
+    def remove_layer(self, layer):
+        self.add_to_history()
+        self.layers.remove(layer)
+        if self.active_layer is layer:
+            self.active_layer = None
+        self.update_display(layer.rect())
+        self.layers_changed.emit()
+
+    def update_layer(self, layer):
+        """Перерисовывает область слоя после изменения его свойств"""
+        self.layers.invalidate(layer.rect())
+        self.update_display(layer.rect())
+
+    def change_layer(self, layer, **properties):
+        """Меняет свойства слоя (opacity, blend_mode, visible) шагом истории.
+
+        Подряд идущие изменения тех же свойств слоя сливаются в один шаг.
+        """
+        self.add_to_history(("layer", layer, tuple(properties)))
+        for name, value in properties.items():
+            setattr(layer, name, value)
+        self.update_layer(layer)
+
+    def reorder_layer(self, layer, step):
+        self.add_to_history()
+        self.layers.reorder(layer, step)
+        self.update_display(layer.rect())
+        self.layers_changed.emit()
+
+    def clear_layers(self):
+        self.layers.clear()
+        self.active_layer = None
+        self.floating_layer = None
+        self.layers_changed.emit()
+
+    def flatten_layers(self):
+        """Сводит слои в изображение холста (шаг истории)"""
+        if not len(self.layers):
+            return
+        self.add_to_history()
+        self.image = self.composed_image().copy()
+        self.clear_layers()
+        self.update_display()
+
+    def lift_layer(self, point):
+        """Поднимает верхний слой под точкой для перемещения.
+
+        Пока слой перемещается, он показывается как вставленный фрагмент.
+        """
+        for index in range(len(self.layers) - 1, -1, -1):
+            layer = self.layers.layers[index]
+            if layer.visible and layer.rect().contains(point):
+                # Перемещение - отдельный шаг истории: он фиксируется, когда
+                # слой кладется обратно
+                self.add_to_history()
+                self.layers.remove(layer)
+                self.floating_layer = (layer, index)
+                self.pasted_fragment = QPixmap.fromImage(layer.image)
+                self.fragment_position = QPoint(layer.position)
+                self.update_display(layer.rect())
+                return True
+        return False
+
+    def add_text(self, text, position=None):
+        """Добавляет текст на изображение отдельным слоем"""
+        if not text:
+            return
 
         # Используем позицию, установленную при клике мыши
         text_pos = position if position else self.text_position
@@ -751,63 +1289,51 @@ class DrawingCanvas(QLabel):
         adjusted_pos = QPoint(text_pos.x(), adjusted_y)
 
         # Убеждаемся, что позиция находится в пределах изображения
-        if (
+        if not (
             adjusted_pos.x() >= 0
             and adjusted_pos.x() < self.image.width()
             and adjusted_pos.y() >= 0
             and adjusted_pos.y() < self.image.height()
         ):
-            painter.drawText(adjusted_pos, text)
-        else:
             # Если позиция вне изображения, размещаем в безопасном месте
-            safe_pos = QPoint(50, 50 + self.text_font.pointSize())
-            painter.drawText(safe_pos, text)
+            adjusted_pos = QPoint(50, 50 + self.text_font.pointSize())
 
+        # Слой по размеру текста; adjusted_pos - базовая линия
+        bounds = QFontMetrics(self.text_font).boundingRect(text)
+        bounds.adjust(-2, -2, 2, 2)
+        text_image = QImage(bounds.size(), QImage.Format.Format_ARGB32_Premultiplied)
+        text_image.fill(Qt.GlobalColor.transparent)
+
+        painter = QPainter(text_image)
+        painter.setPen(QPen(self.brush_color, 2))
+        painter.setFont(self.text_font)
+        painter.setRenderHint(QPainter.RenderHint.Antialiasing)
+        painter.drawText(-bounds.left(), -bounds.top(), text)
         painter.end()
-        self.update_display()
 
-    def remove_background(self, threshold=240):
+        self.add_layer(
+            Layer(text_image, adjusted_pos + bounds.topLeft(), f"Текст: {text[:20]}")
+        )
+
+    def remove_background(self, tolerance=15, feather=0, edge_connected=False):
         """Упрощенное удаление фона"""
         if self.original_image is None:
             return
 
         self.add_to_history()
 
-        # Конвертируем в PIL Image для обработки
-        qimg = self.image.toImage()
-        buffer = qimg.bits().asstring(qimg.sizeInBytes())
+        # Получаем RGBA-представление холста без копирования пикселей
+        qimg = self.image.toImage().convertToFormat(QImage.Format.Format_RGBA8888)
+        rgba = qimage_to_array(qimg)
 
-        if qimg.format() == QImage.Format.Format_RGB888:
-            pil_img = Image.frombuffer(
-                "RGB", (qimg.width(), qimg.height()), buffer, "raw", "RGB", 0, 1
-            )
-        else:
-            pil_img = Image.frombuffer(
-                "RGBA", (qimg.width(), qimg.height()), buffer, "raw", "RGBA", 0, 1
-            )
-
-        # Конвертируем в RGBA для прозрачности
-        pil_img = pil_img.convert("RGBA")
-        data = pil_img.getdata()
-
-        new_data = []
-        for item in data:
-            # Делаем белые пиксели прозрачными
-            if item[0] > threshold and item[1] > threshold and item[2] > threshold:
-                new_data.append((255, 255, 255, 0))
-            else:
-                new_data.append(item)
-
-        pil_img.putdata(new_data)
+        img_array = image_engine.remove_background(
+            rgba, tolerance=tolerance, feather=feather, edge_connected=edge_connected
+        )
 
         # Конвертируем обратно в QPixmap
-        img_array = np.array(pil_img)
-        h, w, ch = img_array.shape
-        bytes_per_line = ch * w
-        qt_image = QImage(
-            img_array.data, w, h, bytes_per_line, QImage.Format.Format_RGBA8888
+        self.image = QPixmap.fromImage(
+            array_to_qimage(img_array, QImage.Format.Format_RGBA8888)
         )
-        self.image = QPixmap.fromImage(qt_image)
 
         self.update_display()
 
@@ -817,10 +1343,35 @@ class DrawingCanvas(QLabel):
             self.image = self.original_image.copy()
             self.update_display()
 
+    def transform_layers(
+        self, transform, bounds, mode=Qt.TransformationMode.SmoothTransformation
+    ):
+        """Применяет к слоям то же преобразование, что и к изображению.
+
+        bounds - часть исходного изображения, которая становится новым
+        кадром (для обрезки - область обрезки): как и у QPixmap.transformed,
+        образ bounds начинается в точке (0, 0).
+        """
+        if not len(self.layers):
+            return
+        origin = transform.mapRect(QRectF(bounds)).topLeft()
+        # Без поворота и масштаба (обрезка) меняется только положение слоев
+        moves_only = transform.type() in (
+            QTransform.TransformationType.TxNone,
+            QTransform.TransformationType.TxTranslate,
+        )
+        for layer in self.layers:
+            area = transform.mapRect(QRectF(layer.rect()))
+            if not moves_only:
+                layer.image = layer.image.transformed(transform, mode)
+            layer.position = (area.topLeft() - origin).toPoint()
+        self.layers.invalidate()
+
     def crop_image(self, rect):
         """Обрезает изображение"""
         if rect.isValid():
             self.add_to_history()
+            self.transform_layers(QTransform(), rect)
             cropped = self.image.copy(rect)
             self.image = cropped
             self.update_display()
@@ -832,6 +1383,7 @@ class DrawingCanvas(QLabel):
         self.add_to_history()
         transform = QTransform()
         transform.rotate(angle)
+        self.transform_layers(transform, self.image.rect())
         self.image = self.image.transformed(
             transform, Qt.TransformationMode.SmoothTransformation
         )
@@ -843,9 +1395,13 @@ class DrawingCanvas(QLabel):
             return
         self.add_to_history()
         if horizontal:
-            self.image = self.image.transformed(QTransform().scale(-1, 1))
+            transform = QTransform().scale(-1, 1)
         else:
-            self.image = self.image.transformed(QTransform().scale(1, -1))
+            transform = QTransform().scale(1, -1)
+        self.transform_layers(
+            transform, self.image.rect(), Qt.TransformationMode.FastTransformation
+        )
+        self.image = self.image.transformed(transform)
         self.update_display()
 
     def resize_image(self, size):
@@ -853,11 +1409,19 @@ class DrawingCanvas(QLabel):
         if not self.image:
             return
         self.add_to_history()
+        old_size = self.image.size()
         self.image = self.image.scaled(
             size,
             Qt.AspectRatioMode.KeepAspectRatio,
             Qt.TransformationMode.SmoothTransformation,
         )
+        self.transform_layers(
+            QTransform.fromScale(
+                self.image.width() / old_size.width(),
+                self.image.height() / old_size.height(),
+            ),
+            QRect(QPoint(0, 0), old_size),
+        )
         self.update_display()
 
     def copy_selected_area(self):
@@ -878,8 +1442,8 @@ class DrawingCanvas(QLabel):
         # Создаем нормализованный прямоугольник
         normalized_rect = QRect(x, y, width, height)
 
-        # Копируем область из изображения
-        copied_pixmap = self.image.copy(normalized_rect)
+        # Копируем область из изображения (вместе со слоями)
+        copied_pixmap = self.composed_image().copy(normalized_rect)
 
         # Сохраняем во внутренний буфер
         self.clipboard_data = copied_pixmap
@@ -929,138 +1493,122 @@ class DrawingCanvas(QLabel):
         return False
 
     def apply_fragment_to_canvas(self):
-        """Применяет вставленный фрагмент к основному изображению"""
+        """Кладет вставленный фрагмент на холст отдельным слоем.
+
+        Слой остается редактируемым: его можно перемещать, менять
+        непрозрачность и режим наложения или свести с изображением.
+        """
         if not self.pasted_fragment:
             return
 
-        # Добавляем в историю перед применением фрагмента
-        self.add_to_history()
-
-        painter = QPainter(self.image)
-        painter.drawPixmap(self.fragment_position, self.pasted_fragment)
-        painter.end()
+        fragment, position = self.pasted_fragment, QPoint(self.fragment_position)
+        floating = self.floating_layer
 
         # Очищаем вставленный фрагмент
+        self.floating_layer = None
         self.pasted_fragment = None
-        self.update_display()
+        self.fragment_display = None
+        self.fragment_display_key = None
 
-        # Обновляем историю после применения
-        if hasattr(self.parent(), "update_history_ui"):
-            self.parent().update_history_ui()
+        if floating is None:
+            self.add_layer(Layer(fragment, position, "Вставка"))
+            return
+
+        # Перемещенный слой возвращается на свое место в стеке; шаг истории,
+        # начатый при подъеме слоя, фиксируется сразу
+        layer, index = floating
+        self.layers.add(layer, index)
+        self.layers.move(layer, position)
+        self.commit_history()
+        self.update_display(layer.rect())
+        self.layers_changed.emit()
 
     def flood_fill(self, start_point):
         """Заливка области одним цветом"""
         if not self.image:
             return
 
-        # Конвертируем в QImage для работы с пикселями
-        img = self.image.toImage()
+        # Работаем с пикселями QImage напрямую через NumPy-представление
+        img = self.image.toImage().convertToFormat(QImage.Format.Format_RGBA8888)
         target_color = img.pixelColor(start_point)
 
-        if target_color == self.fill_color:
+        if target_color == self.fill_color and self.fill_tolerance == 0:
             return  # Цвет уже такой же
 
-        # Простой алгоритм заливки
-        stack = [start_point]
-        visited = set()
-
-        while stack:
-            point = stack.pop()
-
-            if (
-                point.x() < 0
-                or point.x() >= img.width()
-                or point.y() < 0
-                or point.y() >= img.height()
-            ):
-                continue
-
-            if (point.x(), point.y()) in visited:
-                continue
-
-            current_color = img.pixelColor(point)
-            if current_color != target_color:
-                continue
-
-            img.setPixelColor(point, self.fill_color)
-            visited.add((point.x(), point.y()))
-
-            # Добавляем соседние пиксели
-            stack.extend(
-                [
-                    QPoint(point.x() + 1, point.y()),
-                    QPoint(point.x() - 1, point.y()),
-                    QPoint(point.x(), point.y() + 1),
-                    QPoint(point.x(), point.y() - 1),
-                ]
-            )
-
-        self.image = QPixmap.fromImage(img)
-        self.update_display()
-
-    def apply_gradient(self, start_point, end_point):
-        """Применяет градиент между двумя точками"""
-        if not self.image:
-            return
+        # Ограничиваем заливку выделенной областью
+        region = img.rect()
+        if self.fill_selection_only and self.selected_area:
+            region = region.intersected(self.selected_area.normalized())
+            if not region.contains(start_point):
+                return
 
-        painter = QPainter(self.image)
+        pixels = qimage_to_array(img, writable=True)
+        area = pixels[
+            region.top() : region.bottom() + 1, region.left() : region.right() + 1
+        ]
 
-        # Создаем линейный градиент с float координатами
-        gradient = QLinearGradient(
-            float(start_point.x()),
-            float(start_point.y()),
-            float(end_point.x()),
-            float(end_point.y()),
+        mask = image_engine.flood_fill_mask(
+            area,
+            (start_point.x() - region.left(), start_point.y() - region.top()),
+            tolerance=self.fill_tolerance,
+            connectivity=self.fill_connectivity,
         )
-        gradient.setColorAt(0, self.gradient_start_color)
-        gradient.setColorAt(1, self.gradient_end_color)
-
-        painter.setBrush(QBrush(gradient))
-        painter.setPen(Qt.PenStyle.NoPen)
-        painter.drawRect(self.image.rect())
-        painter.end()
+        image_engine.fill_mask(area, mask, self.fill_color.getRgb())
 
+        self.image = QPixmap.fromImage(img)
         self.update_display()
 
-    def apply_clone(self, target_point):
-        """Применяет клонирование"""
-        if not self.clone_source_point or not self.image:
-            return
+    def make_gradient(self, start, end):
+        """Градиент текущего типа между точками start и end (QPointF)"""
+        start_color, end_color = self.gradient_start_color, self.gradient_end_color
+        if self.gradient_type == "radial":
+            radius = math.hypot(end.x() - start.x(), end.y() - start.y())
+            gradient = QRadialGradient(start, radius)
+        elif self.gradient_type == "reflected":
+            # Симметрично относительно начальной точки
+            gradient = QLinearGradient(2 * start - end, end)
+            gradient.setColorAt(0.5, start_color)
+            start_color = end_color
+        else:
+            gradient = QLinearGradient(start, end)
+        gradient.setColorAt(0, start_color)
+        gradient.setColorAt(1, end_color)
+        return gradient
+
+    def gradient_area(self):
+        """Область заливки градиентом: выделение или все изображение"""
+        area = self.image.rect()
+        if self.selected_area and not self.selected_area.isEmpty():
+            area = area.intersected(self.selected_area.normalized())
+        return area
 
-        # Вычисляем смещение
-        offset = target_point - self.last_point if self.last_point else QPoint(0, 0)
-        source_point = self.clone_source_point + offset
+    def apply_gradient(self, start_point, end_point):
+        """Применяет градиент между двумя точками в полном разрешении.
 
-        # Проверяем границы
-        if (
-            source_point.x() < 0
-            or source_point.x() >= self.image.width()
-            or source_point.y() < 0
-            or source_point.y() >= self.image.height()
-        ):
+        Заливается только выделение (если оно есть); рисование идет
+        в активный слой или в само изображение.
+        """
+        if not self.image or start_point == end_point:
             return
 
-        painter = QPainter(self.image)
-
-        # Копируем область
-        brush_rect = QRect(
-            source_point.x() - self.brush_size // 2,
-            source_point.y() - self.brush_size // 2,
-            self.brush_size,
-            self.brush_size,
-        )
+        area = self.gradient_area()
+        layer = self.active_layer
+        target = layer.image if layer is not None else self.image
 
-        target_rect = QRect(
-            target_point.x() - self.brush_size // 2,
-            target_point.y() - self.brush_size // 2,
-            self.brush_size,
-            self.brush_size,
+        painter = QPainter(target)
+        if layer is not None:
+            painter.translate(-QPointF(layer.position))
+        painter.setClipRect(area)
+        painter.setPen(Qt.PenStyle.NoPen)
+        painter.setBrush(
+            QBrush(self.make_gradient(QPointF(start_point), QPointF(end_point)))
         )
-
-        painter.drawPixmap(target_rect, self.image, brush_rect)
+        painter.drawRect(area)
         painter.end()
 
-        self.update_display()
+        if layer is not None:
+            self.layers.invalidate(area)
+        self.update_display(area)
 
     def apply_stamp(self, position):
         """Применяет штамп"""
@@ -1087,11 +1635,21 @@ class DrawingCanvas(QLabel):
         """Устанавливает цвет заливки"""
         self.fill_color = color
 
+    def set_fill_options(self, tolerance, connectivity, selection_only):
+        """Устанавливает параметры заливки"""
+        self.fill_tolerance = tolerance
+        self.fill_connectivity = connectivity
+        self.fill_selection_only = selection_only
+
     def set_gradient_colors(self, start_color, end_color):
         """Устанавливает цвета градиента"""
         self.gradient_start_color = start_color
         self.gradient_end_color = end_color
 
+    def set_gradient_type(self, gradient_type):
+        """Устанавливает тип градиента: linear, radial или reflected"""
+        self.gradient_type = gradient_type
+
     def set_stamp_pattern(self, pattern):
         """Устанавливает паттерн штампа"""
         self.stamp_pattern = pattern
@@ -1117,7 +1675,8 @@ class DrawingCanvas(QLabel):
         # Добавляем в историю
         self.add_to_history()
 
-        # Обрезаем изображение
+        # Обрезаем изображение (слои сдвигаются вместе с ним)
+        self.transform_layers(QTransform(), normalized_rect)
         self.image = self.image.copy(normalized_rect)
 
         # Обновляем отображение
@@ -1206,22 +1765,18 @@ class DrawingCanvas(QLabel):
             event.ignore()
 
     def mousePressEvent(self, event):
+        if self.loading_pixmap is not None or self.read_only:
+            # Полное изображение еще не загружено или не помещается в память
+            return
         if event.button() == Qt.MouseButton.LeftButton:
             widget_pos = event.position().toPoint()
             canvas_pos = self.get_canvas_position(widget_pos)
 
-            if self.current_tool == "brush":
-                self.drawing = True
-                self.last_point = canvas_pos
-                self.add_to_history()
-            elif self.current_tool == "pencil":
-                self.drawing = True
-                self.last_point = canvas_pos
-                self.add_to_history()
-            elif self.current_tool == "eraser":
+            if self.current_tool in ("brush", "pencil", "eraser"):
                 self.drawing = True
                 self.last_point = canvas_pos
                 self.add_to_history()
+                self.begin_stroke(canvas_pos)
             elif self.current_tool == "fill":
                 self.add_to_history()
                 self.flood_fill(canvas_pos)
@@ -1238,6 +1793,7 @@ class DrawingCanvas(QLabel):
                     self.drawing = True
                     self.last_point = canvas_pos
                     self.add_to_history()
+                    self.begin_stroke(canvas_pos)
             elif self.current_tool == "stamp":
                 if self.stamp_pattern:
                     self.add_to_history()
@@ -1262,11 +1818,14 @@ class DrawingCanvas(QLabel):
                 self.selection_start = canvas_pos
                 self.selection_rect = QRect(canvas_pos, canvas_pos)
                 self.selected_area = None
-            elif self.current_tool == "move" and self.pasted_fragment:
+            elif self.current_tool == "move" and (
+                self.pasted_fragment or self.lift_layer(canvas_pos)
+            ):
                 # Проверяем, находится ли курсор над вставленным фрагментом
                 frag_rect = QRect(self.fragment_position, self.pasted_fragment.size())
                 if frag_rect.contains(canvas_pos):
                     self.dragging_fragment = True
+                    self.fragment_grab_offset = canvas_pos - self.fragment_position
             elif self.current_tool == "crop":
                 self.cropping = True
                 self.crop_start = canvas_pos
@@ -1278,97 +1837,23 @@ class DrawingCanvas(QLabel):
         canvas_pos = self.get_canvas_position(widget_pos)
 
         if (
-            self.current_tool == "brush"
+            self.current_tool in ("brush", "pencil", "eraser", "clone")
             and self.drawing
             and event.buttons() & Qt.MouseButton.LeftButton
         ):
-            painter = QPainter(self.image)
-            painter.setPen(
-                QPen(
-                    self.brush_color,
-                    self.brush_size,
-                    Qt.PenStyle.SolidLine,
-                    Qt.PenCapStyle.RoundCap,
-                    Qt.PenJoinStyle.RoundJoin,
-                )
-            )
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-            painter.drawLine(self.last_point, canvas_pos)
-            painter.end()
-
-            self.last_point = canvas_pos
-            self.update_display()
-        elif (
-            self.current_tool == "pencil"
-            and self.drawing
-            and event.buttons() & Qt.MouseButton.LeftButton
-        ):
-            painter = QPainter(self.image)
-            painter.setPen(
-                QPen(
-                    self.brush_color,
-                    1,
-                    Qt.PenStyle.SolidLine,
-                    Qt.PenCapStyle.SquareCap,
-                    Qt.PenJoinStyle.MiterJoin,
-                )
-            )
-            painter.drawLine(self.last_point, canvas_pos)
-            painter.end()
-
-            self.last_point = canvas_pos
-            self.update_display()
-        elif (
-            self.current_tool == "eraser"
-            and self.drawing
-            and event.buttons() & Qt.MouseButton.LeftButton
-        ):
-            painter = QPainter(self.image)
-            # Правильный способ стирания - рисуем белым цветом или прозрачным
-            if self.image.hasAlphaChannel():
-                painter.setCompositionMode(
-                    QPainter.CompositionMode.CompositionMode_Clear
-                )
-                painter.setPen(
-                    QPen(
-                        QColor(0, 0, 0, 0),
-                        self.brush_size,
-                        Qt.PenStyle.SolidLine,
-                        Qt.PenCapStyle.RoundCap,
-                        Qt.PenJoinStyle.RoundJoin,
-                    )
-                )
-            else:
-                painter.setPen(
-                    QPen(
-                        QColor(Qt.GlobalColor.white),
-                        self.brush_size,
-                        Qt.PenStyle.SolidLine,
-                        Qt.PenCapStyle.RoundCap,
-                        Qt.PenJoinStyle.RoundJoin,
-                    )
-                )
-            painter.setRenderHint(QPainter.RenderHint.Antialiasing)
-            painter.drawLine(self.last_point, canvas_pos)
-            painter.end()
-
-            self.last_point = canvas_pos
-            self.update_display()
-        elif (
-            self.current_tool == "clone"
-            and self.drawing
-            and event.buttons() & Qt.MouseButton.LeftButton
-            and self.clone_source_point
-        ):
-            self.apply_clone(canvas_pos)
+            # Точка только запоминается: отрисовка - по таймеру кадров
+            self.stroke_points.append((canvas_pos.x(), canvas_pos.y()))
             self.last_point = canvas_pos
         elif (
             self.current_tool == "gradient"
             and self.drawing
             and event.buttons() & Qt.MouseButton.LeftButton
         ):
-            # Предварительный просмотр градиента
-            pass
+            # Предпросмотр рисуется поверх холста в разрешении экрана;
+            # изображение не меняется до отпускания кнопки
+            self.gradient_preview_end = canvas_pos
+            area = self.get_widget_rect(self.gradient_area())
+            self.update(area.adjusted(-1, -1, 1, 1))
         elif self.current_tool == "select" and self.selecting:
             self.selection_rect = QRect(self.selection_start, canvas_pos).normalized()
             self.update()
@@ -1377,8 +1862,11 @@ class DrawingCanvas(QLabel):
             and self.dragging_fragment
             and self.pasted_fragment
         ):
-            self.fragment_position = canvas_pos
-            self.update()
+            # Перерисовываются только старое и новое места фрагмента:
+            # готовая уменьшенная копия просто сдвигается
+            old_rect = self.fragment_widget_rect()
+            self.fragment_position = canvas_pos - self.fragment_grab_offset
+            self.update(old_rect.united(self.fragment_widget_rect()))
         elif self.current_tool == "crop" and self.cropping:
             self.crop_rect = QRect(self.crop_start, canvas_pos).normalized()
             self.update()
@@ -1390,11 +1878,15 @@ class DrawingCanvas(QLabel):
 
             if self.current_tool == "gradient" and self.drawing:
                 # Применяем градиент от начальной до конечной точки
+                self.gradient_preview_end = None
                 self.apply_gradient(self.last_point, canvas_pos)
 
             # Сбрасываем состояние рисования только после завершения действия
             if self.drawing:
+                self.end_stroke()
                 self.drawing = False
+                # Штрих закончен: сглаженная перерисовка из пирамиды
+                self.update_display()
                 # Обновляем историю в интерфейсе после завершения рисования
                 if hasattr(self.parent(), "update_history_ui"):
                     self.parent().update_history_ui()
@@ -1413,8 +1905,9 @@ class DrawingCanvas(QLabel):
                 self.update()
             elif self.current_tool == "move" and self.dragging_fragment:
                 self.dragging_fragment = False
-                # Применяем фрагмент к изображению
+                # Применяем фрагмент к изображению и сглаженно перерисовываем
                 self.apply_fragment_to_canvas()
+                self.update_display()
             elif self.current_tool == "crop" and self.cropping:
                 self.cropping = False
                 if self.crop_rect.width() > 10 and self.crop_rect.height() > 10:
@@ -1478,6 +1971,44 @@ class DrawingCanvas(QLabel):
         bottom_right = self.get_widget_position(canvas_rect.bottomRight())
         return QRect(top_left, bottom_right)
 
+    def scaled_fragment(self):
+        """Вставленный фрагмент в масштабе отображения.
+
+        Сглаженное масштабирование выполняется один раз и кэшируется до смены
+        фрагмента или масштаба; при перетаскивании копия только сдвигается.
+        """
+        displayed_pixmap = self.pixmap()
+        scale_x = displayed_pixmap.width() / self.image.width()
+        scale_y = displayed_pixmap.height() / self.image.height()
+        size = QSize(
+            max(1, int(self.pasted_fragment.width() * scale_x)),
+            max(1, int(self.pasted_fragment.height() * scale_y)),
+        )
+        key = (self.pasted_fragment.cacheKey(), size)
+        if key != self.fragment_display_key:
+            self.fragment_display = self.pasted_fragment.scaled(
+                size,
+                Qt.AspectRatioMode.IgnoreAspectRatio,
+                Qt.TransformationMode.SmoothTransformation,
+            )
+            self.fragment_display_key = key
+        return self.fragment_display
+
+    def fragment_widget_rect(self):
+        """Область вставленного фрагмента в виджете (с рамкой)"""
+        if not self.pasted_fragment or not self.pixmap():
+            return QRect()
+        rect = QRect(
+            self.get_widget_position(self.fragment_position),
+            self.scaled_fragment().size(),
+        )
+        return rect.adjusted(-2, -2, 2, 2)
+
+    def resizeEvent(self, event):
+        """Дорисовывает открывшуюся часть кадра в режиме реального размера"""
+        super().resizeEvent(event)
+        self.render_visible()
+
     def paintEvent(self, event):
         """Переопределяем paintEvent для рисования выделения и фрагментов"""
         super().paintEvent(event)
@@ -1554,39 +2085,31 @@ class DrawingCanvas(QLabel):
                     widget_rect.height(),
                 )
 
+        # Предпросмотр градиента в разрешении экрана
+        if self.gradient_preview_end is not None and self.pixmap():
+            start = QPointF(self.get_widget_position(self.last_point))
+            end = QPointF(self.get_widget_position(self.gradient_preview_end))
+            area = self.get_widget_rect(self.gradient_area())
+            if start != end:
+                painter.save()
+                painter.setClipRect(area)
+                painter.fillRect(area, QBrush(self.make_gradient(start, end)))
+                painter.restore()
+
         # Рисуем вставленный фрагмент
-        if self.pasted_fragment:
-            # Получаем позицию фрагмента в координатах виджета
+        if self.pasted_fragment and self.pixmap():
+            scaled_fragment = self.scaled_fragment()
             widget_pos = self.get_widget_position(self.fragment_position)
+            if self.floating_layer is not None:
+                painter.setOpacity(self.floating_layer[0].opacity)
+            painter.drawPixmap(widget_pos, scaled_fragment)
+            painter.setOpacity(1.0)
 
-            # Вычисляем масштаб для отображения фрагмента
-            if self.pixmap():
-                displayed_pixmap = self.pixmap()
-                actual_image_size = self.image.size()
-
-                # Коэффициент масштабирования
-                scale_x = displayed_pixmap.width() / actual_image_size.width()
-                scale_y = displayed_pixmap.height() / actual_image_size.height()
-
-                # Масштабируем фрагмент
-                scaled_width = int(self.pasted_fragment.width() * scale_x)
-                scaled_height = int(self.pasted_fragment.height() * scale_y)
-
-                scaled_fragment = self.pasted_fragment.scaled(
-                    scaled_width,
-                    scaled_height,
-                    Qt.AspectRatioMode.IgnoreAspectRatio,
-                    Qt.TransformationMode.SmoothTransformation,
-                )
-
-                painter.drawPixmap(widget_pos, scaled_fragment)
-
-                # Рисуем рамку вокруг фрагмента
-                pen = QPen(QColor(40, 167, 69), 2, Qt.PenStyle.DashLine)
-                painter.setPen(pen)
-                painter.setBrush(QBrush())
-                frag_rect = QRect(widget_pos, scaled_fragment.size())
-                painter.drawRect(frag_rect)
+            # Рисуем рамку вокруг фрагмента
+            pen = QPen(QColor(40, 167, 69), 2, Qt.PenStyle.DashLine)
+            painter.setPen(pen)
+            painter.setBrush(QBrush())
+            painter.drawRect(QRect(widget_pos, scaled_fragment.size()))
 
 
 class ResizeDialog(QDialog):
@@ -1654,6 +2177,99 @@ class ResizeDialog(QDialog):
         return QSize(self.width_spin.value(), self.height_spin.value())
 
 
+class ExportProfileDialog(QDialog):
+    """Диалог экспорта с профилем: формат, профиль и сравнение профилей"""
+
+    def __init__(self, compare, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Экспорт с профилем")
+        self.setModal(True)
+        # compare(формат) запускает сравнение и возвращает задачу
+        self.compare = compare
+        self.comparison = None
+
+        layout = QVBoxLayout()
+
+        settings_layout = QGridLayout()
+        settings_layout.addWidget(QLabel("Формат:"), 0, 0)
+        self.format_combo = QComboBox()
+        self.format_combo.addItems(image_export.available_formats())
+        settings_layout.addWidget(self.format_combo, 0, 1)
+
+        settings_layout.addWidget(QLabel("Профиль:"), 1, 0)
+        self.preset_combo = QComboBox()
+        self.preset_combo.addItems(image_export.PRESETS)
+        self.preset_combo.setCurrentText("balanced")
+        settings_layout.addWidget(self.preset_combo, 1, 1)
+        layout.addLayout(settings_layout)
+
+        # Параметры выбранного профиля
+        self.options_label = QLabel()
+        self.options_label.setWordWrap(True)
+        self.options_label.setStyleSheet("color: #666; margin: 6px 0;")
+        layout.addWidget(self.options_label)
+
+        # Сравнение профилей на текущем изображении
+        compare_group = QGroupBox("Сравнение профилей")
+        compare_layout = QVBoxLayout(compare_group)
+        self.compare_button = QPushButton("Сравнить")
+        self.compare_button.clicked.connect(self.start_comparison)
+        compare_layout.addWidget(self.compare_button)
+        self.report_label = QLabel("Размер и время кодирования для каждого профиля")
+        self.report_label.setFont(QFont("Courier New", 9))
+        self.report_label.setStyleSheet(
+            "background-color: #f0f0f0; padding: 8px; border-radius: 4px;"
+        )
+        compare_layout.addWidget(self.report_label)
+        layout.addWidget(compare_group)
+
+        buttons = QDialogButtonBox(
+            QDialogButtonBox.StandardButton.Ok | QDialogButtonBox.StandardButton.Cancel
+        )
+        buttons.accepted.connect(self.accept)
+        buttons.rejected.connect(self.reject)
+        layout.addWidget(buttons)
+
+        self.setLayout(layout)
+
+        self.format_combo.currentTextChanged.connect(self.update_options)
+        self.preset_combo.currentTextChanged.connect(self.update_options)
+        self.update_options()
+
+    def update_options(self):
+        """Показывает параметры кодировщика выбранного профиля"""
+        preset = image_export.PRESETS[self.preset_combo.currentText()]
+        options = preset[self.format_combo.currentText()]
+        text = ", ".join(f"{key}={value}" for key, value in options.items())
+        if not preset["metadata"]:
+            text += ", без метаданных"
+        self.options_label.setText(text)
+
+    def start_comparison(self):
+        """Запускает сравнение профилей для выбранного формата"""
+        if self.comparison is not None:
+            self.comparison.cancel()
+        image_format = self.format_combo.currentText()
+        self.report_label.setText(f"Сравнение профилей {image_format}...")
+        self.comparison = self.compare(image_format)
+        self.comparison.finished.connect(self.show_report)
+        self.comparison.error.connect(self.report_label.setText)
+
+    def show_report(self, results):
+        self.comparison = None
+        self.report_label.setText(image_export.format_report(results))
+
+    def done(self, result):
+        # Закрытый диалог больше не ждет результатов сравнения
+        if self.comparison is not None:
+            self.comparison.cancel()
+            self.comparison = None
+        super().done(result)
+
+    def get_profile(self):
+        return self.format_combo.currentText(), self.preset_combo.currentText()
+
+
 class IconSizeDialog(QDialog):
     """Диалог выбора размеров для ICO файла"""
 
@@ -1863,14 +2479,62 @@ class GraphicsEditor(QMainWindow):
         self.saturation = 1.0
         self.recent_files = []
 
+        # Очередь фоновых задач обработки
+        self.processor = None
+        self.jobs = JobQueue(parent=self)
+        self.jobs.changed.connect(self.on_jobs_changed)
+        self.jobs.failed.connect(self.on_job_failed)
+
+        # Фоновая очередь: миниатюры и предзагрузка соседних файлов списка.
+        # Отдельная очередь не занимает индикатор прогресса обработки
+        self.thumbnails = ThumbnailCache()
+        self.background_jobs = JobQueue(max_workers=2, parent=self)
+        self.background_jobs.failed.connect(self.on_background_job_failed)
+        self.file_items = {}
+        self.image_sizes = {}
+
+        # Изображение вне памяти (TiledImage), если открыт очень большой файл
+        self.large_image = None
+
+        # Предпросмотр фильтров
+        self.preview_source = None
+        self.filters_result = None
+        self.filters_processor = None
+
         # Настройки приложения
-        self.settings = {"auto_save": False, "backup_count": 5, "default_format": "PNG"}
+        self.settings = {
+            "auto_save": False,
+            "backup_count": 5,
+            "default_format": "PNG",
+            # Эффекты применяются к буферу холста, а не к файлу на диске
+            "canvas_pipeline": True,
+            # Тяжелые эффекты на больших изображениях - в пуле процессов
+            "process_pool": True,
+            # Сколько соседних файлов списка декодировать заранее с каждой
+            # стороны и сколько памяти отвести под декодированные изображения
+            "prefetch_count": 2,
+            "prefetch_memory_mb": 512,
+            # Изображения больше этого числа пикселей редактируются вне памяти
+            "large_image_pixels": 100_000_000,
+        }
+
+        # Декодированные изображения: текущее и соседние в списке файлов
+        self.decoded_images = MemoryCache(
+            self.settings["prefetch_memory_mb"] * 1024 * 1024,
+            lambda pixmap: pixmap.width() * pixmap.height() * pixmap.depth() // 8,
+        )
 
         self.init_ui()
         self.init_menu()
         self.init_toolbar()
         self.init_status_bar()
 
+        # Таймер предпросмотра фильтров (объединяет события слайдеров)
+        self.preview_timer = QTimer()
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(30)
+        self.preview_timer.timeout.connect(self.update_filter_preview)
+
         # Таймер для автосохранения
         self.auto_save_timer = QTimer()
         self.auto_save_timer.timeout.connect(self.auto_save)
@@ -1992,6 +2656,8 @@ class GraphicsEditor(QMainWindow):
         # Список файлов
         self.file_list = QListWidget()
         self.file_list.setMaximumWidth(300)
+        self.file_list.setIconSize(QSize(64, 64))
+        self.file_list.setUniformItemSizes(True)
         self.file_list.itemClicked.connect(self.select_file)
         self.file_list.setStyleSheet("""
             QListWidget { 
@@ -2018,6 +2684,17 @@ class GraphicsEditor(QMainWindow):
         self.folder_info.setStyleSheet("color: #6c757d; font-size: 10px;")
         layout.addWidget(self.folder_info)
 
+        # Миниатюры строятся только для видимых строк списка
+        self.thumbnail_timer = QTimer()
+        self.thumbnail_timer.setSingleShot(True)
+        self.thumbnail_timer.setInterval(50)
+        self.thumbnail_timer.timeout.connect(self.request_visible_thumbnails)
+        self.file_list.verticalScrollBar().valueChanged.connect(
+            self.thumbnail_timer.start
+        )
+        # Выросший список открывает новые строки без прокрутки
+        self.file_list.viewport().installEventFilter(self)
+
         # Загружаем начальный список файлов
         self.refresh_file_list()
 
@@ -2043,6 +2720,10 @@ class GraphicsEditor(QMainWindow):
         self.canvas = DrawingCanvas()
         scroll_area.setWidget(self.canvas)
         scroll_area.setWidgetResizable(True)
+        # В режиме реального размера холст дорисовывает открывшуюся часть кадра
+        for bar in (scroll_area.horizontalScrollBar(), scroll_area.verticalScrollBar()):
+            bar.valueChanged.connect(lambda value: self.canvas.render_visible())
+            bar.rangeChanged.connect(lambda low, high: self.canvas.render_visible())
         layout.addWidget(scroll_area)
 
         # Панель масштабирования
@@ -2246,6 +2927,26 @@ class GraphicsEditor(QMainWindow):
         )
         advanced_layout.addWidget(self.fill_color_preview)
 
+        advanced_layout.addWidget(QLabel("Допуск заливки:"))
+        self.fill_tolerance_spin = QSpinBox()
+        self.fill_tolerance_spin.setRange(0, 255)
+        self.fill_tolerance_spin.setValue(0)
+        self.fill_tolerance_spin.valueChanged.connect(self.change_fill_options)
+        advanced_layout.addWidget(self.fill_tolerance_spin)
+
+        self.fill_connectivity_combo = QComboBox()
+        self.fill_connectivity_combo.addItem("4 соседа", 4)
+        self.fill_connectivity_combo.addItem("8 соседей", 8)
+        self.fill_connectivity_combo.setToolTip("Связность области заливки")
+        self.fill_connectivity_combo.currentIndexChanged.connect(
+            self.change_fill_options
+        )
+        advanced_layout.addWidget(self.fill_connectivity_combo)
+
+        self.fill_selection_check = QCheckBox("Заливать только в выделении")
+        self.fill_selection_check.toggled.connect(self.change_fill_options)
+        advanced_layout.addWidget(self.fill_selection_check)
+
         # Настройки градиента
         advanced_layout.addWidget(QLabel("Градиент:"))
         btn_gradient_start = QPushButton("🌈 Начальный цвет")
@@ -2256,6 +2957,18 @@ class GraphicsEditor(QMainWindow):
         btn_gradient_end.clicked.connect(self.choose_gradient_end_color)
         advanced_layout.addWidget(btn_gradient_end)
 
+        self.gradient_type_combo = QComboBox()
+        self.gradient_type_combo.addItem("Линейный", "linear")
+        self.gradient_type_combo.addItem("Радиальный", "radial")
+        self.gradient_type_combo.addItem("Зеркальный", "reflected")
+        self.gradient_type_combo.setToolTip(
+            "Тип градиента; при наличии выделения заливается только оно"
+        )
+        self.gradient_type_combo.currentIndexChanged.connect(
+            self.change_gradient_type
+        )
+        advanced_layout.addWidget(self.gradient_type_combo)
+
         # Настройки штампа
         advanced_layout.addWidget(QLabel("Штамп:"))
         btn_load_stamp = QPushButton("📁 Загрузить штамп")
@@ -2307,6 +3020,19 @@ class GraphicsEditor(QMainWindow):
         self.saturation_label = QLabel("100%")
         filters_group_layout.addWidget(self.saturation_label)
 
+        # Предпросмотр на уменьшенной копии во время перетаскивания слайдеров
+        self.live_preview_check = QCheckBox("👁️ Предпросмотр")
+        self.live_preview_check.setChecked(True)
+        self.live_preview_check.toggled.connect(self.schedule_filter_preview)
+        filters_group_layout.addWidget(self.live_preview_check)
+
+        for slider in (
+            self.brightness_slider,
+            self.contrast_slider,
+            self.saturation_slider,
+        ):
+            slider.sliderReleased.connect(self.render_filters_full)
+
         # Кнопка применения фильтров
         btn_apply_filters = QPushButton("✨ Применить фильтры")
         btn_apply_filters.clicked.connect(self.apply_filters)
@@ -2360,10 +3086,47 @@ class GraphicsEditor(QMainWindow):
         btn_sketch.clicked.connect(self.apply_sketch_effect)
         artistic_layout.addWidget(btn_sketch)
 
+        # Параметры эффекта стекла
+        glass_params_layout = QHBoxLayout()
+        self.glass_radius_spin = QSpinBox()
+        self.glass_radius_spin.setRange(1, 50)
+        self.glass_radius_spin.setValue(5)
+        self.glass_radius_spin.setSuffix(" px")
+        self.glass_radius_spin.setToolTip("Наибольшее смещение пикселя")
+        glass_params_layout.addWidget(self.glass_radius_spin)
+
+        self.glass_seed_spin = QSpinBox()
+        self.glass_seed_spin.setRange(0, 999999)
+        self.glass_seed_spin.setValue(0)
+        self.glass_seed_spin.setSpecialValueText("случайно")
+        self.glass_seed_spin.setToolTip(
+            "Зерно узора: при одинаковом зерне узор повторяется"
+        )
+        glass_params_layout.addWidget(self.glass_seed_spin)
+        artistic_layout.addLayout(glass_params_layout)
+
         btn_glass = QPushButton("🪟 Стекло")
         btn_glass.clicked.connect(self.apply_glass_effect)
         artistic_layout.addWidget(btn_glass)
 
+        # Параметры эффекта волн
+        wave_params_layout = QHBoxLayout()
+        self.wave_amplitude_spin = QSpinBox()
+        self.wave_amplitude_spin.setRange(1, 200)
+        self.wave_amplitude_spin.setValue(20)
+        self.wave_amplitude_spin.setSuffix(" px")
+        self.wave_amplitude_spin.setToolTip("Амплитуда волн")
+        wave_params_layout.addWidget(self.wave_amplitude_spin)
+
+        self.wave_frequency_spin = QDoubleSpinBox()
+        self.wave_frequency_spin.setRange(0.001, 1.0)
+        self.wave_frequency_spin.setDecimals(3)
+        self.wave_frequency_spin.setSingleStep(0.005)
+        self.wave_frequency_spin.setValue(0.05)
+        self.wave_frequency_spin.setToolTip("Частота волн")
+        wave_params_layout.addWidget(self.wave_frequency_spin)
+        artistic_layout.addLayout(wave_params_layout)
+
         btn_waves = QPushButton("🌊 Волны")
         btn_waves.clicked.connect(self.apply_wave_effect)
         artistic_layout.addWidget(btn_waves)
@@ -2426,6 +3189,27 @@ class GraphicsEditor(QMainWindow):
         special_effects_group = QGroupBox("🎪 Специальные эффекты")
         special_layout = QVBoxLayout(special_effects_group)
 
+        # Параметры удаления фона
+        special_layout.addWidget(QLabel("Допуск цвета фона:"))
+        self.bg_tolerance_spin = QSpinBox()
+        self.bg_tolerance_spin.setRange(1, 255)
+        self.bg_tolerance_spin.setValue(15)
+        self.bg_tolerance_spin.setToolTip("Насколько цвет может отличаться от белого")
+        special_layout.addWidget(self.bg_tolerance_spin)
+
+        special_layout.addWidget(QLabel("Растушевка края:"))
+        self.bg_feather_spin = QSpinBox()
+        self.bg_feather_spin.setRange(0, 50)
+        self.bg_feather_spin.setValue(0)
+        self.bg_feather_spin.setSuffix(" px")
+        special_layout.addWidget(self.bg_feather_spin)
+
+        self.bg_edge_check = QCheckBox("Только фон, связанный с краями")
+        self.bg_edge_check.setToolTip(
+            "Не трогать светлые области внутри объекта, удалять только внешний фон"
+        )
+        special_layout.addWidget(self.bg_edge_check)
+
         btn_remove_bg = QPushButton("🗑️ Убрать фон")
         btn_remove_bg.clicked.connect(self.remove_background)
         special_layout.addWidget(btn_remove_bg)
@@ -2453,6 +3237,67 @@ class GraphicsEditor(QMainWindow):
 
         tabs.addTab(effects_tab, "Эффекты")
 
+        # Вкладка "Слои"
+        layers_tab = QWidget()
+        layers_layout = QVBoxLayout(layers_tab)
+
+        layers_group = QGroupBox("🗂️ Слои")
+        layers_group_layout = QVBoxLayout(layers_group)
+
+        # Список слоев сверху вниз; флажок - видимость слоя
+        self.layers_list = QListWidget()
+        self.layers_list.currentRowChanged.connect(self.on_layer_selected)
+        self.layers_list.itemChanged.connect(self.on_layer_visibility_changed)
+        layers_group_layout.addWidget(self.layers_list)
+
+        layers_group_layout.addWidget(QLabel("Непрозрачность:"))
+        self.layer_opacity_slider = QSlider(Qt.Orientation.Horizontal)
+        self.layer_opacity_slider.setRange(0, 100)
+        self.layer_opacity_slider.setValue(100)
+        self.layer_opacity_slider.valueChanged.connect(self.change_layer_opacity)
+        layers_group_layout.addWidget(self.layer_opacity_slider)
+
+        layers_group_layout.addWidget(QLabel("Режим наложения:"))
+        self.layer_blend_combo = QComboBox()
+        for blend_mode, (label, _) in BLEND_MODES.items():
+            self.layer_blend_combo.addItem(label, blend_mode)
+        self.layer_blend_combo.currentIndexChanged.connect(
+            self.change_layer_blend_mode
+        )
+        layers_group_layout.addWidget(self.layer_blend_combo)
+
+        layer_buttons_layout = QGridLayout()
+
+        btn_add_layer = QPushButton("➕ Новый слой")
+        btn_add_layer.clicked.connect(self.add_empty_layer)
+        layer_buttons_layout.addWidget(btn_add_layer, 0, 0)
+
+        btn_delete_layer = QPushButton("🗑️ Удалить")
+        btn_delete_layer.clicked.connect(self.delete_layer)
+        layer_buttons_layout.addWidget(btn_delete_layer, 0, 1)
+
+        btn_layer_up = QPushButton("⬆️ Выше")
+        btn_layer_up.clicked.connect(lambda: self.move_layer(1))
+        layer_buttons_layout.addWidget(btn_layer_up, 1, 0)
+
+        btn_layer_down = QPushButton("⬇️ Ниже")
+        btn_layer_down.clicked.connect(lambda: self.move_layer(-1))
+        layer_buttons_layout.addWidget(btn_layer_down, 1, 1)
+
+        btn_flatten = QPushButton("📚 Свести слои")
+        btn_flatten.setToolTip("Объединить все слои с изображением")
+        btn_flatten.clicked.connect(self.flatten_layers)
+        layer_buttons_layout.addWidget(btn_flatten, 2, 0, 1, 2)
+
+        layers_group_layout.addLayout(layer_buttons_layout)
+        layers_layout.addWidget(layers_group)
+        layers_layout.addStretch()
+
+        tabs.addTab(layers_tab, "Слои")
+
+        self.canvas.layers_changed.connect(self.update_layers_ui)
+        self.update_layers_ui()
+
         # Вкладка "Информация"
         info_tab = QWidget()
         info_layout = QVBoxLayout(info_tab)
@@ -2495,8 +3340,11 @@ class GraphicsEditor(QMainWindow):
         self.history_label = QLabel("Шагов в истории: 0")
         self.history_position_label = QLabel("Текущая позиция: 0")
 
+        self.history_memory_label = QLabel("Память истории: 0.0 МБ")
+
         history_layout.addWidget(self.history_label)
         history_layout.addWidget(self.history_position_label)
+        history_layout.addWidget(self.history_memory_label)
 
         # Кнопки для работы с историей
         history_buttons_layout = QHBoxLayout()
@@ -2543,6 +3391,16 @@ class GraphicsEditor(QMainWindow):
         open_action.triggered.connect(self.load_image)
         file_menu.addAction(open_action)
 
+        previous_file_action = QAction("Предыдущий файл", self)
+        previous_file_action.setShortcut(QKeySequence.StandardKey.MoveToPreviousPage)
+        previous_file_action.triggered.connect(lambda: self.show_adjacent_file(-1))
+        file_menu.addAction(previous_file_action)
+
+        next_file_action = QAction("Следующий файл", self)
+        next_file_action.setShortcut(QKeySequence.StandardKey.MoveToNextPage)
+        next_file_action.triggered.connect(lambda: self.show_adjacent_file(1))
+        file_menu.addAction(next_file_action)
+
         file_menu.addSeparator()
 
         save_action = QAction(
@@ -2614,6 +3472,11 @@ class GraphicsEditor(QMainWindow):
         reset_action.triggered.connect(self.reset_image)
         edit_menu.addAction(reset_action)
 
+        cancel_jobs_action = QAction("Отменить обработку", self)
+        cancel_jobs_action.setShortcut("Esc")
+        cancel_jobs_action.triggered.connect(self.cancel_processing)
+        edit_menu.addAction(cancel_jobs_action)
+
         # Меню "Изображение"
         image_menu = menubar.addMenu("Изображение")
 
@@ -2649,6 +3512,12 @@ class GraphicsEditor(QMainWindow):
         convert_to_jpg_action.triggered.connect(self.convert_to_jpg)
         convert_menu.addAction(convert_to_jpg_action)
 
+        export_profile_action = QAction(
+            QIcon(os.path.join("image", "imageconv.png")), "Экспорт с профилем...", self
+        )
+        export_profile_action.triggered.connect(self.export_with_profile)
+        convert_menu.addAction(export_profile_action)
+
         rotate_menu = image_menu.addMenu(
             QIcon(os.path.join("image", "turn.png")), "Поворот"
         )
@@ -2855,6 +3724,13 @@ class GraphicsEditor(QMainWindow):
         self.progress_bar.setMaximumWidth(200)
         self.status_bar.addPermanentWidget(self.progress_bar)
 
+        # Отмена фоновой обработки
+        self.cancel_jobs_button = QPushButton("✖")
+        self.cancel_jobs_button.setToolTip("Отменить обработку (Esc)")
+        self.cancel_jobs_button.setVisible(False)
+        self.cancel_jobs_button.clicked.connect(self.cancel_processing)
+        self.status_bar.addPermanentWidget(self.cancel_jobs_button)
+
         # Информация о масштабе
         self.zoom_status = QLabel("Масштаб: 100%")
         self.status_bar.addPermanentWidget(self.zoom_status)
@@ -2866,6 +3742,9 @@ class GraphicsEditor(QMainWindow):
     def refresh_file_list(self):
         """Обновляет список файлов"""
         self.file_list.clear()
+        self.file_items.clear()
+        # Миниатюры и предзагрузка прежней папки больше не нужны
+        self.background_jobs.cancel()
 
         # Получаем текущую директорию
         current_dir = os.getcwd()
@@ -2892,17 +3771,65 @@ class GraphicsEditor(QMainWindow):
             files.sort()
 
             for filename in files:
-                item = QListWidgetItem(f"🖼️ {filename}")
-                item.setData(
-                    Qt.ItemDataRole.UserRole, os.path.join(current_dir, filename)
-                )
-                self.file_list.addItem(item)
+                self.add_file_item(os.path.join(current_dir, filename))
 
             self.folder_info.setText(f"Папка: {current_dir} ({len(files)} файлов)")
+            self.thumbnail_timer.start()
 
         except Exception as e:
             self.status_bar.showMessage(f"Ошибка чтения директории: {e}")
 
+    def add_file_item(self, file_path):
+        """Добавляет файл в список; миниатюра загружается позже"""
+        item = QListWidgetItem(f"🖼️ {os.path.basename(file_path)}")
+        item.setData(Qt.ItemDataRole.UserRole, file_path)
+        item.setSizeHint(QSize(0, 68))
+        self.file_list.addItem(item)
+        self.file_items[file_path] = item
+        return item
+
+    def request_visible_thumbnails(self):
+        """Ставит в очередь миниатюры видимых строк списка (и следующей страницы)"""
+        if not self.file_list.count():
+            return
+        viewport = self.file_list.viewport().rect()
+        first = self.file_list.indexAt(viewport.topLeft()).row()
+        last = self.file_list.indexAt(viewport.bottomLeft()).row()
+        if first < 0:
+            first = 0
+        if last < 0:
+            last = self.file_list.count() - 1
+        last = min(last + (last - first + 1), self.file_list.count() - 1)
+
+        paths = []
+        for row in range(first, last + 1):
+            item = self.file_list.item(row)
+            if item.data(Qt.ItemDataRole.UserRole + 1) is None:
+                # Отметка: миниатюра уже запрошена
+                item.setData(Qt.ItemDataRole.UserRole + 1, False)
+                paths.append(item.data(Qt.ItemDataRole.UserRole))
+
+        # Небольшие группы по полосам очереди: миниатюры появляются по мере
+        # готовности и строятся в нескольких потоках
+        batch = 8
+        for index in range(0, len(paths), batch):
+            lane = f"thumbnails-{index // batch % 2}"
+            job = ThumbnailJob(
+                self.thumbnails, paths[index : index + batch], self.on_thumbnail_ready
+            )
+            self.background_jobs.submit(job, lane)
+
+    def on_thumbnail_ready(self, file_path, thumbnail, original_size):
+        """Показывает готовую миниатюру в списке файлов"""
+        self.image_sizes[file_path] = original_size
+        item = self.file_items.get(file_path)
+        if item is None:
+            return
+        item.setIcon(QIcon(QPixmap.fromImage(thumbnail)))
+        item.setText(os.path.basename(file_path))
+        item.setToolTip("{}\n{}×{}".format(file_path, *original_size))
+        item.setData(Qt.ItemDataRole.UserRole + 1, True)
+
     def open_folder(self):
         """Открывает диалог выбора папки"""
         folder = QFileDialog.getExistingDirectory(
@@ -2931,6 +3858,7 @@ class GraphicsEditor(QMainWindow):
             new_image.fill(Qt.GlobalColor.white)
 
             self.canvas.set_image(new_image)
+            self.set_large_image(None)
             self.current_image_path = None
 
             # Сбрасываем слайдеры
@@ -2957,53 +3885,187 @@ class GraphicsEditor(QMainWindow):
             self.load_image_from_path(file_path)
 
     def load_image_from_path(self, file_path):
-        """Загружает изображение по пути"""
-        try:
-            # Показываем прогресс
-            self.progress_bar.setVisible(True)
-            self.progress_bar.setValue(0)
+        """Загружает изображение по пути.
 
-            # Создаем поток для загрузки
-            self.processor = ImageProcessor(file_path, operation="load")
-            self.processor.progress.connect(self.progress_bar.setValue)
-            self.processor.finished.connect(self.on_image_loaded)
-            self.processor.error.connect(self.on_processing_error)
-            self.processor.start()
+        Уже декодированные (в том числе заранее) изображения берутся из
+        кэша, остальные загружаются в фоне.
+        """
+        try:
+            try:
+                key = file_key(file_path)
+                width, height = read_size(file_path)
+                pixel_count = width * height
+            except OSError:
+                key, pixel_count = None, 0
+            out_of_core = self.is_large_image(pixel_count)
+            if out_of_core:
+                # Огромное изображение не кэшируется в памяти
+                key = None
+            cached = self.decoded_images.get(key) if key else None
 
             self.current_image_path = file_path
+            if cached is not None:
+                # Новое изображение делает ненужными задачи для прежнего.
+                # Холст получает свою копию: рисование не меняет кэш
+                self.jobs.cancel("canvas")
+                self.on_image_loaded(QPixmap(cached))
+            else:
+                # Показываем прогресс
+                self.progress_bar.setVisible(True)
+                self.progress_bar.setValue(0)
+
+                # Создаем поток для загрузки
+                # Новое изображение делает ненужными задачи для прежнего
+                # Большие изображения сначала показываются уменьшенными
+                viewport = self.canvas.size()
+                self.processor = ImageProcessor(
+                    file_path,
+                    operation="load",
+                    preview_size=(viewport.width(), viewport.height()),
+                    out_of_core=out_of_core,
+                )
+                self.processor.progress.connect(self.progress_bar.setValue)
+                self.processor.preview.connect(self.on_image_preview)
+                if key is not None:
+                    self.processor.finished.connect(
+                        lambda pixmap: self.decoded_images.put(key, QPixmap(pixmap))
+                    )
+                self.processor.finished.connect(self.on_image_loaded)
+                self.processor.error.connect(self.on_processing_error)
+                self.jobs.submit(self.processor, "canvas", supersede=True)
 
             # Добавляем файл в список, если его там нет
-            filename = os.path.basename(file_path)
-            file_exists = False
-            for item_index in range(self.file_list.count()):
-                item = self.file_list.item(item_index)
-                if item.data(Qt.ItemDataRole.UserRole) == file_path:
-                    file_exists = True
-                    # Выделяем существующий файл
-                    self.file_list.setCurrentItem(item)
-                    break
-
-            if not file_exists:
+            item = self.file_items.get(file_path)
+            if item is not None:
+                # Выделяем существующий файл
+                self.file_list.setCurrentItem(item)
+            else:
                 # Добавляем новый файл в список
-                item = QListWidgetItem(f"🖼️ {filename}")
-                item.setData(Qt.ItemDataRole.UserRole, file_path)
-                self.file_list.addItem(item)
+                item = self.add_file_item(file_path)
                 self.file_list.setCurrentItem(item)
-                self.status_bar.showMessage(f"Файл добавлен в список: {filename}")
+                self.thumbnail_timer.start()
+                self.status_bar.showMessage(
+                    f"Файл добавлен в список: {os.path.basename(file_path)}"
+                )
+
+            self.prefetch_neighbours(file_path)
 
         except Exception as e:
             QMessageBox.critical(self, "Ошибка", f"Ошибка загрузки изображения: {e}")
 
+    def is_large_image(self, pixel_count):
+        """Открывается ли изображение вне памяти.
+
+        Кроме порога из настроек учитывается предел PIL: кадр больше него
+        PIL целиком не декодирует (защита от "бомб распаковки").
+        """
+        limit = self.settings["large_image_pixels"]
+        if Image.MAX_IMAGE_PIXELS:
+            limit = min(limit, 2 * Image.MAX_IMAGE_PIXELS)
+        return pixel_count > limit
+
+    def prefetch_neighbours(self, file_path):
+        """Заранее декодирует соседние файлы списка (сначала следующий)"""
+        item = self.file_items.get(file_path)
+        count = self.settings["prefetch_count"]
+        if item is None or not count:
+            return
+
+        # Предзагрузка для прежнего файла больше не нужна
+        self.background_jobs.cancel("prefetch")
+        budget = self.settings["prefetch_memory_mb"] * 1024 * 1024
+        self.decoded_images.set_budget(budget)
+
+        row = self.file_list.row(item)
+        for distance in range(1, count + 1):
+            for neighbour in (row + distance, row - distance):
+                if not 0 <= neighbour < self.file_list.count():
+                    continue
+                path = self.file_list.item(neighbour).data(Qt.ItemDataRole.UserRole)
+                try:
+                    key = file_key(path)
+                    width, height = read_size(path)
+                except OSError:
+                    continue
+                if key in self.decoded_images:
+                    continue
+                # Размер берется из заголовка: огромные файлы открываются вне
+                # памяти, а не помещающиеся в бюджет кэш все равно не сохранит,
+                # поэтому их не декодируем
+                pixel_count = width * height
+                if self.is_large_image(pixel_count) or pixel_count * 4 > budget:
+                    continue
+
+                processor = ImageProcessor(path, operation="load")
+                processor.finished.connect(
+                    lambda pixmap, key=key: self.decoded_images.put(key, pixmap)
+                )
+                self.background_jobs.submit(processor, "prefetch")
+
+    def show_adjacent_file(self, step):
+        """Открывает следующий (step=1) или предыдущий (step=-1) файл списка"""
+        if not self.file_list.count():
+            return
+        item = self.file_items.get(self.current_image_path)
+        row = self.file_list.row(item) + step if item is not None else 0
+        row = max(0, min(row, self.file_list.count() - 1))
+        next_item = self.file_list.item(row)
+        if next_item is not item:
+            self.load_image_from_path(next_item.data(Qt.ItemDataRole.UserRole))
+
+    def on_image_preview(self, pixmap):
+        """Показывает уменьшенную копию загружаемого изображения"""
+        processor = self.sender()
+        if processor is not self.processor or processor.is_cancelled():
+            return
+        self.canvas.show_loading_preview(pixmap)
+        self.status_bar.showMessage(
+            f"Загрузка полного изображения: {os.path.basename(processor.image_path)}"
+        )
+
+    def set_large_image(self, store):
+        """Включает (store - TiledImage) или выключает (None) режим вне памяти"""
+        if self.large_image is not None and self.large_image is not store:
+            self.large_image.close()
+        self.large_image = store
+        self.canvas.read_only = store is not None
+
+    def check_loaded(self):
+        """Проверяет, что изображение загружено полностью.
+
+        Пока показана уменьшенная копия загружаемого файла, на холсте лежит
+        прежнее изображение: правки, эффекты и запись к нему не применяются.
+        """
+        if self.canvas.loading_pixmap is None:
+            return True
+        self.status_bar.showMessage("Изображение еще загружается", 3000)
+        return False
+
+    def check_editable(self):
+        """Проверяет, что изображение можно править на холсте"""
+        if not self.check_loaded():
+            return False
+        if self.large_image is None:
+            return True
+        QMessageBox.information(
+            self,
+            "Изображение вне памяти",
+            "Для очень больших изображений доступны только фильтры и эффекты",
+        )
+        return False
+
     def on_image_loaded(self, pixmap):
         """Обработчик успешной загрузки изображения"""
         self.canvas.set_image(pixmap)
+        # Очень большое изображение загружено в хранилище на диске
+        self.set_large_image(getattr(self.sender(), "tiled_result", None))
 
         # Сбрасываем слайдеры
         self.reset_sliders()
 
         # Обновляем информацию о файле
         if self.current_image_path:
-            self.update_file_info_from_path(self.current_image_path)
+            self.update_file_info_from_path(self.current_image_path, pixmap.size())
 
         # Обновляем историю
         self.update_history_ui()
@@ -3011,28 +4073,59 @@ class GraphicsEditor(QMainWindow):
         self.progress_bar.setVisible(False)
         self.status_bar.showMessage(
             f"Загружено: {os.path.basename(self.current_image_path)}"
+            + (" (вне памяти)" if self.large_image is not None else "")
         )
 
+    def on_jobs_changed(self, count):
+        """Показывает состояние очереди задач обработки"""
+        self.progress_bar.setVisible(count > 0)
+        self.cancel_jobs_button.setVisible(count > 0)
+        if count > 1:
+            self.status_bar.showMessage(f"Задач в очереди: {count}")
+
+    def cancel_processing(self):
+        """Отменяет все фоновые задачи обработки"""
+        if not self.jobs.pending_count():
+            return
+        self.jobs.cancel()
+        self.canvas.hide_loading_preview()
+        self.status_bar.showMessage("Обработка отменена")
+
+    def on_job_failed(self, lane, error_msg):
+        """Задача очереди не запустилась или не смогла выдать результат"""
+        self.on_processing_error(error_msg)
+
+    def on_background_job_failed(self, lane, error_msg):
+        """Сбой фоновой задачи (миниатюры, предзагрузка) - только в статусе"""
+        self.status_bar.showMessage(f"Ошибка фоновой задачи: {error_msg}", 5000)
+
     def on_processing_error(self, error_msg):
         """Обработчик ошибок при обработке изображения"""
         self.progress_bar.setVisible(False)
+        self.canvas.hide_loading_preview()
         QMessageBox.critical(
             self, "Ошибка", f"Ошибка обработки изображения: {error_msg}"
         )
 
-    def update_file_info_from_path(self, file_path):
-        """Обновляет информацию о файле по пути"""
+    def update_file_info_from_path(self, file_path, size=None):
+        """Обновляет информацию о файле по пути.
+
+        Размер изображения берется из size (уже загруженное изображение) или
+        из кэша миниатюр; файл открывается, только если его там нет.
+        """
         try:
             file_info = os.stat(file_path)
             file_size = file_info.st_size / (1024 * 1024)  # В мегабайтах
 
             # Получаем размеры изображения
-            with Image.open(file_path) as img:
-                width, height = img.size
+            if size is None:
+                if file_path in self.image_sizes:
+                    size = QSize(*self.image_sizes[file_path])
+                else:
+                    with Image.open(file_path) as img:
+                        size = QSize(*img.size)
 
-            self.update_file_info(
-                os.path.basename(file_path), QSize(width, height), file_size
-            )
+            self.update_file_info(os.path.basename(file_path), size, file_size)
 
         except Exception as e:
             print(f"Ошибка получения информации о файле: {e}")
@@ -3053,6 +4146,8 @@ class GraphicsEditor(QMainWindow):
 
     def save_image(self):
         """Сохраняет изображение"""
+        if not self.check_loaded():
+            return
         if not self.canvas.image:
             QMessageBox.warning(
                 self, "Предупреждение", "Нет изображения для сохранения"
@@ -3061,20 +4156,15 @@ class GraphicsEditor(QMainWindow):
 
         if self.current_image_path:
             # Сохраняем в тот же файл
-            try:
-                self.canvas.image.save(self.current_image_path)
-                self.status_bar.showMessage(
-                    f"Сохранено: {os.path.basename(self.current_image_path)}"
-                )
-                QMessageBox.information(self, "Успех", "Изображение успешно сохранено")
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Ошибка сохранения: {e}")
+            self.export_image(self.current_image_path)
         else:
             # Если файл новый, вызываем "Сохранить как"
             self.save_image_as()
 
     def save_image_as(self):
         """Сохраняет изображение с выбором имени"""
+        if not self.check_loaded():
+            return
         if not self.canvas.image:
             QMessageBox.warning(
                 self, "Предупреждение", "Нет изображения для сохранения"
@@ -3089,27 +4179,62 @@ class GraphicsEditor(QMainWindow):
         )
 
         if file_path:
-            try:
-                self.canvas.image.save(file_path)
-                self.current_image_path = file_path
-                self.status_bar.showMessage(f"Сохранено: {os.path.basename(file_path)}")
-                QMessageBox.information(self, "Успех", "Изображение успешно сохранено")
+            # Новый путь становится текущим только после успешной записи
+            job = self.export_image(file_path)
+            job.finished.connect(self.on_saved_as)
 
-                # Обновляем информацию о файле
-                self.update_file_info_from_path(file_path)
+    def export_image(self, file_path, image_format=None, **options):
+        """Записывает снимок изображения в файл в фоновом потоке.
 
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Ошибка сохранения: {e}")
+        Редактирование можно продолжать: задача работает с копией холста,
+        а файл заменяется только после успешной записи.
+        """
+        if self.large_image is not None:
+            # Хранилище меняют задачи холста - запись встает в их очередь
+            job = ExportJob(self.large_image, file_path, image_format, **options)
+            lane = "canvas"
+        else:
+            # Записывается изображение вместе со слоями
+            job = ExportJob(
+                self.canvas.composed_image().toImage(),
+                file_path,
+                image_format,
+                **options,
+            )
+            lane = "export"
+        job.progress.connect(self.progress_bar.setValue)
+        job.finished.connect(self.on_image_exported)
+        job.error.connect(self.on_export_error)
+        self.jobs.submit(job, lane)
+        self.status_bar.showMessage(f"Сохранение: {os.path.basename(file_path)}...")
+        return job
+
+    def on_image_exported(self, file_path):
+        """Обработчик завершения записи файла"""
+        self.status_bar.showMessage(f"Сохранено: {os.path.basename(file_path)}")
+        if file_path == self.current_image_path:
+            # Обновляем информацию о файле
+            self.update_file_info_from_path(file_path, self.canvas.image.size())
+
+    def on_saved_as(self, file_path):
+        """Файл, записанный через "Сохранить как", становится текущим"""
+        self.current_image_path = file_path
+        self.update_file_info_from_path(file_path, self.canvas.image.size())
+
+    def on_export_error(self, error_msg):
+        """Обработчик ошибки записи файла"""
+        QMessageBox.critical(self, "Ошибка", f"Ошибка сохранения: {error_msg}")
 
     def auto_save(self):
         """Автоматическое сохранение"""
+        if self.large_image is not None or self.jobs.is_busy("export"):
+            # Копия в несколько гигабайт по таймеру не нужна, а прежняя
+            # запись еще не закончена
+            return
         if self.settings["auto_save"] and self.current_image_path:
             backup_path = self.current_image_path + ".backup"
-            try:
-                self.canvas.image.save(backup_path)
-                self.status_bar.showMessage("Автосохранение выполнено", 2000)
-            except Exception as e:
-                print(f"Ошибка автосохранения: {e}")
+            extension = os.path.splitext(self.current_image_path)[1]
+            self.export_image(backup_path, extension.lstrip(".").upper() or "PNG")
 
     def set_tool(self, tool):
         """Устанавливает текущий инструмент"""
@@ -3135,6 +4260,8 @@ class GraphicsEditor(QMainWindow):
 
     def copy_selection(self):
         """Копирует выделенную область"""
+        if not self.check_loaded():
+            return
         if self.canvas.copy_selected_area():
             self.status_bar.showMessage(
                 "Область скопирована в буфер обмена (системный и внутренний)"
@@ -3155,6 +4282,8 @@ class GraphicsEditor(QMainWindow):
 
     def paste_from_clipboard(self):
         """Вставляет из буфера обмена"""
+        if not self.check_editable():
+            return
         if self.canvas.paste_from_clipboard():
             self.status_bar.showMessage("Изображение вставлено из буфера обмена")
             self.fragment_status_label.setText("Фрагмент: вставлен")
@@ -3175,10 +4304,12 @@ class GraphicsEditor(QMainWindow):
     def update_history_ui(self):
         """Обновляет интерфейс истории"""
         total_steps = len(self.canvas.history)
-        current_pos = self.canvas.history_index + 1
+        current_pos = self.canvas.history.index + 1
+        memory_mb = self.canvas.history.memory_usage() / (1024 * 1024)
 
         self.history_label.setText(f"Шагов в истории: {total_steps}")
         self.history_position_label.setText(f"Текущая позиция: {current_pos}")
+        self.history_memory_label.setText(f"Память истории: {memory_mb:.1f} МБ")
 
         # Обновляем состояние кнопок
         can_undo = self.canvas.can_undo()
@@ -3214,6 +4345,14 @@ class GraphicsEditor(QMainWindow):
                 f"background-color: {color.name()}; border: 1px solid gray;"
             )
 
+    def change_fill_options(self):
+        """Передает параметры заливки на холст"""
+        self.canvas.set_fill_options(
+            self.fill_tolerance_spin.value(),
+            self.fill_connectivity_combo.currentData(),
+            self.fill_selection_check.isChecked(),
+        )
+
     def choose_gradient_start_color(self):
         """Выбирает начальный цвет градиента"""
         color = QColorDialog.getColor()
@@ -3226,6 +4365,10 @@ class GraphicsEditor(QMainWindow):
         if color.isValid():
             self.canvas.gradient_end_color = color
 
+    def change_gradient_type(self, index):
+        """Изменяет тип градиента"""
+        self.canvas.set_gradient_type(self.gradient_type_combo.itemData(index))
+
     def load_stamp_pattern(self):
         """Загружает паттерн для штампа"""
         file_path, _ = QFileDialog.getOpenFileName(
@@ -3257,6 +4400,8 @@ class GraphicsEditor(QMainWindow):
 
     def add_text(self):
         """Добавляет текст на изображение"""
+        if not self.check_editable():
+            return
         text = self.text_input.text()
         if text and self.canvas.image:
             # Добавляем текст в центр изображения, если инструмент не активен
@@ -3275,20 +4420,238 @@ class GraphicsEditor(QMainWindow):
         else:
             QMessageBox.warning(self, "Предупреждение", "Введите текст для добавления")
 
+    def update_layers_ui(self):
+        """Обновляет список слоев и элементы их настройки"""
+        canvas = self.canvas
+        self.layers_list.blockSignals(True)
+        self.layers_list.clear()
+        for layer in reversed(canvas.layers.layers):
+            item = QListWidgetItem(layer.name)
+            item.setFlags(item.flags() | Qt.ItemFlag.ItemIsUserCheckable)
+            item.setCheckState(
+                Qt.CheckState.Checked if layer.visible else Qt.CheckState.Unchecked
+            )
+            self.layers_list.addItem(item)
+        self.layers_list.addItem(QListWidgetItem("Фон"))
+
+        row = len(canvas.layers)
+        if canvas.active_layer in canvas.layers.layers:
+            row -= canvas.layers.layers.index(canvas.active_layer) + 1
+        self.layers_list.setCurrentRow(row)
+        self.layers_list.blockSignals(False)
+        self.update_layer_controls()
+
+    def layer_for_row(self, row):
+        """Слой строки списка (None - фон)"""
+        layers = self.canvas.layers.layers
+        if 0 <= row < len(layers):
+            return layers[len(layers) - 1 - row]
+        return None
+
+    def update_layer_controls(self):
+        """Показывает непрозрачность и режим активного слоя"""
+        layer = self.canvas.active_layer
+        self.layer_opacity_slider.setEnabled(layer is not None)
+        self.layer_blend_combo.setEnabled(layer is not None)
+        if layer is None:
+            return
+        self.layer_opacity_slider.blockSignals(True)
+        self.layer_opacity_slider.setValue(round(layer.opacity * 100))
+        self.layer_opacity_slider.blockSignals(False)
+        self.layer_blend_combo.blockSignals(True)
+        self.layer_blend_combo.setCurrentIndex(
+            self.layer_blend_combo.findData(layer.blend_mode)
+        )
+        self.layer_blend_combo.blockSignals(False)
+
+    def on_layer_selected(self, row):
+        """Выбранный слой становится активным: в него рисуют кисти"""
+        self.canvas.active_layer = self.layer_for_row(row)
+        self.update_layer_controls()
+
+    def on_layer_visibility_changed(self, item):
+        layer = self.layer_for_row(self.layers_list.row(item))
+        if layer is not None:
+            self.canvas.change_layer(
+                layer, visible=item.checkState() == Qt.CheckState.Checked
+            )
+            self.update_history_ui()
+
+    def change_layer_opacity(self, value):
+        layer = self.canvas.active_layer
+        if layer is not None:
+            self.canvas.change_layer(layer, opacity=value / 100)
+            self.update_history_ui()
+
+    def change_layer_blend_mode(self, index):
+        layer = self.canvas.active_layer
+        if layer is not None:
+            self.canvas.change_layer(
+                layer, blend_mode=self.layer_blend_combo.itemData(index)
+            )
+            self.update_history_ui()
+
+    def add_empty_layer(self):
+        """Добавляет прозрачный слой размером с изображение"""
+        if not self.check_editable():
+            return
+        image = QImage(
+            self.canvas.image.size(), QImage.Format.Format_ARGB32_Premultiplied
+        )
+        image.fill(Qt.GlobalColor.transparent)
+        # Новый слой размером с изображение сразу выбран для рисования
+        self.canvas.add_layer(
+            Layer(image, name=f"Слой {len(self.canvas.layers) + 1}"), activate=True
+        )
+        self.update_history_ui()
+
+    def delete_layer(self):
+        if not self.check_loaded():
+            return
+        if self.canvas.active_layer is not None:
+            self.canvas.remove_layer(self.canvas.active_layer)
+            self.update_history_ui()
+
+    def move_layer(self, step):
+        if not self.check_loaded():
+            return
+        if self.canvas.active_layer is not None:
+            self.canvas.reorder_layer(self.canvas.active_layer, step)
+            self.update_history_ui()
+
+    def flatten_layers(self):
+        """Сводит слои с изображением"""
+        if not self.check_loaded():
+            return
+        if len(self.canvas.layers):
+            self.canvas.flatten_layers()
+            self.update_history_ui()
+            self.status_bar.showMessage("Слои сведены")
+
     def change_brightness(self, value):
         """Изменяет яркость"""
         self.brightness = value / 100.0
         self.brightness_label.setText(f"{value}%")
+        self.schedule_filter_preview()
 
     def change_contrast(self, value):
         """Изменяет контрастность"""
         self.contrast = value / 100.0
         self.contrast_label.setText(f"{value}%")
+        self.schedule_filter_preview()
 
     def change_saturation(self, value):
         """Изменяет насыщенность"""
         self.saturation = value / 100.0
         self.saturation_label.setText(f"{value}%")
+        self.schedule_filter_preview()
+
+    def filter_values(self):
+        """Возвращает текущие значения базовых фильтров"""
+        return (self.brightness, self.contrast, self.saturation)
+
+    def schedule_filter_preview(self):
+        """Планирует обновление предпросмотра фильтров.
+
+        События слайдеров объединяются: пока таймер активен, новые значения
+        просто запоминаются, а обрабатывается только последнее.
+        """
+        self.filters_result = None
+        if not self.live_preview_check.isChecked():
+            return
+        if not self.preview_timer.isActive():
+            self.preview_timer.start()
+
+    def update_filter_preview(self):
+        """Показывает фильтры на уменьшенной копии холста"""
+        display_pixmap = self.canvas.display_pixmap
+        if display_pixmap is None:
+            return
+
+        if self.filter_values() == (1.0, 1.0, 1.0):
+            self.canvas.show_preview(None)
+            return
+
+        # Уменьшенная копия берется из кэша отображения холста
+        if (
+            self.preview_source is None
+            or self.preview_source[0] != display_pixmap.cacheKey()
+        ):
+            qimg = display_pixmap.toImage().convertToFormat(
+                QImage.Format.Format_RGBA8888
+            )
+            self.preview_source = (
+                display_pixmap.cacheKey(),
+                qimage_to_array(qimg).copy(),
+            )
+
+        result = image_engine.enhance(self.preview_source[1], *self.filter_values())
+        preview = array_to_qimage(result, QImage.Format.Format_RGBA8888)
+        self.canvas.show_preview(QPixmap.fromImage(preview))
+
+    def render_filters_full(self):
+        """Рассчитывает фильтры в полном разрешении после отпускания слайдера"""
+        if (
+            not self.live_preview_check.isChecked()
+            or not self.has_processing_source()
+            or self.canvas.loading_pixmap is not None
+            or self.filter_values() == (1.0, 1.0, 1.0)
+            or self.large_image is not None
+        ):
+            return
+
+        values = self.filter_values()
+        image_key = self.canvas.image.cacheKey()
+
+        self.filters_processor = self.create_processor(
+            "filters",
+            brightness=self.brightness,
+            contrast=self.contrast,
+            saturation=self.saturation,
+        )
+        self.filters_processor.finished.connect(
+            lambda pixmap: self.on_filters_rendered(values, image_key, pixmap)
+        )
+        self.jobs.submit(self.filters_processor, "preview", supersede=True)
+
+    def on_filters_rendered(self, values, image_key, pixmap):
+        """Запоминает готовый результат фильтров для мгновенного применения"""
+        if values == self.filter_values():
+            self.filters_result = (values, image_key, pixmap)
+
+    def canvas_snapshot(self):
+        """Возвращает копию холста для задачи обработки.
+
+        Для изображения вне памяти задача получает само хранилище.
+        """
+        if self.large_image is not None:
+            return self.large_image
+        return self.canvas.image.toImage()
+
+    def has_processing_source(self):
+        """Проверяет, есть ли изображение для потока обработки"""
+        if self.settings["canvas_pipeline"]:
+            return not self.canvas.image.isNull()
+        return bool(self.current_image_path)
+
+    def create_processor(self, operation, **kwargs):
+        """Создает поток обработки для текущего изображения"""
+        if self.settings["canvas_pipeline"]:
+            # Снимок холста делается при запуске задачи, а не при постановке в
+            # очередь: так несколько эффектов подряд применяются друг за другом.
+            # QImage можно безопасно читать из рабочего потока
+            return ImageProcessor(
+                image_source=self.canvas_snapshot,
+                operation=operation,
+                use_processes=self.settings["process_pool"],
+                **kwargs,
+            )
+        return ImageProcessor(
+            self.current_image_path,
+            operation=operation,
+            use_processes=self.settings["process_pool"],
+            **kwargs,
+        )
 
     def apply_filters(self):
         """Применяет фильтры к изображению"""
@@ -3296,20 +4659,31 @@ class GraphicsEditor(QMainWindow):
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(
                 self, "Предупреждение", "Нет пути к изображению для применения фильтров"
             )
             return
 
+        # Результат уже рассчитан в полном разрешении после отпускания слайдера
+        if self.filters_result is not None:
+            values, image_key, pixmap = self.filters_result
+            if (
+                values == self.filter_values()
+                and image_key == self.canvas.image.cacheKey()
+            ):
+                self.on_filters_applied(pixmap)
+                return
+
         # Показываем прогресс-бар
         self.progress_bar.setVisible(True)
         self.progress_bar.setValue(0)
 
         # Создаем и запускаем поток обработки
-        self.processor = ImageProcessor(
-            self.current_image_path,
-            operation="filters",
+        self.processor = self.create_processor(
+            "filters",
             brightness=self.brightness,
             contrast=self.contrast,
             saturation=self.saturation,
@@ -3317,254 +4691,290 @@ class GraphicsEditor(QMainWindow):
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_filters_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
+
+    def apply_result(self, pixmap):
+        """Заменяет изображение холста результатом обработки"""
+        if self.large_image is not None:
+            # Хранилище уже изменено задачей, холст показывает его копию.
+            # История для изображения вне памяти не ведется
+            self.canvas.set_image(pixmap)
+            return
+        self.canvas.add_to_history()
+        self.canvas.image = pixmap
+        self.canvas.update_display()
 
     def on_filters_applied(self, pixmap):
         """Обработчик завершения применения фильтров"""
         if not self.canvas.image:
             return
-        self.canvas.add_to_history()
-        self.canvas.image = pixmap
-        self.canvas.update_display()
+        self.apply_result(pixmap)
         self.progress_bar.setVisible(False)
         self.status_bar.showMessage("Фильтры применены")
         self.update_history_ui()
 
+        # Фильтры применены к холсту - сбрасываем слайдеры, чтобы не
+        # применить их повторно поверх результата
+        self.filters_result = None
+        self.reset_sliders()
+
     def apply_blur(self):
         """Применяет размытие"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="blur", radius=2
-        )
+        self.processor = self.create_processor("blur", radius=2)
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_sharpen(self):
         """Применяет резкость"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(self.current_image_path, operation="sharpen")
+        self.processor = self.create_processor("sharpen")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def on_effect_applied(self, pixmap):
         """Обработчик завершения применения эффекта"""
         if not self.canvas.image:
             return
-        self.canvas.add_to_history()
-        self.canvas.image = pixmap
-        self.canvas.update_display()
+        self.apply_result(pixmap)
         self.progress_bar.setVisible(False)
         self.status_bar.showMessage("Эффект применен")
         self.update_history_ui()
 
     def remove_background(self):
         """Удаляет фон"""
+        if not self.check_loaded():
+            return
         if not self.canvas.image:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
-        # Если есть путь к файлу, используем поток обработки
-        if self.current_image_path:
+        tolerance = self.bg_tolerance_spin.value()
+        feather = self.bg_feather_spin.value()
+        edge_connected = self.bg_edge_check.isChecked()
+
+        # Если есть источник для потока обработки, используем его
+        if self.has_processing_source():
             self.progress_bar.setVisible(True)
-            self.processor = ImageProcessor(
-                self.current_image_path, operation="remove_background"
+            self.processor = self.create_processor(
+                "remove_background",
+                tolerance=tolerance,
+                feather=feather,
+                edge_connected=edge_connected,
             )
             self.processor.progress.connect(self.progress_bar.setValue)
             self.processor.finished.connect(self.on_background_removed)
             self.processor.error.connect(self.on_processing_error)
-            self.processor.start()
+            self.jobs.submit(self.processor, "canvas")
         else:
             # Если нет пути, применяем удаление фона к текущему изображению
-            self.canvas.remove_background()
+            self.canvas.remove_background(tolerance, feather, edge_connected)
             self.update_history_ui()
 
     def on_background_removed(self, pixmap):
         """Обработчик завершения удаления фона"""
         if not self.canvas.image:
             return
-        self.canvas.add_to_history()
-        self.canvas.image = pixmap
-        self.canvas.update_display()
+        self.apply_result(pixmap)
         self.progress_bar.setVisible(False)
         self.status_bar.showMessage("Фон удален")
         self.update_history_ui()
 
     def apply_unsharp_mask(self):
         """Применяет увеличение резкости"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="unsharp_mask"
-        )
+        self.processor = self.create_processor("unsharp_mask")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_noise_reduction(self):
         """Применяет шумоподавление"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="noise_reduction"
-        )
+        self.processor = self.create_processor("noise_reduction")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_grayscale(self):
         """Применяет черно-белый фильтр"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(self.current_image_path, operation="grayscale")
+        self.processor = self.create_processor("grayscale")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_noise_filter(self):
         """Применяет добавление шума"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(self.current_image_path, operation="noise")
+        self.processor = self.create_processor("noise")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_sketch_effect(self):
         """Применяет эффект рисунка"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="sketch_effect"
-        )
+        self.processor = self.create_processor("sketch_effect")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_glass_effect(self):
         """Применяет эффект стекла"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="glass_effect"
+        seed = self.glass_seed_spin.value()
+        self.processor = self.create_processor(
+            "glass_effect",
+            radius=self.glass_radius_spin.value(),
+            seed=seed or None,
         )
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_wave_effect(self):
         """Применяет эффект волн"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="wave_effect"
+        self.processor = self.create_processor(
+            "wave_effect",
+            amplitude=self.wave_amplitude_spin.value(),
+            frequency=self.wave_frequency_spin.value(),
         )
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_glow_effect(self):
         """Применяет эффект свечения"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="glow_effect"
-        )
+        self.processor = self.create_processor("glow_effect")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_shadow_effect(self):
         """Применяет эффект теней"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="shadow_effect"
-        )
+        self.processor = self.create_processor("shadow_effect")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_auto_levels(self):
         """Применяет автоуровни"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="auto_levels"
-        )
+        self.processor = self.create_processor("auto_levels")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_auto_contrast(self):
         """Применяет автоконтраст"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path, operation="auto_contrast"
-        )
+        self.processor = self.create_processor("auto_contrast")
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def apply_color_balance(self):
         """Применяет цветовой баланс"""
-        if not self.current_image_path:
+        if not self.check_loaded():
+            return
+        if not self.has_processing_source():
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
@@ -3573,9 +4983,8 @@ class GraphicsEditor(QMainWindow):
         blue_yellow = self.blue_yellow_slider.value()
 
         self.progress_bar.setVisible(True)
-        self.processor = ImageProcessor(
-            self.current_image_path,
-            operation="color_balance",
+        self.processor = self.create_processor(
+            "color_balance",
             red_cyan=red_cyan,
             green_magenta=green_magenta,
             blue_yellow=blue_yellow,
@@ -3583,7 +4992,7 @@ class GraphicsEditor(QMainWindow):
         self.processor.progress.connect(self.progress_bar.setValue)
         self.processor.finished.connect(self.on_effect_applied)
         self.processor.error.connect(self.on_processing_error)
-        self.processor.start()
+        self.jobs.submit(self.processor, "canvas")
 
     def reset_image(self):
         """Сбрасывает изображение"""
@@ -3602,6 +5011,8 @@ class GraphicsEditor(QMainWindow):
         if not self.canvas.image:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
+        if not self.check_editable():
+            return
 
         current_size = self.canvas.image.size()
         dialog = ResizeDialog(current_size, self)
@@ -3618,6 +5029,8 @@ class GraphicsEditor(QMainWindow):
         if not self.canvas.image:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
+        if not self.check_editable():
+            return
 
         self.canvas.rotate_image(angle)
         self.status_bar.showMessage(f"Изображение повернуто на {angle}°")
@@ -3627,6 +5040,8 @@ class GraphicsEditor(QMainWindow):
         if not self.canvas.image:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
+        if not self.check_editable():
+            return
 
         self.canvas.flip_image(horizontal)
         direction = "горизонтально" if horizontal else "вертикально"
@@ -3634,6 +5049,8 @@ class GraphicsEditor(QMainWindow):
 
     def show_actual_size(self):
         """Переключает режим показа в реальном размере"""
+        if not self.check_loaded():
+            return
         if not self.canvas.image:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
@@ -3660,6 +5077,8 @@ class GraphicsEditor(QMainWindow):
 
     def undo(self):
         """Отменяет последнее действие"""
+        if not self.check_loaded():
+            return
         if self.canvas.undo_action():
             self.status_bar.showMessage("Действие отменено")
             self.update_history_ui()
@@ -3668,6 +5087,8 @@ class GraphicsEditor(QMainWindow):
 
     def redo(self):
         """Повторяет отмененное действие"""
+        if not self.check_loaded():
+            return
         if self.canvas.redo_action():
             self.status_bar.showMessage("Действие повторено")
             self.update_history_ui()
@@ -3769,8 +5190,10 @@ class GraphicsEditor(QMainWindow):
             self.clipboard_status_label.setText("Буфер обмена: пуст")
 
     def eventFilter(self, source, event):
-        """Обработчик событий для горячих клавиш"""
-        if event.type() == event.Type.KeyPress:
+        """Обработчик событий для горячих клавиш и размера списка файлов"""
+        if event.type() == event.Type.Resize and source is self.file_list.viewport():
+            self.thumbnail_timer.start()
+        elif event.type() == event.Type.KeyPress:
             # Ctrl+Shift+C для копирования
             if (
                 event.modifiers()
@@ -3798,6 +5221,8 @@ class GraphicsEditor(QMainWindow):
 
     def convert_to_ico(self):
         """Конвертирует изображение в ICO формат с высоким качеством"""
+        if not self.check_loaded():
+            return
         if not self.canvas.image:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
@@ -3820,143 +5245,13 @@ class GraphicsEditor(QMainWindow):
         )
 
         if file_path:
-            try:
-                # Показываем прогресс
-                self.progress_bar.setVisible(True)
-                self.progress_bar.setValue(0)
-
-                # Конвертируем QPixmap в высококачественный PIL Image
-                qimg = self.canvas.image.toImage()
-
-                # Конвертируем в формат RGB или RGBA с правильным порядком байтов
-                if qimg.hasAlphaChannel():
-                    # Конвертируем в RGBA
-                    qimg = qimg.convertToFormat(QImage.Format.Format_RGBA8888)
-                    width, height = qimg.width(), qimg.height()
-                    ptr = qimg.bits()
-                    ptr.setsize(qimg.sizeInBytes())
-                    arr = np.array(ptr).reshape(height, width, 4)
-                    pil_img = Image.fromarray(arr, "RGBA")
-                else:
-                    # Конвертируем в RGB
-                    qimg = qimg.convertToFormat(QImage.Format.Format_RGB888)
-                    width, height = qimg.width(), qimg.height()
-                    ptr = qimg.bits()
-                    ptr.setsize(qimg.sizeInBytes())
-                    arr = np.array(ptr).reshape(height, width, 3)
-                    pil_img = Image.fromarray(arr, "RGB")
-                    # Добавляем альфа-канал для лучшей совместимости
-                    pil_img = pil_img.convert("RGBA")
-
-                self.progress_bar.setValue(20)
-
-                # Создаем список изображений разных размеров с высоким качеством
-                icon_images = []
-                total_sizes = len(selected_sizes)
-
-                for i, size in enumerate(selected_sizes):
-                    # Вычисляем наилучший метод масштабирования
-                    if size <= 48:
-                        # Для маленьких иконок используем более четкий алгоритм
-                        resample = (
-                            Image.Resampling.NEAREST
-                            if size <= 16
-                            else Image.Resampling.BOX
-                        )
-                    else:
-                        # Для больших иконок используем качественное масштабирование
-                        resample = Image.Resampling.LANCZOS
-
-                    # Изменяем размер с сохранением пропорций и качества
-                    if pil_img.width != pil_img.height:
-                        # Если изображение не квадратное, сначала подгоняем под квадрат
-                        max_side = max(pil_img.width, pil_img.height)
-
-                        # Создаем квадратное изображение с прозрачным фоном
-                        square_img = Image.new(
-                            "RGBA", (max_side, max_side), (0, 0, 0, 0)
-                        )
-
-                        # Вычисляем позицию для центрирования
-                        paste_x = (max_side - pil_img.width) // 2
-                        paste_y = (max_side - pil_img.height) // 2
-
-                        # Вставляем оригинальное изображение в центр
-                        square_img.paste(
-                            pil_img,
-                            (paste_x, paste_y),
-                            pil_img if pil_img.mode == "RGBA" else None,
-                        )
-
-                        # Теперь масштабируем квадратное изображение
-                        resized_img = square_img.resize((size, size), resample)
-                    else:
-                        # Изображение уже квадратное
-                        resized_img = pil_img.resize((size, size), resample)
-
-                    # Оптимизируем цветовую палитру для маленьких иконок
-                    if size <= 48 and resized_img.mode == "RGBA":
-                        # Для маленьких иконок квантуем цвета для лучшего отображения
-                        # Конвертируем в P режим с альфой для лучшего сжатия
-                        try:
-                            # Создаем оптимизированную палитру
-                            alpha = resized_img.split()[-1]  # Извлекаем альфа-канал
-                            rgb_img = resized_img.convert("RGB")
-                            # Квантуем до 255 цветов, оставляя место для прозрачности
-                            quantized = rgb_img.quantize(
-                                colors=255, method=Image.Quantize.MEDIANCUT
-                            )
-                            quantized = quantized.convert("RGBA")
-                            # Применяем альфа-канал обратно
-                            quantized.putalpha(alpha)
-                            resized_img = quantized
-                        except:
-                            # Если квантизация не удалась, оставляем как есть
-                            pass
-
-                    icon_images.append(resized_img)
-
-                    # Обновляем прогресс
-                    progress = 20 + (60 * (i + 1) // total_sizes)
-                    self.progress_bar.setValue(progress)
-
-                self.progress_bar.setValue(85)
-
-                # Сохраняем как ICO файл с максимальным качеством
-                save_kwargs = {
-                    "format": "ICO",
-                    "sizes": [(img.width, img.height) for img in icon_images],
-                }
-
-                # Добавляем дополнительные изображения только если их больше одного
-                if len(icon_images) > 1:
-                    save_kwargs["append_images"] = icon_images[1:]
-
-                # Сохраняем с оптимальными настройками
-                icon_images[0].save(file_path, **save_kwargs)
-
-                self.progress_bar.setValue(100)
-
-                self.status_bar.showMessage(
-                    f"ICO файл сохранен: {os.path.basename(file_path)}"
-                )
-                QMessageBox.information(
-                    self,
-                    "Успех",
-                    f"Изображение успешно конвертировано в ICO формат высокого качества!\n"
-                    f"Размеры иконок: {', '.join(f'{s}×{s}' for s in selected_sizes)}\n"
-                    f"Алгоритм: адаптивное масштабирование с сохранением цветов\n"
-                    f"Файл: {os.path.basename(file_path)}",
-                )
-
-                self.progress_bar.setVisible(False)
-
-            except Exception as e:
-                self.progress_bar.setVisible(False)
-                QMessageBox.critical(self, "Ошибка", f"Ошибка конвертации в ICO: {e}")
+            # Иконки всех размеров готовит общий модуль операций в фоне
+            self.export_image(file_path, "ICO", sizes=selected_sizes)
 
     def convert_to_png(self):
         """Конвертирует изображение в PNG формат"""
+        if not self.check_loaded():
+            return
         if not self.canvas.image:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
@@ -3966,25 +5261,17 @@ class GraphicsEditor(QMainWindow):
         )
 
         if file_path:
-            try:
-                self.canvas.image.save(file_path, "PNG")
-                self.status_bar.showMessage(
-                    f"PNG файл сохранен: {os.path.basename(file_path)}"
-                )
-                QMessageBox.information(
-                    self, "Успех", "Изображение успешно конвертировано в PNG формат!"
-                )
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Ошибка конвертации в PNG: {e}")
+            self.export_image(file_path, "PNG")
 
     def convert_to_jpg(self):
         """Конвертирует изображение в JPEG формат"""
+        if not self.check_loaded():
+            return
         if not self.canvas.image:
             QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
             return
 
         # Диалог настроек JPEG
-        quality, ok = QSpinBox().value(), True
         quality_dialog = QDialog(self)
         quality_dialog.setWindowTitle("Настройки JPEG")
         quality_dialog.setModal(True)
@@ -4014,33 +5301,53 @@ class GraphicsEditor(QMainWindow):
         )
 
         if file_path:
-            try:
-                # Конвертируем в RGB если есть альфа-канал
-                qimg = self.canvas.image.toImage()
-                if qimg.hasAlphaChannel():
-                    # Создаем белый фон для JPEG
-                    rgb_image = QImage(qimg.size(), QImage.Format.Format_RGB888)
-                    rgb_image.fill(Qt.GlobalColor.white)
-
-                    painter = QPainter(rgb_image)
-                    painter.drawImage(0, 0, qimg)
-                    painter.end()
-
-                    pixmap = QPixmap.fromImage(rgb_image)
-                else:
-                    pixmap = self.canvas.image
+            # Прозрачные области получают белый фон при записи
+            self.export_image(file_path, "JPEG", quality=quality)
 
-                pixmap.save(file_path, "JPEG", quality)
-                self.status_bar.showMessage(
-                    f"JPEG файл сохранен: {os.path.basename(file_path)}"
-                )
-                QMessageBox.information(
-                    self,
-                    "Успех",
-                    f"Изображение успешно конвертировано в JPEG формат!\nКачество: {quality}%",
-                )
-            except Exception as e:
-                QMessageBox.critical(self, "Ошибка", f"Ошибка конвертации в JPEG: {e}")
+    def export_with_profile(self):
+        """Экспортирует изображение с профилем кодировщика (PNG, JPEG, WebP, AVIF)"""
+        if not self.check_loaded():
+            return
+        if not self.canvas.image:
+            QMessageBox.warning(self, "Предупреждение", "Сначала загрузите изображение")
+            return
+
+        dialog = ExportProfileDialog(self.compare_export_presets, self)
+        if dialog.exec() != QDialog.DialogCode.Accepted:
+            return
+        image_format, preset = dialog.get_profile()
+
+        extension = image_export.FORMATS[image_format]
+        file_path, _ = QFileDialog.getSaveFileName(
+            self,
+            f"Сохранить как {image_format}",
+            "",
+            f"{image_format} файлы (*{extension});;Все файлы (*.*)",
+        )
+
+        if file_path:
+            options = image_export.export_options(
+                preset, image_format, self.source_metadata()
+            )
+            self.export_image(file_path, image_format, **options)
+
+    def compare_export_presets(self, image_format):
+        """Сравнивает профили экспорта на текущем изображении в фоне"""
+        job = PresetComparisonJob(
+            self.canvas.composed_image().toImage(),
+            image_format,
+            self.source_metadata(),
+        )
+        job.progress.connect(self.progress_bar.setValue)
+        # Отдельная полоса: сравнение не задерживает запись файлов
+        self.jobs.submit(job, "compare", supersede=True)
+        return job
+
+    def source_metadata(self):
+        """EXIF и профиль ICC открытого файла"""
+        if not self.current_image_path:
+            return {}
+        return image_export.read_metadata(self.current_image_path)
 
     def dragEnterEvent(self, event):
         """Обработчик входа перетаскиваемых данных в главное окно"""
@@ -4096,6 +5403,16 @@ class GraphicsEditor(QMainWindow):
                 event.ignore()
                 return
 
+        # Дожидаемся записи файлов, чтобы не потерять сохранение
+        while self.jobs.is_busy("export") or (
+            self.large_image is not None and self.jobs.is_busy("canvas")
+        ):
+            QApplication.processEvents(QEventLoop.ProcessEventsFlag.WaitForMoreEvents)
+
+        self.jobs.shutdown()
+        self.background_jobs.shutdown()
+        image_parallel.shutdown()
+        self.set_large_image(None)
         event.accept()
 
 